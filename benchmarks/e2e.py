@@ -0,0 +1,222 @@
+"""
+times the `user` and `archive` commands end to end against a local Reddit stand-in
+
+    python -m benchmarks.e2e --sizes 10000,100000 --latency 0.05
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+import click
+from click.testing import CliRunner
+
+from benchmarks.stand_in import RedditStandIn
+from benchmarks.synthetic import USERNAME, write_archive
+from reddit_user_to_sqlite.cli import cli
+from reddit_user_to_sqlite.metrics import format_bytes
+
+DEFAULT_SIZES = "10000"
+
+
+def run_command(
+    args: list[str], stand_in: RedditStandIn, work_dir: Path, track_memory=False
+) -> dict[str, Any]:
+    """
+    runs a single cli command in-process and returns how it went, including the
+    command's own `--metrics-json` report
+    """
+    if track_memory:
+        args = [*args, "--track-memory"]
+    metrics_path = work_dir / "metrics.json"
+    requests_before = stand_in.requests_served
+
+    start = time.perf_counter()
+    result = CliRunner().invoke(
+        cli,
+        [*args, "--metrics-json", str(metrics_path)],
+        env={
+            "REDDIT_BASE_URL": stand_in.base_url,
+            "DISABLE_PROGRESS": "1",
+            # the stand-in is local; don't let a system proxy get in the way
+            "NO_PROXY": "127.0.0.1",
+        },
+    )
+    seconds = time.perf_counter() - start
+
+    if result.exception:
+        raise click.ClickException(
+            f"`{' '.join(args)}` failed: {result.exception!r}\n{result.output}"
+        )
+
+    return {
+        "command": args[0],
+        "seconds": seconds,
+        "requests_served": stand_in.requests_served - requests_before,
+        "metrics": json.loads(metrics_path.read_text()),
+    }
+
+
+def run_suite(
+    sizes: list[int],
+    latency: float,
+    missing_rate: float,
+    requests_per_window: int,
+    window_seconds: float,
+    listing_size: int,
+    work_dir: Path,
+    track_memory=False,
+) -> list[dict[str, Any]]:
+    results = []
+    with RedditStandIn(
+        latency=latency,
+        requests_per_window=requests_per_window,
+        window_seconds=window_seconds,
+        missing_rate=missing_rate,
+        listing_size=listing_size,
+    ) as stand_in:
+        user_db = work_dir / "user.db"
+        results.append(
+            {
+                "size": listing_size * 2,
+                **run_command(
+                    ["user", USERNAME, "--db", str(user_db)],
+                    stand_in,
+                    work_dir,
+                    track_memory=track_memory,
+                ),
+            }
+        )
+
+        for size in sizes:
+            archive_path = write_archive(work_dir / f"archive-{size}", size)
+            db_path = work_dir / f"archive-{size}.db"
+            results.append(
+                {
+                    "size": size,
+                    **run_command(
+                        ["archive", str(archive_path), "--db", str(db_path)],
+                        stand_in,
+                        work_dir,
+                        track_memory=track_memory,
+                    ),
+                }
+            )
+
+    return results
+
+
+def format_results(results: list[dict[str, Any]]) -> str:
+    lines = [
+        f"{'command':<8} {'ids':>9} {'seconds':>9} {'ids/sec':>9} {'requests':>9} {'rows':>9}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['command']:<8} {r['size']:>9} {r['seconds']:>9.2f} {r['size'] / r['seconds']:>9.0f} {r['requests_served']:>9} {r['metrics']['rows_written']:>9}"
+        )
+
+    lines.append("\nstage seconds:")
+    for r in results:
+        stages = ", ".join(
+            f"{name} {s['seconds']:.2f}" for name, s in r["metrics"]["stages"].items()
+        )
+        lines.append(f"{r['command']:<8} {r['size']:>9}  {stages}")
+
+    if any("memory" in r["metrics"] for r in results):
+        lines.append("\nstage peak memory:")
+        for r in results:
+            stages = ", ".join(
+                f"{name} {format_bytes(s['peak_bytes']) if 'peak_bytes' in s else 'n/a'}"
+                for name, s in r["metrics"]["stages"].items()
+            )
+            memory = r["metrics"]["memory"]
+            lines.append(
+                f"{r['command']:<8} {r['size']:>9}  {stages}; overall {format_bytes(memory['peak_traced_bytes'])}"
+            )
+
+    return "\n".join(lines)
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default=DEFAULT_SIZES,
+    show_default=True,
+    help="Comma-separated numbers of archive ids to benchmark, e.g. `10000,100000,1000000`.",
+)
+@click.option(
+    "--latency",
+    type=click.FloatRange(min=0),
+    default=0.05,
+    show_default=True,
+    help="Seconds the stand-in waits before answering each request.",
+)
+@click.option(
+    "--missing-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0.01,
+    show_default=True,
+    help="Share of ids that the stand-in acts like were deleted.",
+)
+@click.option(
+    "--requests-per-window",
+    type=click.IntRange(min=1),
+    default=1_000_000,
+    show_default=True,
+    help="Rate limit to report in the `x-ratelimit-*` headers. Runs stop early when it's used up, like they would against Reddit.",
+)
+@click.option(
+    "--window-seconds",
+    type=click.FloatRange(min=1),
+    default=600,
+    show_default=True,
+)
+@click.option(
+    "--listing-size",
+    type=click.IntRange(min=0),
+    default=1000,
+    show_default=True,
+    help="How many comments and posts the `user` listings return.",
+)
+@click.option(
+    "--track-memory",
+    is_flag=True,
+    default=False,
+    help="Also record the peak memory of each stage (slower).",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="Also write the raw results to this file as JSON.",
+)
+def main(
+    sizes: str,
+    latency: float,
+    missing_rate: float,
+    requests_per_window: int,
+    window_seconds: float,
+    listing_size: int,
+    track_memory: bool,
+    output: Optional[Path],
+):
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run_suite(
+            [int(s) for s in sizes.split(",")],
+            latency=latency,
+            missing_rate=missing_rate,
+            requests_per_window=requests_per_window,
+            window_seconds=window_seconds,
+            listing_size=listing_size,
+            work_dir=Path(tmp),
+            track_memory=track_memory,
+        )
+
+    click.echo(format_results(results))
+    if output:
+        output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
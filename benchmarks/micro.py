@@ -0,0 +1,155 @@
+"""
+microbenchmarks for the per-item conversion and saving hot paths, with fixed
+synthetic inputs so numbers are comparable between runs
+
+    python -m benchmarks.micro             # compare against the committed baseline
+    python -m benchmarks.micro --save      # update the baseline
+"""
+
+import json
+import timeit
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+import click
+from sqlite_utils import Database
+
+from benchmarks.synthetic import make_comment, make_id, make_post
+from reddit_user_to_sqlite.loaders import save_comments, save_posts
+from reddit_user_to_sqlite.reddit_api import decode_child
+from reddit_user_to_sqlite.sqlite_helpers import (
+    comment_to_comment_row,
+    item_to_subreddit_row,
+    items_to_rows,
+    post_to_post_row,
+)
+
+BASELINE_PATH = Path(__file__).parent / "baselines" / "micro.json"
+
+# items per benchmark call; results are reported per item
+NUM_ITEMS = 1000
+# anything this much slower than the baseline counts as a regression
+DEFAULT_THRESHOLD = 1.5
+
+# decoded, since that's what the conversion functions see
+COMMENTS = [
+    decode_child({"kind": "t1", "data": make_comment(make_id(n))})  # type: ignore
+    for n in range(NUM_ITEMS)
+]
+POSTS = [
+    decode_child({"kind": "t3", "data": make_post(make_id(n))})  # type: ignore
+    for n in range(NUM_ITEMS)
+]
+
+
+def _save_benchmark(
+    save: Callable[[Database, list[Any]], int], items: list[Any]
+) -> Callable[[], Any]:
+    # the first call creates the tables, later ones are updates of existing rows,
+    # which is what repeat runs do
+    db = Database(memory=True)
+    save(db, items)
+    return lambda: save(db, items)
+
+
+def benchmarks() -> dict[str, Callable[[], Any]]:
+    return {
+        "comment_to_comment_row": lambda: [comment_to_comment_row(c) for c in COMMENTS],
+        "post_to_post_row": lambda: [post_to_post_row(p) for p in POSTS],
+        "item_to_subreddit_row": lambda: [item_to_subreddit_row(c) for c in COMMENTS],
+        # the single pass that every saved batch goes through
+        "items_to_rows": lambda: items_to_rows(
+            COMMENTS, comment_to_comment_row, ("bench_user", "t2_b3nch")
+        ),
+        # everything the loaders do to write a batch: users, subreddits and items
+        "save_comments": _save_benchmark(save_comments, COMMENTS),
+        "save_posts": _save_benchmark(save_posts, POSTS),
+    }
+
+
+def run_benchmarks(
+    repeat: int = 5, only: Optional[list[str]] = None
+) -> dict[str, float]:
+    """
+    returns the best time of `repeat` runs for each benchmark, in microseconds per item
+    """
+    results = {}
+    for name, func in benchmarks().items():
+        if only and name not in only:
+            continue
+        timer = timeit.Timer(func)
+        # aim for each sample taking at least 0.2 seconds, so it's not all noise
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=repeat, number=number)) / number
+        results[name] = best / NUM_ITEMS * 1_000_000
+    return results
+
+
+def compare(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> tuple[str, list[str]]:
+    """
+    returns a report of `results` next to `baseline`, plus the names of any
+    benchmarks that regressed past `threshold`
+    """
+    lines = [f"{'benchmark':<28} {'us/item':>9} {'baseline':>9} {'ratio':>7}"]
+    regressions = []
+    for name, micros in results.items():
+        if name in baseline:
+            ratio = micros / baseline[name]
+            flag = "  <- slower" if ratio > threshold else ""
+            if flag:
+                regressions.append(name)
+            lines.append(
+                f"{name:<28} {micros:>9.3f} {baseline[name]:>9.3f} {ratio:>6.2f}x{flag}"
+            )
+        else:
+            lines.append(f"{name:<28} {micros:>9.3f} {'-':>9} {'-':>7}")
+    return "\n".join(lines), regressions
+
+
+@click.command()
+@click.option("--repeat", type=click.IntRange(min=1), default=5, show_default=True)
+@click.option(
+    "--only",
+    multiple=True,
+    help="Only run this benchmark. Can be given more than once.",
+)
+@click.option(
+    "--threshold",
+    type=click.FloatRange(min=1),
+    default=DEFAULT_THRESHOLD,
+    show_default=True,
+    help="Fail if any benchmark is this many times slower than the baseline.",
+)
+@click.option(
+    "--save",
+    is_flag=True,
+    default=False,
+    help="Write the results as the new baseline instead of comparing.",
+)
+def main(repeat: int, only: tuple[str, ...], threshold: float, save: bool):
+    results = run_benchmarks(repeat=repeat, only=list(only))
+
+    baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+    report, regressions = compare(results, baseline, threshold)
+    click.echo(report)
+
+    if save:
+        BASELINE_PATH.parent.mkdir(exist_ok=True)
+        BASELINE_PATH.write_text(
+            json.dumps(
+                {**baseline, **{k: round(v, 3) for k, v in results.items()}},
+                indent=2,
+            )
+            + "\n"
+        )
+        click.echo(f"\nsaved baseline to {BASELINE_PATH}")
+    elif regressions:
+        raise click.ClickException(
+            f"{len(regressions)} benchmarks regressed: {', '.join(regressions)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+a local HTTP server that answers like the handful of Reddit endpoints this package
+uses, with configurable latency and rate limit headers, and optionally OAuth
+"""
+
+import base64
+import json
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import islice
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic import USER_ID, listing, make_comment, make_post
+
+MAKE_ITEM = {"t1": make_comment, "t3": make_post}
+LISTING_KIND = {"comments": "t1", "submitted": "t3"}
+
+
+class RateLimitWindow:
+    """
+    counts requests the way Reddit does: a fixed number per window, reported through
+    the `x-ratelimit-*` headers
+    """
+
+    def __init__(self, requests_per_window: int, window_seconds: float) -> None:
+        self.requests_per_window = requests_per_window
+        self.window_seconds = window_seconds
+        self._window_start = time.monotonic()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> tuple[bool, dict[str, str]]:
+        """
+        uses up a request if one is left. Returns whether it was allowed, plus the
+        headers to send either way.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= self.window_seconds:
+                self._window_start = now
+                self._used = 0
+
+            allowed = self._used < self.requests_per_window
+            if allowed:
+                self._used += 1
+
+            return allowed, {
+                "x-ratelimit-used": str(self._used),
+                # reddit sends this one as a float
+                "x-ratelimit-remaining": f"{self.requests_per_window - self._used:.1f}",
+                "x-ratelimit-reset": str(
+                    int(self.window_seconds - (now - self._window_start))
+                ),
+            }
+
+
+class TokenIssuer:
+    """
+    hands out bearer tokens for a single app, like reddit's `/api/v1/access_token`, and
+    checks them on later requests
+    """
+
+    def __init__(
+        self, client_id: str, client_secret: str, token_lifetime: float = 3600
+    ) -> None:
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.token_lifetime = token_lifetime
+        self.grants: list[dict[str, str]] = []
+        # token -> when it expires
+        self._tokens: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def issue(self, authorization: str, form: dict[str, str]) -> tuple[int, Any]:
+        expected = base64.b64encode(
+            f"{self.client_id}:{self.client_secret}".encode()
+        ).decode()
+        if authorization != f"Basic {expected}":
+            return 401, {"message": "Unauthorized", "error": 401}
+        if form.get("grant_type") not in ("client_credentials", "password"):
+            return 200, {"error": "unsupported_grant_type"}
+
+        with self._lock:
+            self.grants.append(form)
+            token = f"token-{len(self.grants)}"
+            self._tokens[token] = time.monotonic() + self.token_lifetime
+        return 200, {
+            "access_token": token,
+            "token_type": "bearer",
+            "expires_in": self.token_lifetime,
+            "scope": "*",
+        }
+
+    def is_valid(self, authorization: Optional[str]) -> bool:
+        token = (authorization or "").removeprefix("bearer ")
+        with self._lock:
+            return self._tokens.get(token, 0) > time.monotonic()
+
+    def revoke_all(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+class RedditStandIn:
+    """
+    serves `/api/info.json`, `/user/<name>/comments.json`, `/user/<name>/submitted.json`
+    and `/user/<name>/about.json` on a random local port. Use it as a context manager;
+    `base_url` is where to point the client.
+
+    With a `client_id` and `client_secret`, it also serves `/api/v1/access_token`, and
+    every other endpoint wants one of the tokens it handed out.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        requests_per_window: int = 1_000_000,
+        window_seconds: float = 600,
+        missing_rate: float = 0.01,
+        listing_size: int = 1000,
+        client_id: Optional[str] = None,
+        client_secret: Optional[str] = None,
+        token_lifetime: float = 3600,
+    ) -> None:
+        self.latency = latency
+        self.missing_rate = missing_rate
+        self.listing_size = listing_size
+        self.rate_limit = RateLimitWindow(requests_per_window, window_seconds)
+        self.tokens = (
+            TokenIssuer(client_id, client_secret or "", token_lifetime)
+            if client_id
+            else None
+        )
+
+        self.requests_served = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def token_url(self) -> str:
+        return f"{self.base_url}/api/v1/access_token"
+
+    def __enter__(self) -> "RedditStandIn":
+        # a short poll interval means shutting down doesn't hold up every test
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def is_missing(self, fullname: str) -> bool:
+        # deterministic, so repeat runs see the same gaps
+        return zlib.crc32(fullname.encode()) % 10_000 < self.missing_rate * 10_000
+
+    def respond(self, path: str, query: dict[str, list[str]]) -> tuple[int, Any]:
+        parts = path.strip("/").split("/")
+
+        if path == "/api/info.json":
+            fullnames = query.get("id", [""])[0].split(",")
+            return 200, _listing_response(
+                [
+                    {"kind": f[:2], "data": MAKE_ITEM[f[:2]](f[3:])}
+                    for f in fullnames
+                    if f[:2] in MAKE_ITEM and not self.is_missing(f)
+                ],
+                after=None,
+            )
+
+        if len(parts) == 3 and parts[0] == "user":
+            resource = parts[2].removesuffix(".json")
+            if resource == "about":
+                return 200, {"kind": "t2", "data": {"id": USER_ID, "name": parts[1]}}
+
+            if resource in LISTING_KIND:
+                limit = int(query.get("limit", ["100"])[0])
+                start = int(query.get("after", ["0"])[0] or 0)
+                end = min(start + limit, self.listing_size)
+                page = list(islice(listing(LISTING_KIND[resource], end), start, end))
+                return 200, _listing_response(
+                    page, after=str(end) if end < self.listing_size else None
+                )
+
+        return 404, {"message": "Not Found", "error": 404}
+
+    def _handler_class(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(stand_in.latency)
+
+                if stand_in.tokens and not stand_in.tokens.is_valid(
+                    self.headers.get("authorization")
+                ):
+                    # reddit doesn't count these against the rate limit
+                    self._send(401, {"message": "Unauthorized", "error": 401}, {})
+                    return
+
+                allowed, headers = stand_in.rate_limit.take()
+                if allowed:
+                    url = urlparse(self.path)
+                    status, body = stand_in.respond(url.path, parse_qs(url.query))
+                else:
+                    status, body = 429, {"message": "Too Many Requests", "error": 429}
+
+                self._send(status, body, headers)
+
+            def do_POST(self):
+                length = int(self.headers.get("content-length", 0))
+                form = {
+                    k: v[0]
+                    for k, v in parse_qs(self.rfile.read(length).decode()).items()
+                }
+                if stand_in.tokens and self.path == "/api/v1/access_token":
+                    status, body = stand_in.tokens.issue(
+                        self.headers.get("authorization", ""), form
+                    )
+                else:
+                    status, body = 404, {"message": "Not Found", "error": 404}
+                self._send(status, body, {})
+
+            def _send(self, status: int, body: Any, headers: dict[str, str]):
+                payload = json.dumps(body).encode()
+                with stand_in._lock:
+                    stand_in.requests_served += 1
+                    stand_in.bytes_sent += len(payload)
+
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_):
+                pass
+
+        return Handler
+
+
+def _listing_response(children: list[dict[str, Any]], after: Optional[str]):
+    return {
+        "kind": "Listing",
+        "data": {
+            "after": after,
+            "before": None,
+            "dist": len(children),
+            "modhash": "",
+            "geo_filter": "",
+            "children": children,
+        },
+    }
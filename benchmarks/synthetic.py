@@ -0,0 +1,158 @@
+"""
+deterministic fake Reddit data, shaped like what the API and GDPR archives return
+"""
+
+import csv
+import zlib
+from pathlib import Path
+from typing import Any, Iterator
+
+USERNAME = "bench_user"
+USER_ID = "b3nch"
+
+# archive files, and what share of the ids each one gets
+ARCHIVE_SHARES = {
+    "comments": 0.5,
+    "posts": 0.2,
+    "saved_comments": 0.15,
+    "saved_posts": 0.15,
+}
+
+# keeps the synthetic ids the same length as real ones
+_ID_OFFSET = 36**6
+
+
+def to_base36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    while n:
+        n, remainder = divmod(n, 36)
+        result = digits[remainder] + result
+    return result or "0"
+
+
+def make_id(n: int) -> str:
+    return to_base36(_ID_OFFSET + n)
+
+
+def _seed(item_id: str) -> int:
+    return zlib.crc32(item_id.encode())
+
+
+def _subreddit(seed: int) -> dict[str, str]:
+    # a few hundred subreddits, so the subreddit upsert has real work to do
+    n = seed % 300
+    return {
+        "subreddit": f"sub_{n}",
+        "subreddit_id": f"t5_{to_base36(36**4 + n)}",
+        "subreddit_type": "public",
+    }
+
+
+def _author(item_id: str, seed: int) -> dict[str, str]:
+    # about 1 in 50 items is from a deleted account, like the real thing
+    if seed % 50 == 0:
+        return {"author": "[deleted]"}
+    return {"author": USERNAME, "author_fullname": f"t2_{USER_ID}"}
+
+
+def _unstored_fields(seed: int, text: str) -> dict[str, Any]:
+    # real API children carry dozens of fields that are never stored
+    return {
+        "body_html": f'<div class="md"><p>{text}</p></div>',
+        "all_awardings": [],
+        "treatment_tags": [],
+        "author_flair_richtext": [],
+        "gildings": {},
+        **{f"unused_field_{i}": None if i % 3 else seed for i in range(60)},
+    }
+
+
+def make_comment(item_id: str) -> dict[str, Any]:
+    seed = _seed(item_id)
+    body = f"comment {item_id} " + "lorem ipsum dolor sit amet " * (seed % 12)
+    return {
+        **_unstored_fields(seed, body),
+        "id": item_id,
+        "name": f"t1_{item_id}",
+        "created": 1_600_000_000 + seed % 100_000_000,
+        "score": seed % 500 - 20,
+        "body": body,
+        "permalink": f"/r/sub/comments/{item_id}/title/{item_id}/",
+        "is_submitter": seed % 7 == 0,
+        "controversiality": seed % 2,
+        "total_awards_received": seed % 3,
+        "gilded": 0,
+        "parent_id": f"t3_{item_id}",
+        "link_id": f"t3_{item_id}",
+        **_subreddit(seed),
+        **_author(item_id, seed),
+    }
+
+
+def make_post(item_id: str) -> dict[str, Any]:
+    seed = _seed(item_id)
+    is_link = seed % 3 == 0
+    return {
+        **_unstored_fields(seed, f"post {item_id}"),
+        "id": item_id,
+        "name": f"t3_{item_id}",
+        "created": 1_600_000_000 + seed % 100_000_000,
+        "score": seed % 2000,
+        "num_comments": seed % 150,
+        "title": f"post {item_id}",
+        "selftext": "" if is_link else "lorem ipsum dolor sit amet " * (seed % 40),
+        "url": (
+            f"https://example.com/{item_id}"
+            if is_link
+            else f"https://www.reddit.com/r/sub/comments/{item_id}/"
+        ),
+        "permalink": f"/r/sub/comments/{item_id}/title/",
+        "upvote_ratio": (seed % 100) / 100,
+        "total_awards_received": seed % 3,
+        **_subreddit(seed),
+        **_author(item_id, seed),
+    }
+
+
+def archive_ids(num_ids: int) -> dict[str, list[str]]:
+    """
+    splits `num_ids` unique ids between the archive files
+    """
+    result = {}
+    start = 0
+    for filename, share in ARCHIVE_SHARES.items():
+        count = int(num_ids * share)
+        result[filename] = [make_id(n) for n in range(start, start + count)]
+        start += count
+    return result
+
+
+def write_archive(path: Path, num_ids: int) -> Path:
+    """
+    writes a GDPR-style archive with `num_ids` ids (spread across the comment and post
+    files) into `path`
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    for filename, ids in archive_ids(num_ids).items():
+        with open(path / f"{filename}.csv", "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["id", "permalink", "date", "ip", "subreddit"])
+            writer.writerows(
+                [i, f"https://www.reddit.com/r/sub/comments/{i}/", "", "", "sub"]
+                for i in ids
+            )
+
+    with open(path / "statistics.csv", "w", encoding="utf-8") as f:
+        f.write(f"statistic,value\naccount name,{USERNAME}\n")
+
+    return path
+
+
+def listing(kind: str, num_items: int) -> Iterator[dict[str, Any]]:
+    """
+    the items in a user's `comments` (kind `t1`) or `submitted` (kind `t3`) listing
+    """
+    make = make_comment if kind == "t1" else make_post
+    for n in range(num_items):
+        yield {"kind": kind, "data": make(make_id(n))}
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional, Union
+
+from reddit_user_to_sqlite.helpers import Shard, clean_username
+from reddit_user_to_sqlite.loaders import (
+    DEFAULT_RETRY_MISSING_AFTER,
+    hydrate_parent_posts,
+    load_data_from_files,
+    load_user,
+    open_db,
+    sync_user,
+)
+from reddit_user_to_sqlite.metrics import FTS
+from reddit_user_to_sqlite.reddit_api import RedditClient
+from reddit_user_to_sqlite.sqlite_helpers import ensure_fts
+
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
+    from reddit_user_to_sqlite.metrics import Metrics
+
+
+class Archiver:
+    """
+    loads reddit data into a single database, for use from python instead of the CLI.
+
+    An `Archiver` holds on to its `RedditClient` (one HTTP session, request budget, and
+    rate limit) and its `Database` connection, so a long-running process can call it
+    over and over without reconnecting. Like the CLI, it writes from one thread at a
+    time: use it from the thread that created it.
+
+        with Archiver("reddit.db") as archiver:
+            for username in usernames:
+                archiver.load_user(username, incremental=True)
+    """
+
+    def __init__(
+        self,
+        db: Union[Database, str, Path],
+        client: Optional[RedditClient] = None,
+    ) -> None:
+        # only what the archiver opens itself is closed by `close()`; anything passed
+        # in still belongs to the caller
+        self._owns_db = isinstance(db, (str, Path))
+        self._owns_client = client is None
+        self.db = open_db(str(db)) if isinstance(db, (str, Path)) else db
+        self.client = client or RedditClient()
+
+    @property
+    def metrics(self) -> Metrics:
+        """
+        everything this archiver's client has done so far
+        """
+        return self.client.metrics
+
+    def load_user(
+        self,
+        username: str,
+        incremental=False,
+        all_sorts=False,
+        hydrate_parents=False,
+    ) -> tuple[int, int]:
+        """
+        saves a user's recent comments and posts, like the `user` command, and returns
+        how many of each were saved. If `incremental`, paging stops at the first page
+        that's already stored, which makes re-syncing a user much cheaper. `all_sorts`
+        also crawls the `top` and `controversial` listings; it reads every page of the
+        `new` listings, so it ignores `incremental`. With `hydrate_parents`, the posts
+        their comments are on are saved too.
+        """
+        username = clean_username(username)
+        if incremental and not all_sorts:
+            result = sync_user(self.db, username, self.client, incremental=True)
+        else:
+            result = load_user(self.db, username, self.client, all_sorts=all_sorts)
+
+        if hydrate_parents:
+            hydrate_parent_posts(self.db, self.client)
+
+        with self.metrics.stage(FTS):
+            ensure_fts(self.db)
+        return result
+
+    def load_archive(
+        self,
+        archive_path: Union[str, Path],
+        include_saved=True,
+        retry_missing_after: float = DEFAULT_RETRY_MISSING_AFTER,
+        shard: Optional[Shard] = None,
+        hydrate_parents=False,
+    ) -> dict[str, int]:
+        """
+        hydrates a GDPR archive, like the `archive` command, and returns how many items
+        were saved to each table. `retry_missing_after` is in seconds. With
+        `hydrate_parents`, the posts that the archive's comments are on are saved too.
+        """
+        result = load_data_from_files(
+            self.db,
+            Path(archive_path).expanduser(),
+            include_saved=include_saved,
+            client=self.client,
+            retry_missing_after=retry_missing_after,
+            shard=shard,
+        )
+
+        if hydrate_parents:
+            hydrate_parent_posts(
+                self.db, self.client, retry_missing_after=retry_missing_after
+            )
+
+        with self.metrics.stage(FTS):
+            ensure_fts(self.db)
+        return result
+
+    def close(self):
+        """
+        closes the database connection and HTTP session, if the archiver opened them
+        """
+        if self._owns_client:
+            self.client.session.close()
+        if self._owns_db:
+            self.db.close()
+
+    def __enter__(self) -> Archiver:
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,141 +1,338 @@
-from functools import partial
+from __future__ import annotations
+
+import heapq
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
 from pathlib import Path
-from typing import Callable, Iterable, Optional, TypeVar, cast
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Iterable,
+    Iterator,
+    Optional,
+    TextIO,
+)
 
 import click
-from sqlite_utils import Database
 
-from reddit_user_to_sqlite.csv_helpers import (
-    PrefixType,
-    get_username_from_archive,
-    load_unsaved_ids_from_file,
+from reddit_user_to_sqlite.export import (
+    EXPORTABLE_TABLES,
+    WRITERS,
+    ExportFormat,
+    ensure_export_index,
+    format_cursor,
+    iter_rows_after,
+    parse_cursor,
+)
+from reddit_user_to_sqlite.helpers import (
+    Shard,
+    clean_username,
+    in_shard,
+)
+from reddit_user_to_sqlite.loaders import (
+    DEFAULT_RETRY_MISSING_AFTER,
+    hydrate_parent_posts,
+    load_data_from_files,
+    load_user,
+    open_db,
+    save_comments,
+    save_posts,
+    sync_user,
+)
+from reddit_user_to_sqlite.metrics import (
+    FTS,
+    Metrics,
+)
+from reddit_user_to_sqlite.oauth import OAuthError
+from reddit_user_to_sqlite.profiling import (
+    profile_thread,
+    start_profiling,
+    stop_profiling,
+    summarize_stats,
 )
-from reddit_user_to_sqlite.helpers import clean_username, find_user_details_from_items
 from reddit_user_to_sqlite.reddit_api import (
     Comment,
     Post,
-    add_missing_user_fragment,
-    get_user_id,
+    RedditClient,
+    RedditUnavailableException,
+    RequestBudget,
+    RetryPolicy,
     load_comments_for_user,
-    load_info,
     load_posts_for_user,
 )
+from reddit_user_to_sqlite.search import (
+    DEFAULT_LIMIT,
+    MATCH_END,
+    MATCH_START,
+    SearchCursor,
+    format_search_cursor,
+    parse_search_cursor,
+    search,
+    searchable_tables,
+)
 from reddit_user_to_sqlite.sqlite_helpers import (
+    FTS_INSTRUCTIONS,
+    PARENT_POSTS_TABLE,
     ensure_fts,
-    insert_users,
-    upsert_comments,
-    upsert_posts,
-    upsert_subreddits,
+    merge_shard,
+    staged_in_memory,
 )
 
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
 
 @click.group()
 @click.version_option()
-def cli():
+@click.option(
+    "--profile",
+    "profile_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False, path_type=Path),
+    help="Profile the command with cProfile and write the stats to this file. A summary of the hottest functions is printed at the end.",
+)
+@click.pass_context
+def cli(ctx: click.Context, profile_path: Optional[Path]):
     "Save data from Reddit to a SQLite database"
+    if not profile_path:
+        return
+
+    profiler = start_profiling()
+
+    def _report():
+        stats = stop_profiling(profiler)
+        stats.dump_stats(profile_path)
+        click.echo(f"\n{summarize_stats(stats)}", err=True)
+        click.echo(
+            f"\nwrote full profile to {profile_path} (try `python -m pstats {profile_path}`)",
+            err=True,
+        )
+
+    # runs once the subcommand finishes, even if it fails
+    ctx.call_on_close(_report)
 
 
 DB_PATH_HELP = "A path to a SQLite database file. If it doesn't exist, it will be created. It can have any extension, `.db` or `.sqlite` is recommended."
 DEFAULT_DB_NAME = "reddit.db"
 
-DELETED_USERNAME = "__DeletedUser__"
-DELETED_USER_FULLNAME = "t2_1234567"
 
-T = TypeVar("T", Comment, Post)
-
-
-def _save_items(
-    db: Database,
-    items: list[T],
-    upsert_func: Callable[[Database, Iterable[T], Optional[PrefixType]], int],
-    table_prefix: Optional[PrefixType] = None,
-) -> int:
-    if not items:
-        return 0
+@contextmanager
+def open_db_for_run(db_path: str, stage_in_memory: bool) -> Iterator[Database]:
+    """
+    opens the database a loading command writes to. When staging in memory, the file at
+    `db_path` is only updated once the command succeeds.
+    """
+    if not stage_in_memory:
+        yield open_db(db_path)
+        return
 
-    insert_users(db, items)
-    upsert_subreddits(db, items)
-    return upsert_func(db, items, table_prefix)
+    with staged_in_memory(db_path) as db:
+        yield db
+    click.echo(f"\ncopied staged changes to {db_path}")
 
 
-save_comments = partial(_save_items, upsert_func=upsert_comments)
-save_posts = partial(_save_items, upsert_func=upsert_posts)
+stage_option = click.option(
+    "--stage-in-memory",
+    is_flag=True,
+    default=False,
+    help="Load everything into an in-memory copy of the database, and only write it to --db once the run succeeds. Faster on slow disks, but uses enough memory to hold the whole database.",
+)
 
 
-def load_data_from_files(
-    db: Database,
-    archive_path: Path,
-    own_data=True,
-    tables_prefix: Optional[PrefixType] = None,
-):
+def client_options(f):
     """
-    if own data is true, requires a username to save. Otherwise, will add a placeholder
-    (for external data)
+    adds the `--max-requests`, `--max-duration`, `--max-retries`, and `--timeout`
+    options, which reach the command as a `client` argument that enforces them, plus
+    `--metrics-json` and `--track-memory`, which report what the client's `Metrics`
+    recorded once the command is done. The client authenticates with OAuth if app
+    credentials are in the environment.
     """
-    new_comment_ids = load_unsaved_ids_from_file(
-        db, archive_path, "comments", prefix=tables_prefix
-    )
-    click.echo(f"\nFetching info about {'your' if own_data else 'saved'} comments")
-    comments = cast(list[Comment], load_info(new_comment_ids))
 
-    post_ids = load_unsaved_ids_from_file(
-        db, archive_path, "posts", prefix=tables_prefix
+    @click.option(
+        "--max-requests",
+        type=click.IntRange(min=0),
+        help="Stop after making this many API requests. Anything already fetched is saved; re-run to continue.",
     )
-    click.echo(f"\nFetching info about {'your' if own_data else 'saved'} posts")
-    posts = cast(list[Post], load_info(post_ids))
-
-    username = None
-    user_fullname = None
-
-    if own_data:
-        # find the username, first from any of the loaded comments/posts
-        if user_details := (
-            find_user_details_from_items(comments)
-            or find_user_details_from_items(posts)
-        ):
-            username, user_fullname = user_details
-        # if all loaded posts are removed (which could be the case on subsequent runs),
-        # then try to load from archive
-        elif username := get_username_from_archive(archive_path):
-            user_fullname = f"t2_{get_user_id(username)}"
-        # otherwise, your posts without a username won't be saved;
-        # this only happens for malformed archives
-        else:
-            click.echo(
-                "\nUnable to guess username from API content or archive; some data will not be saved.",
-                err=True,
+    @click.option(
+        "--max-duration",
+        type=click.FloatRange(min=0),
+        help="Stop making API requests after this many seconds. Anything already fetched is saved; re-run to continue.",
+    )
+    @click.option(
+        "--max-retries",
+        type=click.IntRange(min=0),
+        default=3,
+        show_default=True,
+        help="Retry requests that time out, lose their connection, or get a 5xx response up to this many times, backing off a little longer each time.",
+    )
+    @click.option(
+        "--timeout",
+        type=click.FloatRange(min=0, min_open=True),
+        default=30,
+        show_default=True,
+        help="Seconds to wait for Reddit to connect, and then to send each part of a response, before retrying.",
+    )
+    @click.option(
+        "--metrics-json",
+        "metrics_path",
+        type=click.Path(
+            file_okay=True, dir_okay=False, allow_dash=False, path_type=Path
+        ),
+        help="Write timings, request counts, bytes received, and rows written for each stage of the run to this file as JSON.",
+    )
+    @click.option(
+        "--track-memory",
+        is_flag=True,
+        default=False,
+        help="Record the peak and retained memory of each stage, and print them at the end. Included in --metrics-json. Slows the run down.",
+    )
+    @wraps(f)
+    def wrapper(
+        *args,
+        max_requests: Optional[int],
+        max_duration: Optional[float],
+        max_retries: int,
+        timeout: float,
+        metrics_path: Optional[Path],
+        track_memory: bool,
+        **kwargs,
+    ):
+        metrics = Metrics(
+            click.get_current_context().info_name, track_memory=track_memory
+        )
+        try:
+            return f(
+                *args,
+                client=RedditClient(
+                    RequestBudget(max_requests, max_duration),
+                    metrics=metrics,
+                    retry=RetryPolicy(max_retries=max_retries, timeout=timeout),
+                ),
+                **kwargs,
             )
-    else:
-        username = DELETED_USERNAME
-        user_fullname = DELETED_USER_FULLNAME
+        except OAuthError as e:
+            raise click.ClickException(str(e)) from e
+        finally:
+            metrics.stop()
+            if track_memory:
+                click.echo(f"\n{metrics.memory_summary()}")
+            # even a failed run's numbers are worth having
+            if metrics_path:
+                metrics.write_json(metrics_path)
+                click.echo(f"\nwrote metrics to {metrics_path}")
+
+    return wrapper
+
+
+def _parse_shard(ctx, param, value: Optional[str]) -> Optional[Shard]:
+    if value is None:
+        return None
+    try:
+        index, count = map(int, value.split("/"))
+    except ValueError:
+        raise click.BadParameter("must look like INDEX/COUNT, e.g. 0/4")
+    if not 0 <= index < count:
+        raise click.BadParameter("INDEX must be between 0 and COUNT - 1")
+    return Shard(index, count)
+
+
+shard_option = click.option(
+    "--shard",
+    metavar="INDEX/COUNT",
+    callback=_parse_shard,
+    help="Only handle this process's share of the work, e.g. `0/4` through `3/4` across four processes, each with its own --db. Combine them afterwards with the `merge` command.",
+)
 
-    if username and user_fullname:
-        comments = add_missing_user_fragment(comments, username, user_fullname)
-        posts = add_missing_user_fragment(posts, username, user_fullname)
 
-    num_comments_written = save_comments(db, comments, table_prefix=tables_prefix)
-    num_posts_written = save_posts(db, posts, table_prefix=tables_prefix)
+hydrate_option = click.option(
+    "--hydrate-parents",
+    is_flag=True,
+    default=False,
+    help=f"Also fetch the posts that stored comments are on into the `{PARENT_POSTS_TABLE}` table, so comments can be joined to their threads. Each post only costs one lookup, no matter how many comments are on it.",
+)
 
-    messages = [
-        "\nDone!",
-        f" - saved {num_comments_written} new comments",
-        f" - saved {num_posts_written} new posts",
-    ]
 
-    if missing_comments := len(comments) - num_comments_written:
-        messages.append(
-            f" - failed to find {missing_comments} missing comments; ignored for now"
+@cli.command()
+@click.argument("username")
+@click.option(
+    "--db",
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    default=DEFAULT_DB_NAME,
+    help=DB_PATH_HELP,
+)
+@click.option(
+    "--all-sorts",
+    is_flag=True,
+    default=False,
+    help="Also crawl the `top` (for every time window) and `controversial` listings, which can reach items past the newest 1,000. Each only saves what isn't stored yet, and stops at its first page with nothing new.",
+)
+@hydrate_option
+@stage_option
+@client_options
+def user(
+    db_path: str,
+    username: str,
+    all_sorts: bool,
+    hydrate_parents: bool,
+    stage_in_memory: bool,
+    client: RedditClient,
+):
+    username = clean_username(username)
+    click.echo(f"loading data about /u/{username} into {db_path}")
+
+    with open_db_for_run(db_path, stage_in_memory) as db:
+        click.echo(
+            f"\nfetching (up to 10 pages each of) comments and posts{', from every sort' if all_sorts else ''}"
         )
-    if missing_posts := len(post_ids) - num_posts_written:
-        messages.append(
-            f" - failed to find {missing_posts} missing posts; ignored for now"
+        num_comments, num_posts = load_user(db, username, client, all_sorts=all_sorts)
+        click.echo(f"saved/updated {num_comments} comments")
+        click.echo(f"saved/updated {num_posts} posts")
+
+        if hydrate_parents:
+            hydrate_parent_posts(db, client)
+
+        with client.metrics.stage(FTS):
+            ensure_fts(db)
+
+    if stopped := client.budget.exhausted:
+        click.echo(
+            f"\nStopped early after {client.budget.requests_made} requests ({stopped})."
         )
+    elif not (num_comments or num_posts):
+        raise click.ClickException(f"no data found for username: {username}")
+
+
+def _load_user(
+    username: str, client: RedditClient
+) -> Optional[tuple[list[Comment], list[Post]]]:
+    # once the budget or rate limit is used up, don't bother starting anyone new
+    if client.stopped:
+        return None
+
+    return (
+        load_comments_for_user(username, client=client),
+        load_posts_for_user(username, client=client),
+    )
 
-    click.echo("\n".join(messages))
+
+def read_usernames(lines: Iterable[str]) -> list[str]:
+    """
+    cleans and dedupes usernames, one per line. Blank lines and `#` comments are ignored.
+    """
+    return list(
+        dict.fromkeys(
+            clean_username(line.strip())
+            for line in lines
+            if line.strip() and not line.lstrip().startswith("#")
+        )
+    )
 
 
 @cli.command()
-@click.argument("username")
+@click.argument("usernames_file", type=click.File("r", encoding="utf-8"), default="-")
 @click.option(
     "--db",
     "db_path",
@@ -143,26 +340,172 @@ def load_data_from_files(
     default=DEFAULT_DB_NAME,
     help=DB_PATH_HELP,
 )
-def user(db_path: str, username: str):
-    username = clean_username(username)
-    click.echo(f"loading data about /u/{username} into {db_path}")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    show_default=True,
+    help="How many users to fetch at once. They all share the same request budget and rate limit.",
+)
+@shard_option
+@hydrate_option
+@stage_option
+@client_options
+def users(
+    usernames_file: TextIO,
+    db_path: str,
+    workers: int,
+    shard: Optional[Shard],
+    hydrate_parents: bool,
+    stage_in_memory: bool,
+    client: RedditClient,
+):
+    usernames = [
+        u for u in read_usernames(usernames_file) if in_shard(u.lower(), shard)
+    ]
+    click.echo(f"loading data about {len(usernames)} users into {db_path}")
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    not_loaded: list[str] = []
+    with open_db_for_run(db_path, stage_in_memory) as db:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(profile_thread(_load_user), u, client): u for u in usernames
+            }
+
+            for future in as_completed(futures):
+                username = futures[future]
+                try:
+                    result = future.result()
+                except ValueError as e:
+                    click.echo(f"\n/u/{username}: {e}", err=True)
+                    continue
+
+                if result is None:
+                    not_loaded.append(username)
+                    continue
+
+                # only this thread touches the db, so there's a single writer
+                comments, posts = result
+                save_comments(db, comments, metrics=client.metrics)
+                save_posts(db, posts, metrics=client.metrics)
+                click.echo(
+                    f"\n/u/{username}: saved/updated {len(comments)} comments and {len(posts)} posts"
+                )
+
+        if hydrate_parents:
+            hydrate_parent_posts(db, client)
+
+        with client.metrics.stage(FTS):
+            ensure_fts(db)
+
+    if not_loaded:
+        not_loaded.sort(key=usernames.index)
+        click.echo(
+            f"\nStopped early ({client.stopped}); {len(not_loaded)} users weren't loaded: {', '.join(not_loaded)}"
+        )
 
-    db = Database(db_path)
 
-    click.echo("\nfetching (up to 10 pages of) comments")
-    comments = load_comments_for_user(username)
-    save_comments(db, comments)
-    click.echo(f"saved/updated {len(comments)} comments")
+def watch_users(
+    db: Database,
+    client: RedditClient,
+    usernames: list[str],
+    interval: float,
+    jitter: float = 0.1,
+    max_backoff: Optional[float] = None,
+    max_syncs: Optional[int] = None,
+    sleep: Callable[[float], None] = time.sleep,
+    clock: Callable[[], float] = time.monotonic,
+):
+    """
+    re-syncs each user every `interval` seconds until interrupted (or until `max_syncs`
+    syncs have happened). Every wait is nudged by up to `jitter` (as a fraction of the
+    interval) so that accounts spread out instead of syncing all at once. While Reddit
+    is rate limiting us, nothing is synced until the limit resets. Users that error are
+    retried with exponential backoff, up to `max_backoff` seconds.
+    """
+    import requests
+
+    max_backoff = max_backoff or interval * 16
+
+    def _jittered(seconds: float) -> float:
+        return seconds + interval * random.uniform(-jitter, jitter)
+
+    # spread the first round out a little, too
+    start = clock()
+    queue = [(start + abs(_jittered(0)), u) for u in usernames]
+    heapq.heapify(queue)
+    failures: dict[str, int] = {}
+    num_syncs = 0
+
+    while queue and (max_syncs is None or num_syncs < max_syncs):
+        due, username = heapq.heappop(queue)
+        if (wait := max(due - clock(), client.rate_limit_resets_in)) > 0:
+            sleep(wait)
+
+        try:
+            num_comments, num_posts = sync_user(db, username, client, incremental=True)
+        except (
+            ValueError,
+            requests.RequestException,
+            RedditUnavailableException,
+        ) as e:
+            failures[username] = failures.get(username, 0) + 1
+            delay = min(interval * 2 ** failures[username], max_backoff)
+            click.echo(
+                f"\n/u/{username}: {e}; retrying in {delay:.0f} seconds", err=True
+            )
+        else:
+            failures.pop(username, None)
+            delay = interval
+            with client.metrics.stage(FTS):
+                ensure_fts(db)
+            click.echo(
+                f"\n/u/{username}: saved/updated {num_comments} comments and {num_posts} posts"
+            )
 
-    click.echo("\nfetching (up to 10 pages of) posts")
-    posts = load_posts_for_user(username)
-    save_posts(db, posts)
-    click.echo(f"saved/updated {len(posts)} posts")
+        num_syncs += 1
+        heapq.heappush(queue, (clock() + max(0, _jittered(delay)), username))
 
-    if not (comments or posts):
-        raise click.ClickException(f"no data found for username: {username}")
 
-    ensure_fts(db)
+@cli.command()
+@click.argument("usernames_file", type=click.File("r", encoding="utf-8"), default="-")
+@click.option(
+    "--db",
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    default=DEFAULT_DB_NAME,
+    help=DB_PATH_HELP,
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=1),
+    default=15,
+    show_default=True,
+    help="Minutes between syncs of each user.",
+)
+@click.option(
+    "--jitter",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    show_default=True,
+    help="Randomly shift each sync by up to this fraction of the interval, so users don't all sync at once.",
+)
+def watch(usernames_file: TextIO, db_path: str, interval: float, jitter: float):
+    usernames = read_usernames(usernames_file)
+    click.echo(
+        f"syncing {len(usernames)} users into {db_path} every {interval:g} minutes; press Ctrl+C to stop"
+    )
+
+    # both of these stay open for the life of the process
+    db = open_db(db_path)
+    client = RedditClient()
+
+    try:
+        watch_users(db, client, usernames, interval * 60, jitter=jitter)
+    except KeyboardInterrupt:
+        click.echo("\nstopped watching")
 
 
 @cli.command()
@@ -183,15 +526,276 @@ def user(db_path: str, username: str):
     default=False,
     help="Skip hydrating data about your saved posts and comments.",
 )
-def archive(archive_path: Path, db_path: str, skip_saved: bool):
+@click.option(
+    "--retry-missing-after",
+    type=click.FloatRange(min=0),
+    default=DEFAULT_RETRY_MISSING_AFTER / 60 / 60,
+    show_default=True,
+    help="Hours to wait before re-requesting items that Reddit didn't return. The wait doubles after each failed attempt.",
+)
+@shard_option
+@hydrate_option
+@stage_option
+@client_options
+def archive(
+    archive_path: Path,
+    db_path: str,
+    skip_saved: bool,
+    retry_missing_after: float,
+    shard: Optional[Shard],
+    hydrate_parents: bool,
+    stage_in_memory: bool,
+    client: RedditClient,
+):
     click.echo(f"loading data found in archive at {archive_path} into {db_path}")
 
-    db = Database(db_path)
+    with open_db_for_run(db_path, stage_in_memory) as db:
+        # I don't love this double negative, but it is what it is
+        load_data_from_files(
+            db,
+            archive_path,
+            include_saved=not skip_saved,
+            client=client,
+            retry_missing_after=retry_missing_after * 60 * 60,
+            shard=shard,
+        )
+
+        if hydrate_parents:
+            hydrate_parent_posts(
+                db, client, retry_missing_after=retry_missing_after * 60 * 60
+            )
 
-    load_data_from_files(db, archive_path)
+        with client.metrics.stage(FTS):
+            ensure_fts(db)
+
+    if stopped := client.budget.exhausted:
+        click.echo(
+            f"\nStopped early after {client.budget.requests_made} requests ({stopped}). Run again to pick up where this left off."
+        )
 
-    # I don't love this double negative, but it is what it is
-    if not skip_saved:
-        load_data_from_files(db, archive_path, own_data=False, tables_prefix="saved_")
 
+@cli.command()
+@click.argument(
+    "shard_paths",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),
+)
+@click.option(
+    "--db",
+    "db_path",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=False),
+    default=DEFAULT_DB_NAME,
+    help=DB_PATH_HELP,
+)
+def merge(shard_paths: tuple[Path, ...], db_path: str):
+    click.echo(f"merging {len(shard_paths)} databases into {db_path}")
+
+    db = open_db(db_path)
+
+    for shard_path in shard_paths:
+        counts = merge_shard(db, shard_path)
+        summary = ", ".join(f"{n} {table}" for table, n in counts.items())
+        click.echo(f"\nmerged {shard_path}: {summary or 'nothing to merge'}")
+
+    # rebuilt once at the end, rather than after every shard
     ensure_fts(db)
+
+
+def _parse_cursor(ctx, param, value: Optional[str]):
+    if value is None:
+        return None
+    try:
+        return parse_cursor(value)
+    except ValueError:
+        raise click.BadParameter(
+            "expected TIMESTAMP or TIMESTAMP:ID, e.g. `1690000000:jg3mdbc`"
+        )
+
+
+@cli.command()
+@click.argument("table", type=click.Choice(EXPORTABLE_TABLES), default="comments")
+@click.option(
+    "--db",
+    "db_path",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, allow_dash=False),
+    default=DEFAULT_DB_NAME,
+    help="A path to a SQLite database file created by one of the other commands.",
+)
+@click.option(
+    "--format",
+    "export_format",
+    type=click.Choice(list(WRITERS)),
+    default="ndjson",
+    show_default=True,
+    help="Newline-delimited JSON (one object per row) or CSV with a header row.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(file_okay=True, dir_okay=False, allow_dash=True),
+    default="-",
+    help="Where to write the rows. Defaults to stdout.",
+)
+@click.option(
+    "--since",
+    callback=_parse_cursor,
+    metavar="TIMESTAMP[:ID]",
+    help="Only export rows after this cursor. Each export ends by printing the cursor to pass next time.",
+)
+def export(
+    table: str,
+    db_path: str,
+    export_format: ExportFormat,
+    output: str,
+    since: Optional[tuple[int, str]],
+):
+    db = open_db(db_path)
+    if not db[table].exists():
+        raise click.ClickException(f"no {table} have been saved to {db_path} yet")
+
+    ensure_export_index(db, table)
+    columns = [c.name for c in db[table].columns]  # type: ignore
+
+    num_rows = 0
+    last_row: Optional[tuple] = None
+
+    def _counted(rows: Iterable[tuple]) -> Iterator[tuple]:
+        nonlocal num_rows, last_row
+        for row in rows:
+            num_rows += 1
+            last_row = row
+            yield row
+
+    with click.open_file(output, "w", encoding="utf-8") as out:
+        WRITERS[export_format](
+            columns, _counted(iter_rows_after(db, table, columns, after=since)), out
+        )
+        # so the summary below comes after the rows when both go to a terminal
+        out.flush()
+
+    if last_row is None:
+        click.echo(f"no new {table} to export", err=True)
+        return
+
+    cursor = (last_row[columns.index("timestamp")], last_row[columns.index("id")])
+    click.echo(
+        f"exported {num_rows} {table}; pass `--since {format_cursor(cursor)}` to continue from here",
+        err=True,
+    )
+
+
+def _parse_search_cursor(ctx, param, value: Optional[str]):
+    if value is None:
+        return None
+    try:
+        return parse_search_cursor(value)
+    except ValueError:
+        raise click.BadParameter(
+            "expected the cursor printed at the end of the previous page"
+        )
+
+
+def _to_timestamp(ctx, param, value: Optional[datetime]) -> Optional[int]:
+    # dates are in UTC, same as the stored timestamps
+    return (
+        None if value is None else int(value.replace(tzinfo=timezone.utc).timestamp())
+    )
+
+
+@cli.command(name="search")
+@click.argument("query")
+@click.option(
+    "--db",
+    "db_path",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, allow_dash=False),
+    default=DEFAULT_DB_NAME,
+    help="A path to a SQLite database file created by one of the other commands.",
+)
+@click.option(
+    "--table",
+    "tables",
+    type=click.Choice([t for t, _ in FTS_INSTRUCTIONS]),
+    multiple=True,
+    help="Only search this table. Can be passed more than once. Defaults to all of them.",
+)
+@click.option("--subreddit", help="Only show results from this subreddit.")
+@click.option(
+    "--since",
+    type=click.DateTime(["%Y-%m-%d"]),
+    callback=_to_timestamp,
+    help="Only show results from this day (UTC) onwards.",
+)
+@click.option(
+    "--until",
+    type=click.DateTime(["%Y-%m-%d"]),
+    callback=_to_timestamp,
+    help="Only show results from before this day (UTC).",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=DEFAULT_LIMIT,
+    show_default=True,
+    help="How many results to show.",
+)
+@click.option(
+    "--after",
+    callback=_parse_search_cursor,
+    metavar="CURSOR",
+    help="Show the page of results after this cursor, which is printed at the end of each full page.",
+)
+def search_command(
+    query: str,
+    db_path: str,
+    tables: tuple[str, ...],
+    subreddit: Optional[str],
+    since: Optional[int],
+    until: Optional[int],
+    limit: int,
+    after: Optional[SearchCursor],
+):
+    import sqlite3
+
+    db = open_db(db_path)
+    if not searchable_tables(db):
+        raise click.ClickException(f"nothing has been saved to {db_path} yet")
+
+    try:
+        results = search(
+            db,
+            query,
+            tables=tables or None,
+            subreddit=subreddit,
+            since=since,
+            until=until,
+            after=after,
+            limit=limit,
+        )
+    except sqlite3.OperationalError as e:
+        # usually a malformed query, like unbalanced quotes
+        raise click.ClickException(f"couldn't run search: {e}")
+
+    if not results:
+        click.echo("no results")
+        return
+
+    for result in results:
+        day = time.strftime("%Y-%m-%d", time.gmtime(result["timestamp"]))
+        click.echo(
+            f"\n[{result['table']}] r/{result['subreddit']} on {day}: {result['permalink']}"
+        )
+        if result["title"]:
+            click.echo(f"  {result['title']}")
+        snippet = " ".join(result["snippet"].split())
+        click.echo(
+            "  "
+            + snippet.replace(
+                MATCH_START, click.style("", bold=True, reset=False)
+            ).replace(MATCH_END, click.style("", reset=True))
+        )
+
+    if len(results) == limit:
+        click.echo(
+            f"\nthere may be more results; pass `--after {format_search_cursor(results[-1])}` to see them"
+        )
@@ -1,11 +1,16 @@
+from __future__ import annotations
+
+import hashlib
 from csv import DictReader
 from pathlib import Path
-from typing import Literal, Optional
+from typing import TYPE_CHECKING, Literal, Optional, TypedDict
 
-from sqlite_utils import Database
+if TYPE_CHECKING:
+    from sqlite_utils import Database
 
 ItemType = Literal["comments", "posts"]
-PrefixType = Literal["saved_"]
+# `parent_` is for posts that your comments are on, not anything from the archive
+PrefixType = Literal["saved_", "parent_"]
 
 FULLNAME_PREFIX: dict[ItemType, str] = {
     "comments": "t1",
@@ -49,6 +54,40 @@ def load_unsaved_ids_from_file(
         ]
 
 
+class FileFingerprint(TypedDict):
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+def _hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 16):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_file(
+    path: Path, previous: Optional[FileFingerprint] = None
+) -> FileFingerprint:
+    """
+    describes a file by its size, modification time, and content hash. If the size
+    and mtime match `previous`, its hash is reused instead of re-reading the file.
+    """
+    stat = path.stat()
+    if (
+        previous
+        and previous["size"] == stat.st_size
+        and previous["mtime_ns"] == stat.st_mtime_ns
+    ):
+        sha256 = previous["sha256"]
+    else:
+        sha256 = _hash_file(path)
+
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha256}
+
+
 def get_username_from_archive(archive_path: Path) -> Optional[str]:
     with open(validate_and_build_path(archive_path, "statistics")) as stat_rows:
         try:
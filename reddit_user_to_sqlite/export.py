@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import csv
+import json
+from typing import TYPE_CHECKING, Iterable, Iterator, Literal, Optional, TextIO
+
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
+ExportFormat = Literal["ndjson", "csv"]
+
+# the tables that can be exported; they all have `timestamp` and `id` columns
+EXPORTABLE_TABLES = [
+    "comments",
+    "posts",
+    "saved_comments",
+    "saved_posts",
+    "parent_posts",
+]
+
+# a row's position in export order: its (timestamp, id)
+Cursor = tuple[int, str]
+
+# rows per keyset query, and per fetch within it
+PAGE_SIZE = 10_000
+FETCH_SIZE = 1_000
+
+
+def parse_cursor(value: str) -> Cursor:
+    """
+    parses `TIMESTAMP[:ID]`. A bare timestamp starts at that second, so rows with that
+    exact timestamp are included.
+    """
+    timestamp, _, id_ = value.partition(":")
+    return int(timestamp), id_
+
+
+def format_cursor(cursor: Cursor) -> str:
+    return f"{cursor[0]}:{cursor[1]}"
+
+
+def ensure_export_index(db: Database, table: str):
+    # keyset pagination is only constant-time per page if it can seek
+    db[table].create_index(["timestamp", "id"], if_not_exists=True)  # type: ignore
+
+
+def iter_rows_after(
+    db: Database,
+    table: str,
+    columns: list[str],
+    after: Optional[Cursor] = None,
+    page_size: int = PAGE_SIZE,
+    fetch_size: int = FETCH_SIZE,
+) -> Iterator[tuple]:
+    """
+    yields every row of `table` that sorts after the `after` cursor, in (timestamp, id)
+    order. Each page is its own short query that picks up after the last row of the
+    previous one, so nothing holds a read open (or a whole table in memory) for the
+    length of the export.
+    """
+    timestamp_index, id_index = columns.index("timestamp"), columns.index("id")
+    select = f"select {', '.join(f'[{c}]' for c in columns)} from [{table}]"
+
+    while True:
+        if after is None:
+            cursor = db.execute(f"{select} order by timestamp, id limit ?", [page_size])
+        else:
+            cursor = db.execute(
+                f"{select} where (timestamp, id) > (?, ?) order by timestamp, id limit ?",
+                [*after, page_size],
+            )
+
+        num_rows = 0
+        last_row = None
+        while rows := cursor.fetchmany(fetch_size):
+            num_rows += len(rows)
+            last_row = rows[-1]
+            yield from rows
+
+        if last_row is None or num_rows < page_size:
+            return
+        after = (last_row[timestamp_index], last_row[id_index])
+
+
+def write_ndjson(columns: list[str], rows: Iterable[tuple], out: TextIO):
+    for row in rows:
+        out.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+        out.write("\n")
+
+
+def write_csv(columns: list[str], rows: Iterable[tuple], out: TextIO):
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(columns)
+    writer.writerows(rows)
+
+
+WRITERS = {"ndjson": write_ndjson, "csv": write_csv}
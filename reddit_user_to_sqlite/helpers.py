@@ -1,6 +1,8 @@
 import re
+import threading
+import zlib
 from itertools import islice
-from typing import Iterable, Optional, TypeVar
+from typing import Iterable, NamedTuple, Optional, TypeVar
 
 T = TypeVar("T")
 
@@ -36,3 +38,38 @@ def find_user_details_from_items(items) -> Optional[tuple[str, str]]:
         )
     except StopIteration:
         return None
+
+
+class Shard(NamedTuple):
+    # 0-based
+    index: int
+    count: int
+
+
+def in_shard(key: str, shard: Optional[Shard]) -> bool:
+    """
+    whether `key` belongs to `shard`. Unlike `hash()`, this is stable across processes,
+    so separate runs agree on who owns what. Everything is in the `None` shard.
+    """
+    if shard is None:
+        return True
+    return zlib.crc32(key.encode()) % shard.count == shard.index
+
+
+class SeenIds:
+    """
+    a set of ids that several threads can add to at once
+    """
+
+    def __init__(self, ids: Iterable[str] = ()) -> None:
+        self._ids = set(ids)
+        self._lock = threading.Lock()
+
+    def claim(self, ids: Iterable[str]) -> set[str]:
+        """
+        adds `ids`, returning the ones that weren't already here
+        """
+        with self._lock:
+            new = set(ids) - self._ids
+            self._ids |= new
+        return new
@@ -0,0 +1,520 @@
+from __future__ import annotations
+
+from functools import partial
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Container,
+    Iterator,
+    Optional,
+    Sequence,
+    TypeVar,
+    cast,
+)
+
+import click
+
+from reddit_user_to_sqlite.csv_helpers import (
+    FULLNAME_PREFIX,
+    FileFingerprint,
+    ItemType,
+    PrefixType,
+    build_table_name,
+    fingerprint_file,
+    get_username_from_archive,
+    load_unsaved_ids_from_file,
+    validate_and_build_path,
+)
+from reddit_user_to_sqlite.helpers import (
+    SeenIds,
+    Shard,
+    find_user_details_from_items,
+    in_shard,
+)
+from reddit_user_to_sqlite.metrics import (
+    ARCHIVE_SCAN,
+    BOOKKEEPING,
+    ITEM_UPSERT,
+    PARENT_FETCH,
+    USER_UPSERT,
+    Metrics,
+)
+from reddit_user_to_sqlite.pipeline import fetch_and_write
+from reddit_user_to_sqlite.reddit_api import (
+    EXTRA_SORTS,
+    BudgetExhaustedException,
+    Comment,
+    Post,
+    RedditClient,
+    RedditUnavailableException,
+    StopPagingFunc,
+    get_user_id,
+    iter_comments_for_user,
+    iter_info,
+    iter_posts_for_user,
+    iter_unseen,
+    load_comments_for_user,
+    load_posts_for_user,
+)
+from reddit_user_to_sqlite.sqlite_helpers import (
+    PARENT_POSTS_TABLE,
+    comment_to_comment_row,
+    find_missing_parent_posts,
+    find_saved_ids,
+    find_user_item_ids,
+    format_shard,
+    get_archive_file_row,
+    insert_user_rows,
+    items_to_rows,
+    load_ids_to_skip,
+    post_to_post_row,
+    update_missing_items,
+    upsert_archive_file,
+    upsert_comment_rows,
+    upsert_post_rows,
+    upsert_subreddit_rows,
+)
+
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
+
+def open_db(db_path: str) -> Database:
+    # sqlite_utils is slow to import, so only commands that touch the db pay for it
+    from sqlite_utils import Database
+
+    return Database(db_path)
+
+
+# items that Reddit doesn't return are retried after a day, then 2, 4, 8...
+DEFAULT_RETRY_MISSING_AFTER = 60 * 60 * 24
+
+DELETED_USERNAME = "__DeletedUser__"
+DELETED_USER_FULLNAME = "t2_1234567"
+
+T = TypeVar("T", Comment, Post)
+
+
+def _save_items(
+    db: Database,
+    items: list[T],
+    item_to_row: Callable[[T, str], Any],
+    upsert_rows: Callable[[Database, list[Any], Optional[PrefixType]], int],
+    table_prefix: Optional[PrefixType] = None,
+    metrics: Optional[Metrics] = None,
+    fallback_user: Optional[tuple[str, str]] = None,
+) -> int:
+    if not items:
+        return 0
+
+    rows, users, subreddits = items_to_rows(items, item_to_row, fallback_user)
+
+    metrics = metrics or Metrics()
+    with metrics.stage(USER_UPSERT) as stage:
+        insert_user_rows(db, users)
+        upsert_subreddit_rows(db, subreddits)
+        stage["rows"] = len(users) + len(subreddits)
+
+    with metrics.stage(ITEM_UPSERT) as stage:
+        stage["rows"] = upsert_rows(db, rows, table_prefix)
+    return stage["rows"]
+
+
+save_comments = partial(
+    _save_items, item_to_row=comment_to_comment_row, upsert_rows=upsert_comment_rows
+)
+save_posts = partial(
+    _save_items, item_to_row=post_to_post_row, upsert_rows=upsert_post_rows
+)
+
+
+def load_ids_to_fetch(
+    db: Database,
+    archive_path: Path,
+    item_type: ItemType,
+    prefix: Optional[PrefixType] = None,
+    skip_ids: Container[str] = frozenset(),
+    shard: Optional[Shard] = None,
+) -> tuple[list[str], list[str], FileFingerprint]:
+    """
+    returns the fullnames from an archive file that should be fetched, every fullname
+    from it that's still unsaved (to remember for next time), and the file's current
+    fingerprint. If the file is unchanged since the last run (which loaded the same
+    shard), it's not re-read; only the ids that were unsaved last time are considered.
+    Either way, anything outside of `shard` is left out, and `skip_ids` are only left
+    out of what's fetched.
+    """
+    filename = build_table_name(item_type, prefix)
+    previous = get_archive_file_row(db, filename)
+    fingerprint = fingerprint_file(
+        validate_and_build_path(archive_path, filename), previous
+    )
+
+    if (
+        previous
+        and previous["sha256"] == fingerprint["sha256"]
+        # another shard's pending ids say nothing about this one's
+        and previous["shard"] == format_shard(shard)
+    ):
+        pending_ids = previous["pending_ids"]
+        requested = [i for i in pending_ids if i not in skip_ids]
+        click.echo(
+            f"\n{filename}.csv is unchanged since the last run; retrying {len(requested)} missing {item_type}"
+        )
+        return requested, pending_ids, fingerprint
+
+    # ids that are skipped for now still need retrying later, so they stay pending
+    pending_ids = [
+        i
+        for i in load_unsaved_ids_from_file(db, archive_path, item_type, prefix=prefix)
+        if in_shard(i, shard)
+    ]
+    return [i for i in pending_ids if i not in skip_ids], pending_ids, fingerprint
+
+
+class _TableLoad:
+    """
+    tracks loading a single archive file into its matching table
+    """
+
+    def __init__(
+        self,
+        item_type: ItemType,
+        prefix: Optional[PrefixType],
+        requested: list[str],
+        fingerprint: FileFingerprint,
+        metrics: Metrics,
+        pending: Optional[list[str]] = None,
+    ) -> None:
+        self.item_type: ItemType = item_type
+        self.prefix: Optional[PrefixType] = prefix
+        self.requested = requested
+        # everything from the file that isn't saved yet, including ids skipped this run
+        self.pending = requested if pending is None else pending
+        self.fingerprint = fingerprint
+        self.metrics = metrics
+        self.wanted = set(requested)
+
+        self.num_found = 0
+        self.num_written = 0
+        # your own items that are missing an author; saved once we know your username
+        self.unattributed: list[Any] = []
+
+    @property
+    def filename(self) -> str:
+        return build_table_name(self.item_type, self.prefix)
+
+    def save(
+        self,
+        db: Database,
+        items: list[Any],
+        fallback_user: Optional[tuple[str, str]] = None,
+    ):
+        save = save_comments if self.item_type == "comments" else save_posts
+        self.num_written += save(
+            db,
+            items,
+            table_prefix=self.prefix,
+            metrics=self.metrics,
+            fallback_user=fallback_user,
+        )
+
+    def flush(self, db: Database, user_details: Optional[tuple[str, str]]):
+        self.save(db, self.unattributed, fallback_user=user_details)
+        self.unattributed = []
+
+
+def _find_user_details_in_archive(
+    archive_path: Path, client: Optional[RedditClient] = None
+) -> Optional[tuple[str, str]]:
+    # if all loaded posts are removed (which could be the case on subsequent runs),
+    # then try to load from archive
+    if username := get_username_from_archive(archive_path):
+        try:
+            return username, f"t2_{get_user_id(username, client=client)}"
+        except (BudgetExhaustedException, RedditUnavailableException) as e:
+            # these items will be retried next run, when there's budget to spare
+            click.echo(f"\nUnable to look up /u/{username} ({e})", err=True)
+            return None
+
+    # otherwise, your posts without a username won't be saved;
+    # this only happens for malformed archives
+    click.echo(
+        "\nUnable to guess username from API content or archive; some data will not be saved.",
+        err=True,
+    )
+    return None
+
+
+def load_data_from_files(
+    db: Database,
+    archive_path: Path,
+    include_saved=True,
+    client: Optional[RedditClient] = None,
+    retry_missing_after: float = DEFAULT_RETRY_MISSING_AFTER,
+    shard: Optional[Shard] = None,
+) -> dict[str, int]:
+    """
+    hydrates every item in the archive that isn't stored yet. An item that's both
+    yours and saved is only fetched once, then written to both tables. Your own items
+    require a username to save; saved items get a placeholder user if they lack one.
+
+    Items that Reddit didn't return are remembered, and aren't requested again until
+    `retry_missing_after` seconds have passed (doubling after every failed attempt).
+
+    Comments and posts are fetched on their own threads while batches are written
+    as they arrive. With a `shard`, only that share of the archive is loaded. Returns
+    how many items were saved to each table.
+    """
+    client = client or RedditClient()
+    metrics = client.metrics
+    prefixes: list[Optional[PrefixType]] = [None, "saved_"] if include_saved else [None]
+
+    with metrics.stage(BOOKKEEPING):
+        skip_ids = load_ids_to_skip(db, retry_missing_after)
+    if skip_ids:
+        click.echo(
+            f"\nSkipping {len(skip_ids)} items that weren't found recently; they'll be retried later"
+        )
+
+    def _scan(item_type: ItemType, prefix: Optional[PrefixType]) -> _TableLoad:
+        with metrics.stage(ARCHIVE_SCAN) as stage:
+            requested, pending, fingerprint = load_ids_to_fetch(
+                db,
+                archive_path,
+                item_type,
+                prefix=prefix,
+                skip_ids=skip_ids,
+                shard=shard,
+            )
+            stage["rows"] = len(requested)
+        return _TableLoad(
+            item_type, prefix, requested, fingerprint, metrics, pending=pending
+        )
+
+    tables = [
+        _scan(item_type, prefix)
+        for item_type in cast(list[ItemType], ["comments", "posts"])
+        for prefix in prefixes
+    ]
+
+    def _fetch(item_type: ItemType):
+        # dicts keep insertion order, so this dedupes without shuffling the ids
+        unique_ids = list(
+            dict.fromkeys(
+                i for t in tables if t.item_type == item_type for i in t.requested
+            )
+        )
+        click.echo(f"\nFetching info about {len(unique_ids)} {item_type}")
+        return (
+            (item_type, batch, items)
+            for batch, items in iter_info(unique_ids, client=client)
+        )
+
+    user_details: Optional[tuple[str, str]] = None
+
+    def _write(fetched: tuple[ItemType, Sequence[str], list[Any]]):
+        nonlocal user_details
+        item_type, batch, items = fetched
+
+        found = {f"{FULLNAME_PREFIX[item_type]}_{i['id']}": i for i in items}
+        with metrics.stage(BOOKKEEPING):
+            update_missing_items(db, batch, found)
+
+        for table in tables:
+            if table.item_type != item_type:
+                continue
+
+            routed = [i for fullname, i in found.items() if fullname in table.wanted]
+            table.num_found += len(routed)
+
+            if table.prefix:
+                table.save(
+                    db,
+                    routed,
+                    fallback_user=(DELETED_USERNAME, DELETED_USER_FULLNAME),
+                )
+            elif user_details:
+                table.save(db, routed, fallback_user=user_details)
+            elif user_details := find_user_details_from_items(routed):
+                # now that we know who you are, catch up on anything that was waiting
+                for t in tables:
+                    if not t.prefix:
+                        t.flush(db, user_details)
+                table.save(db, routed, fallback_user=user_details)
+            else:
+                table.unattributed += routed
+
+    fetch_and_write([_fetch("comments"), _fetch("posts")], _write)
+
+    if any(t.unattributed for t in tables):
+        user_details = _find_user_details_in_archive(archive_path, client=client)
+        for table in tables:
+            table.flush(db, user_details)
+
+    with metrics.stage(BOOKKEEPING):
+        for table in tables:
+            upsert_archive_file(
+                db, table.filename, table.fingerprint, table.pending, shard=shard
+            )
+
+    for prefix in prefixes:
+        comments, posts = (t for t in tables if t.prefix == prefix)
+        messages = [
+            f"\nDone with {'saved' if prefix else 'your'} items!",
+            f" - saved {comments.num_written} new comments",
+            f" - saved {posts.num_written} new posts",
+        ]
+
+        if missing_comments := comments.num_found - comments.num_written:
+            messages.append(
+                f" - failed to find {missing_comments} missing comments; ignored for now"
+            )
+        if missing_posts := len(posts.requested) - posts.num_written:
+            messages.append(
+                f" - failed to find {missing_posts} missing posts; ignored for now"
+            )
+
+        click.echo("\n".join(messages))
+
+    return {t.filename: t.num_written for t in tables}
+
+
+def hydrate_parent_posts(
+    db: Database,
+    client: RedditClient,
+    retry_missing_after: float = DEFAULT_RETRY_MISSING_AFTER,
+) -> int:
+    """
+    fetches the posts that stored comments are on into `parent_posts`, unless they're
+    already in one of the posts tables. Each post is requested once (in batches of 100),
+    no matter how many comments are on it. Posts that Reddit doesn't return are retried
+    later, like archive items. Returns how many posts were saved.
+    """
+    metrics = client.metrics
+    with metrics.stage(BOOKKEEPING):
+        skip_ids = load_ids_to_skip(db, retry_missing_after)
+        fullnames = [
+            fullname
+            for i in find_missing_parent_posts(db)
+            if (fullname := f"{FULLNAME_PREFIX['posts']}_{i}") not in skip_ids
+        ]
+
+    click.echo(f"\nFetching {len(fullnames)} posts that comments are on")
+    num_saved = 0
+
+    def _write(fetched: tuple[Sequence[str], list[Any]]):
+        nonlocal num_saved
+        batch, items = fetched
+        with metrics.stage(BOOKKEEPING):
+            update_missing_items(
+                db, batch, {f"{FULLNAME_PREFIX['posts']}_{i['id']}" for i in items}
+            )
+        # like saved items, these can be by anyone, deleted accounts included
+        num_saved += save_posts(
+            db,
+            items,
+            table_prefix="parent_",
+            metrics=metrics,
+            fallback_user=(DELETED_USERNAME, DELETED_USER_FULLNAME),
+        )
+
+    fetch_and_write(
+        [iter_info(fullnames, client=client, stage_name=PARENT_FETCH)], _write
+    )
+    click.echo(f"saved {num_saved} posts to {PARENT_POSTS_TABLE}")
+    return num_saved
+
+
+def load_user(
+    db: Database, username: str, client: RedditClient, all_sorts=False
+) -> tuple[int, int]:
+    """
+    fetches and saves a user's recent comments and posts, returning how many of each
+    were saved. Comments and posts are fetched on their own threads while pages are
+    written as they arrive.
+
+    With `all_sorts`, the `top` and `controversial` listings are crawled at the same
+    time, to reach items past the newest 1k. They only save items that aren't stored
+    (or found by another listing) yet, and each one stops at its first page with
+    nothing new.
+    """
+    saved: dict[ItemType, set[str]] = {"comments": set(), "posts": set()}
+
+    def _write(page: tuple[ItemType, list[Any]]):
+        item_type, items = page
+        if item_type == "comments":
+            save_comments(db, items, metrics=client.metrics)
+        else:
+            save_posts(db, items, metrics=client.metrics)
+        saved[item_type].update(i["id"] for i in items)
+
+    def _claim(pages: Iterator[list[Any]], seen: SeenIds) -> Iterator[list[Any]]:
+        for page in pages:
+            seen.claim(i["id"] for i in page)
+            yield page
+
+    def _listings(item_type: ItemType, iter_pages: Callable[..., Iterator[list[Any]]]):
+        pages = iter_pages(username, client=client)
+        if not all_sorts:
+            return [((item_type, p) for p in pages)]
+
+        # the db is only touched on this thread, so look up what's stored up front
+        seen = SeenIds(find_user_item_ids(db, item_type, username))
+        return [
+            # everything on `new` is saved, which keeps recent scores up to date
+            ((item_type, p) for p in _claim(pages, seen)),
+            *(
+                (
+                    (item_type, p)
+                    for p in iter_unseen(
+                        iter_pages(username, client=client, sort=sort, time_filter=t),
+                        seen,
+                    )
+                )
+                for sort, t in EXTRA_SORTS
+            ),
+        ]
+
+    fetch_and_write(
+        [
+            *_listings("comments", iter_comments_for_user),
+            *_listings("posts", iter_posts_for_user),
+        ],
+        _write,
+        # with all sorts, there are too many listings to wait on each one in turn
+        in_order=not all_sorts,
+    )
+    return len(saved["comments"]), len(saved["posts"])
+
+
+def _all_stored(db: Database, table_name: str) -> StopPagingFunc:
+    def _check(ids: list[str]) -> bool:
+        return len(find_saved_ids(db, table_name, ids)) == len(ids)
+
+    return _check
+
+
+def sync_user(
+    db: Database, username: str, client: RedditClient, incremental=False
+) -> tuple[int, int]:
+    """
+    fetches and saves a user's recent comments and posts, returning how many of each
+    were saved. If `incremental`, paging stops at the first page that's already stored.
+    """
+    comments = load_comments_for_user(
+        username,
+        client=client,
+        stop_paging=_all_stored(db, "comments") if incremental else None,
+    )
+    posts = load_posts_for_user(
+        username,
+        client=client,
+        stop_paging=_all_stored(db, "posts") if incremental else None,
+    )
+    return (
+        save_comments(db, comments, metrics=client.metrics),
+        save_posts(db, posts, metrics=client.metrics),
+    )
@@ -0,0 +1,300 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional, TypedDict
+
+if TYPE_CHECKING:
+    from typing import NotRequired
+
+# the stages of a run, in the order they (usually) happen
+ARCHIVE_SCAN = "archive_scan"
+LISTING_FETCH = "listing_fetch"
+INFO_FETCH = "info_fetch"
+# like INFO_FETCH, but for the posts that stored comments are on
+PARENT_FETCH = "parent_fetch"
+USER_UPSERT = "user_and_subreddit_upsert"
+ITEM_UPSERT = "item_upsert"
+BOOKKEEPING = "bookkeeping"
+FTS = "fts"
+
+
+class StageMetrics(TypedDict):
+    # total time spent in the stage; stages on different threads overlap
+    seconds: float
+    calls: int
+    rows: int
+    # API traffic made from inside the stage, on the thread that ran it
+    requests: int
+    bytes_received: int
+    rate_limit_wait_seconds: float
+    # only when tracking memory: the most the stage allocated on top of what was
+    # already in use, and how much of what it allocated was still around afterwards.
+    # tracemalloc only measures the whole process, so these only cover calls that
+    # didn't overlap any other stage; `overlapped_calls` counts the ones that did.
+    peak_bytes: "NotRequired[int]"
+    retained_bytes: "NotRequired[int]"
+    overlapped_calls: "NotRequired[int]"
+
+
+class MemoryMetrics(TypedDict):
+    # python allocations, as seen by tracemalloc
+    peak_traced_bytes: int
+    # the whole process's high-water mark, if the platform reports it
+    max_rss_bytes: Optional[int]
+
+
+class RunMetrics(TypedDict):
+    command: Optional[str]
+    version: Optional[str]
+    started_at: float
+    wall_seconds: float
+    requests: int
+    bytes_received: int
+    rate_limits: int
+    rate_limit_wait_seconds: float
+    retries: int
+    retry_wait_seconds: float
+    circuit_breaks: int
+    rows_written: int
+    stages: dict[str, StageMetrics]
+    memory: "NotRequired[MemoryMetrics]"
+
+
+def _empty_stage(calls: int) -> StageMetrics:
+    return {
+        "seconds": 0.0,
+        "calls": calls,
+        "rows": 0,
+        "requests": 0,
+        "bytes_received": 0,
+        "rate_limit_wait_seconds": 0.0,
+    }
+
+
+def _package_version() -> Optional[str]:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version("reddit-user-to-sqlite")
+    except PackageNotFoundError:
+        return None
+
+
+def max_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def format_bytes(num_bytes: float) -> str:
+    for unit in ["B", "KB", "MB"]:
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} GB"
+
+
+class Metrics:
+    """
+    collects timings and counts for a single run. Safe to share between threads.
+
+    With `track_memory`, each stage also records its peak and retained python
+    allocations using tracemalloc. That slows things down quite a bit, so it's off by
+    default. tracemalloc has a single, process-wide peak counter, so a stage's memory is
+    only recorded when no other stage (on any thread) was open at any point while it
+    ran. Calls that overlapped are counted instead, and only the run's overall peak
+    covers them.
+    """
+
+    def __init__(self, command: Optional[str] = None, track_memory=False) -> None:
+        self.command = command
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        # the stage each thread is in, so requests can be credited to it
+        self._current = threading.local()
+
+        self.stages: dict[str, StageMetrics] = {}
+        self.requests = 0
+        self.bytes_received = 0
+        self.rate_limits = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.retries = 0
+        self.retry_wait_seconds = 0.0
+        self.circuit_breaks = 0
+
+        self.track_memory = track_memory
+        self._started_tracing = False
+        self._peak_traced_bytes = 0
+        # one flag per open stage, set once another stage opens alongside it
+        self._open_stages: list[list[bool]] = []
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """
+        times the body of the `with` block as part of stage `name`. Add to the yielded
+        record's `rows` to count what the stage produced. Requests made on this thread
+        while it's open are counted towards it, too.
+        """
+        record = _empty_stage(calls=1)
+        outer: Optional[StageMetrics] = getattr(self._current, "record", None)
+        self._current.record = record
+        overlapped = [False]
+        if self.track_memory:
+            with self._lock:
+                if self._open_stages:
+                    for flag in [*self._open_stages, overlapped]:
+                        flag[0] = True
+                else:
+                    # nothing else is measuring, so the peak counter is ours to reset
+                    self._note_peak()
+                    tracemalloc.reset_peak()
+                self._open_stages.append(overlapped)
+                start_bytes = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self._current.record = outer
+            record["seconds"] = time.perf_counter() - start
+            if self.track_memory:
+                with self._lock:
+                    self._open_stages.remove(overlapped)
+                    current, peak = tracemalloc.get_traced_memory()
+                    self._note_peak()
+                if overlapped[0]:
+                    record["overlapped_calls"] = 1
+                else:
+                    record["peak_bytes"] = max(0, peak - start_bytes)
+                    record["retained_bytes"] = current - start_bytes
+            self._add_stage(name, record)
+
+    def _note_peak(self):
+        # call with the lock held
+        self._peak_traced_bytes = max(
+            self._peak_traced_bytes, tracemalloc.get_traced_memory()[1]
+        )
+
+    def _add_stage(self, name: str, record: StageMetrics):
+        with self._lock:
+            total = self.stages.setdefault(name, _empty_stage(calls=0))
+            for key in (
+                "seconds",
+                "calls",
+                "rows",
+                "requests",
+                "bytes_received",
+                "rate_limit_wait_seconds",
+            ):
+                total[key] += record[key]  # type: ignore
+            if "peak_bytes" in record:
+                total["peak_bytes"] = max(
+                    total.get("peak_bytes", 0), record["peak_bytes"]
+                )
+                total["retained_bytes"] = (
+                    total.get("retained_bytes", 0) + record["retained_bytes"]
+                )
+            if "overlapped_calls" in record:
+                total["overlapped_calls"] = (
+                    total.get("overlapped_calls", 0) + record["overlapped_calls"]
+                )
+
+    def record_request(self, num_bytes: int):
+        # only this thread touches its open stage, so that doesn't need the lock
+        if stage := getattr(self._current, "record", None):
+            stage["requests"] += 1
+            stage["bytes_received"] += num_bytes
+        with self._lock:
+            self.requests += 1
+            self.bytes_received += num_bytes
+
+    def record_rate_limit(self, wait_seconds: float):
+        if stage := getattr(self._current, "record", None):
+            stage["rate_limit_wait_seconds"] += wait_seconds
+        with self._lock:
+            self.rate_limits += 1
+            self.rate_limit_wait_seconds += wait_seconds
+
+    def record_retry(self, wait_seconds: float):
+        with self._lock:
+            self.retries += 1
+            self.retry_wait_seconds += wait_seconds
+
+    def record_circuit_break(self):
+        with self._lock:
+            self.circuit_breaks += 1
+
+    def stop(self):
+        """
+        stops tracemalloc, if this started it
+        """
+        if self._started_tracing:
+            with self._lock:
+                self._peak_traced_bytes = max(
+                    self._peak_traced_bytes, tracemalloc.get_traced_memory()[1]
+                )
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def report(self) -> RunMetrics:
+        with self._lock:
+            report: RunMetrics = {
+                "command": self.command,
+                "version": _package_version(),
+                "started_at": self.started_at,
+                "wall_seconds": time.perf_counter() - self._started,
+                "requests": self.requests,
+                "bytes_received": self.bytes_received,
+                "rate_limits": self.rate_limits,
+                "rate_limit_wait_seconds": self.rate_limit_wait_seconds,
+                "retries": self.retries,
+                "retry_wait_seconds": self.retry_wait_seconds,
+                "circuit_breaks": self.circuit_breaks,
+                "rows_written": self.stages.get(ITEM_UPSERT, {"rows": 0})["rows"],
+                "stages": {name: {**s} for name, s in self.stages.items()},  # type: ignore
+            }
+            if self.track_memory:
+                report["memory"] = {
+                    "peak_traced_bytes": self._peak_traced_bytes,
+                    "max_rss_bytes": max_rss_bytes(),
+                }
+            return report
+
+    def memory_summary(self) -> str:
+        """
+        a human-readable table of each stage's memory use
+        """
+        report = self.report()
+        lines = ["memory by stage (peak / retained):"]
+        for name, s in report["stages"].items():
+            if "peak_bytes" in s:
+                line = f"  {name:<26} {format_bytes(s['peak_bytes']):>10} / {format_bytes(s['retained_bytes'])}"
+                if overlapped := s.get("overlapped_calls"):
+                    line += f" ({overlapped} of {s['calls']} calls overlapped other stages and weren't measured)"
+            else:
+                line = f"  {name:<26} not measured; it always overlapped other stages"
+            lines.append(line)
+        if memory := report.get("memory"):
+            lines.append(
+                f"  peak python allocations: {format_bytes(memory['peak_traced_bytes'])}"
+            )
+            if memory["max_rss_bytes"] is not None:
+                lines.append(
+                    f"  max resident set size: {format_bytes(memory['max_rss_bytes'])}"
+                )
+        return "\n".join(lines)
+
+    def write_json(self, path: Path):
+        path.write_text(json.dumps(self.report(), indent=2))
@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Mapping, Optional, TypedDict
+
+if TYPE_CHECKING:
+    from typing import NotRequired
+
+    import requests
+
+OAUTH_BASE_URL = "https://oauth.reddit.com"
+TOKEN_URL = "https://www.reddit.com/api/v1/access_token"
+
+# tokens are re-requested this many seconds before reddit says they expire, so one
+# can't run out between being handed to a request and reddit checking it
+REFRESH_MARGIN = 60
+
+
+class OAuthCredentials(TypedDict):
+    # from https://www.reddit.com/prefs/apps
+    client_id: str
+    client_secret: str
+    # only for "script" apps, which act as the account that created them
+    username: "NotRequired[str]"
+    password: "NotRequired[str]"
+
+
+class OAuthError(Exception):
+    """
+    raised when reddit won't hand out a token, usually because of bad credentials
+    """
+
+
+def credentials_from_env(
+    environ: Mapping[str, str] = os.environ,
+) -> Optional[OAuthCredentials]:
+    """
+    reads `REDDIT_CLIENT_ID` and `REDDIT_CLIENT_SECRET` (plus `REDDIT_USERNAME` and
+    `REDDIT_PASSWORD`, for script apps). Returns `None` unless both of the first two
+    are set.
+    """
+    client_id = environ.get("REDDIT_CLIENT_ID")
+    client_secret = environ.get("REDDIT_CLIENT_SECRET")
+    if not (client_id and client_secret):
+        return None
+
+    credentials: OAuthCredentials = {
+        "client_id": client_id,
+        "client_secret": client_secret,
+    }
+    username, password = environ.get("REDDIT_USERNAME"), environ.get("REDDIT_PASSWORD")
+    if username and password:
+        credentials["username"] = username
+        credentials["password"] = password
+    return credentials
+
+
+class TokenProvider:
+    """
+    hands out bearer tokens for a reddit app, fetching a new one shortly before the
+    current one expires
+    """
+
+    def __init__(
+        self,
+        credentials: OAuthCredentials,
+        token_url: Optional[str] = None,
+        refresh_margin: float = REFRESH_MARGIN,
+        timeout: float = 30,
+    ) -> None:
+        self.credentials = credentials
+        self.token_url = token_url or os.environ.get("REDDIT_TOKEN_URL") or TOKEN_URL
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.tokens_fetched = 0
+
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def get_token(self, session: requests.Session) -> str:
+        with self._lock:
+            if self._token is None or time.monotonic() >= self._expires_at:
+                self._fetch(session)
+            return self._token  # type: ignore
+
+    def invalidate(self, token: str):
+        """
+        drops `token` (e.g. after reddit rejected it), so the next request gets a new
+        one. Does nothing if another thread has already replaced it.
+        """
+        with self._lock:
+            if token == self._token:
+                self._token = None
+
+    def _fetch(self, session: requests.Session):
+        if "username" in self.credentials and "password" in self.credentials:
+            data = {
+                "grant_type": "password",
+                "username": self.credentials["username"],
+                "password": self.credentials["password"],
+            }
+        else:
+            data = {"grant_type": "client_credentials"}
+
+        requested_at = time.monotonic()
+        response = session.post(
+            self.token_url,
+            data=data,
+            auth=(self.credentials["client_id"], self.credentials["client_secret"]),
+            timeout=self.timeout,
+        )
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+
+        # bad passwords get a 200 with an `error`; bad app credentials get a 401
+        if response.status_code != 200 or "access_token" not in result:
+            raise OAuthError(
+                f"Unable to get an OAuth token from reddit (HTTP {response.status_code}): {result.get('message') or result.get('error') or response.text[:200]}"
+            )
+
+        self._token = result["access_token"]
+        self._expires_at = (
+            requested_at + float(result.get("expires_in", 3600)) - self.refresh_margin
+        )
+        self.tokens_fetched += 1
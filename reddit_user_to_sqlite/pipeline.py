@@ -0,0 +1,88 @@
+import queue
+import threading
+from typing import Callable, Iterable, Sequence, TypeVar
+
+from reddit_user_to_sqlite.profiling import profile_thread
+
+T = TypeVar("T")
+
+# how many batches each fetcher may get ahead of the writer
+DEFAULT_MAX_PENDING = 4
+
+
+class _Failed:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+
+
+_DONE = object()
+
+
+def fetch_and_write(
+    producers: Sequence[Iterable[T]],
+    write: Callable[[T], None],
+    max_pending: int = DEFAULT_MAX_PENDING,
+    in_order=True,
+):
+    """
+    iterates each of the `producers` on its own fetcher thread, while `write` is called
+    with everything they yield on the calling thread (which owns the db connection), so
+    network requests and sqlite writes overlap.
+
+    By default, items are written in producer order: everything from the first
+    producer, then the second, and so on. Each producer has its own bounded queue; once
+    it's full, that fetcher waits for the writer to catch up. If the order doesn't
+    matter, pass `in_order=False` to write items as they arrive instead, so no fetcher
+    waits on the ones ahead of it. They share a single queue.
+
+    If a producer raises, its exception is re-raised here when the writer reaches it.
+    """
+    stop = threading.Event()
+    if in_order:
+        queues: list[queue.Queue] = [
+            queue.Queue(maxsize=max_pending) for _ in producers
+        ]
+    else:
+        shared: queue.Queue = queue.Queue(maxsize=max_pending * len(producers))
+        queues = [shared] * len(producers)
+
+    def _put(q: queue.Queue, item) -> bool:
+        # don't block forever if the writer has given up
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @profile_thread
+    def _fetch(producer: Iterable[T], q: queue.Queue):
+        try:
+            for item in producer:
+                if not _put(q, item):
+                    return
+        except Exception as e:
+            _put(q, _Failed(e))
+        else:
+            _put(q, _DONE)
+
+    threads = [
+        threading.Thread(target=_fetch, args=(producer, q), daemon=True)
+        for producer, q in zip(producers, queues)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        # in order, this waits for each queue's end in turn; otherwise, it waits for
+        # every producer's end to come through the shared queue
+        for q in queues:
+            while (item := q.get()) is not _DONE:
+                if isinstance(item, _Failed):
+                    raise item.error
+                write(item)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,138 @@
+from __future__ import annotations
+
+import sys
+import threading
+from collections import defaultdict
+from functools import wraps
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional, TypeVar
+
+if TYPE_CHECKING:
+    import cProfile
+    import pstats
+
+F = TypeVar("F", bound=Callable)
+
+PACKAGE_DIR = Path(__file__).parent
+
+# before 3.12, cProfile only sees the thread that enabled it, so worker threads each get
+# their own profiler while one is running. `None` means we're not profiling. Newer
+# versions are built on `sys.monitoring`, which covers every thread (and only allows
+# one profiler at a time).
+_PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+_thread_profilers: Optional[list[cProfile.Profile]] = None
+_lock = threading.Lock()
+
+
+def start_profiling() -> cProfile.Profile:
+    """
+    starts profiling the calling thread, plus any thread that runs a `profile_thread`
+    function until `stop_profiling` is called
+    """
+    global _thread_profilers
+    import cProfile
+
+    _thread_profilers = []
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiling(profiler: cProfile.Profile) -> pstats.Stats:
+    """
+    stops profiling and returns the combined stats from every profiled thread
+    """
+    global _thread_profilers
+    import pstats
+
+    profiler.disable()
+    with _lock:
+        thread_profilers, _thread_profilers = _thread_profilers or [], None
+
+    stats = pstats.Stats(profiler)
+    if thread_profilers:
+        stats.add(*thread_profilers)
+    return stats
+
+
+def profile_thread(func: F) -> F:
+    """
+    wraps `func` so that, if profiling is on, its calls are included in the profile.
+    Use it for anything that's run on a worker thread.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if _thread_profilers is None or _PROFILES_ALL_THREADS:
+            return func(*args, **kwargs)
+
+        import cProfile
+
+        profiler = cProfile.Profile()
+        with _lock:
+            if _thread_profilers is not None:
+                _thread_profilers.append(profiler)
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+
+    return wrapper  # type: ignore
+
+
+def module_label(filename: str) -> str:
+    """
+    groups a profiled function by where it lives: our own modules by name (e.g.
+    `reddit_api`), third-party code by package (e.g. `sqlite_utils`), and C functions
+    (like sqlite's `execute`) as `builtins`
+    """
+    if filename == "~" or filename.startswith("<"):
+        return "builtins"
+
+    path = Path(filename)
+    if path.parent == PACKAGE_DIR:
+        return path.stem
+
+    parts = path.parts
+    if "site-packages" in parts and (i := parts.index("site-packages")) + 1 < len(
+        parts
+    ):
+        return Path(parts[i + 1]).stem
+
+    return "stdlib"
+
+
+def summarize_stats(stats: pstats.Stats, limit: int = 5) -> str:
+    """
+    a short report of where the time went: total self time per module, then the
+    functions with the most cumulative time in each of this package's modules
+    """
+    # keys are (filename, lineno, funcname); values are
+    # (primitive calls, total calls, self time, cumulative time, callers)
+    raw_stats: dict = stats.stats  # type: ignore
+
+    self_time: dict[str, float] = defaultdict(float)
+    ours: dict[str, list[tuple[float, int, str]]] = defaultdict(list)
+    for (filename, lineno, funcname), timings in raw_stats.items():
+        _, calls, tottime, cumtime, _ = timings
+        label = module_label(filename)
+        self_time[label] += tottime
+        # the profiler's own bookkeeping isn't interesting
+        if Path(filename).parent == PACKAGE_DIR and label != "profiling":
+            ours[label].append((cumtime, calls, f"{funcname} (line {lineno})"))
+
+    lines = ["time spent per module (excluding calls into other modules):"]
+    lines += [
+        f"  {seconds:8.3f}s  {label}"
+        for label, seconds in sorted(self_time.items(), key=lambda i: -i[1])[:10]
+    ]
+
+    for label in sorted(ours, key=lambda m: -max(f[0] for f in ours[m])):
+        lines.append(f"\nhottest functions in {label} (cumulative):")
+        lines += [
+            f"  {cumtime:8.3f}s  {name}, {calls} calls"
+            for cumtime, calls, name in sorted(ours[label], reverse=True)[:limit]
+        ]
+
+    return "\n".join(lines)
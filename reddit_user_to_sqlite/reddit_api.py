@@ -1,8 +1,16 @@
+import itertools
 import os
+import random
+import threading
+import time
+from collections import deque
 from typing import (
     TYPE_CHECKING,
     Any,
+    Callable,
+    Iterator,
     Literal,
+    Mapping,
     Optional,
     Sequence,
     TypedDict,
@@ -13,15 +21,22 @@ from typing import (
 )
 
 import click
-import requests
-from tqdm import tqdm, trange
 
-from reddit_user_to_sqlite.helpers import batched
+from reddit_user_to_sqlite.helpers import SeenIds, batched
+from reddit_user_to_sqlite.metrics import INFO_FETCH, LISTING_FETCH, Metrics
+from reddit_user_to_sqlite.oauth import (
+    OAUTH_BASE_URL,
+    TokenProvider,
+    credentials_from_env,
+)
 
 if TYPE_CHECKING:
     from typing import NotRequired
 
+    import requests
+
 USER_AGENT = "reddit-user-to-sqlite"
+DEFAULT_BASE_URL = "https://www.reddit.com"
 
 
 class SubredditFragment(TypedDict):
@@ -42,16 +57,13 @@ class UserFragment(TypedDict):
 
 
 class Comment(SubredditFragment, UserFragment):
-    # this is only the relevant fields from the response
+    # these are the only fields kept from the response; see `decode_child`
 
     ## COMMENT
     # short ID
     id: str
-    # full ID
-    name: str
 
     total_awards_received: int
-    gilded: int
 
     # the ID of a post or comment
     parent_id: str
@@ -61,7 +73,6 @@ class Comment(SubredditFragment, UserFragment):
     controversiality: int
     # plaintext (or markdown?)
     body: str
-    body_html: str
     # is the commenter OP?
     is_submitter: bool
     # 1682464342.0,
@@ -70,17 +81,13 @@ class Comment(SubredditFragment, UserFragment):
     permalink: str
 
     ## POST
-    # post title
-    link_title: str
-    num_comments: int
     # post ID
     link_id: str
-    link_permalink: str
-    # "r/consoledeals",
-    subreddit_name_prefixed: str
 
 
 class Post(SubredditFragment, UserFragment):
+    # these are the only fields kept from the response; see `decode_child`
+
     # no prefix
     id: str
 
@@ -98,7 +105,6 @@ class Post(SubredditFragment, UserFragment):
     total_awards_received: int
 
     num_comments: int
-    over_18: bool
 
     # timestamp
     created: float
@@ -114,6 +120,25 @@ class ResourceWrapper(TypedDict):
     data: Union[Comment, Post]
 
 
+# API children have 100+ fields, but we only store a dozen or so. Dropping the rest as
+# soon as a child is decoded keeps items small while they wait to be written.
+FIELDS_BY_KIND: dict[str, tuple[str, ...]] = {
+    "t1": tuple(Comment.__annotations__),
+    "t3": tuple(Post.__annotations__),
+}
+
+
+def decode_child(child: ResourceWrapper) -> Union[Comment, Post]:
+    """
+    returns a compact copy of a listing child's data, keeping only the fields declared
+    on `Comment` or `Post`. Other kinds of children are returned as-is.
+    """
+    data = child["data"]
+    if not (fields := FIELDS_BY_KIND.get(child["kind"])):
+        return data
+    return cast(Union[Comment, Post], {f: data[f] for f in fields if f in data})
+
+
 class SuccessResponse(TypedDict):
     kind: Literal["Listing", "t2"]
 
@@ -170,22 +195,209 @@ class RedditRateLimitException(Exception):
     def __init__(self, headers: ErrorHeaders) -> None:
         super().__init__("Rate limited by Reddit")
 
-        self.used = int(headers["x-ratelimit-used"])
-        self.remaining = int(headers["x-ratelimit-remaining"])
+        # reddit sometimes sends these as floats, e.g. `"99.0"`
+        self.used = int(float(headers["x-ratelimit-used"]))
+        self.remaining = int(float(headers["x-ratelimit-remaining"]))
         self.window_total = self.used + self.remaining
-        self.reset_after_seconds = int(headers["x-ratelimit-reset"])
+        self.reset_after_seconds = int(float(headers["x-ratelimit-reset"]))
 
     @property
     def stats(self) -> str:
         return f"Used {self.used}/{self.window_total} requests (resets in {self.reset_after_seconds} seconds)"
 
 
-def _unwrap_response_and_raise(response: requests.Response):
-    result = response.json()
+class BudgetExhaustedException(Exception):
+    """
+    raised when a run has used all of the requests or time it was given
+    """
+
+
+class RequestBudget:
+    """
+    caps the requests and/or wall time a run may use; `spend()` raises a
+    `BudgetExhaustedException` once either runs out
+    """
+
+    def __init__(
+        self, max_requests: Optional[int] = None, max_duration: Optional[float] = None
+    ) -> None:
+        self.max_requests = max_requests
+        self.max_duration = max_duration
+        self.requests_made = 0
+        self.started_at = time.monotonic()
+        # set to a human-readable reason once the budget runs out
+        self.exhausted: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def check(self) -> Optional[str]:
+        """
+        returns the reason the budget is used up, if it is
+        """
+        if self.exhausted:
+            pass
+        elif self.max_requests is not None and self.requests_made >= self.max_requests:
+            self.exhausted = f"used all {self.max_requests} allowed requests"
+        elif (
+            self.max_duration is not None
+            and time.monotonic() - self.started_at >= self.max_duration
+        ):
+            self.exhausted = f"ran for the allowed {self.max_duration:g} seconds"
+
+        return self.exhausted
+
+    def spend(self):
+        with self._lock:
+            if reason := self.check():
+                raise BudgetExhaustedException(reason)
+
+            self.requests_made += 1
+
+
+class RedditUnavailableException(Exception):
+    """
+    raised when a request still fails after all of its retries
+    """
+
+
+# server errors and gateway timeouts usually go away on their own
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+
+
+class RetryPolicy:
+    """
+    how often a `RedditClient` retries requests that fail in passing (dropped
+    connections, timeouts, and 5xx responses), and how long it waits on each one
+    """
+
+    def __init__(
+        self,
+        max_retries=3,
+        timeout: float = 30,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+    ) -> None:
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def backoff(self, attempt: int) -> float:
+        """
+        seconds to wait before retrying after the `attempt`th try (counting from 0)
+        """
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**attempt)
+        )
+
+
+class CircuitBreaker:
+    """
+    stops every request for `cooldown` seconds once `failure_threshold` of the last
+    `window` requests have failed
+    """
+
+    def __init__(
+        self,
+        window=20,
+        min_requests=10,
+        failure_threshold=0.5,
+        cooldown: float = 30,
+    ) -> None:
+        self.min_requests = min_requests
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures: deque[bool] = deque(maxlen=window)
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, failed: bool) -> bool:
+        """
+        notes how a request went, returning True if that opened the circuit
+        """
+        with self._lock:
+            self._failures.append(failed)
+            if len(self._failures) < self.min_requests or sum(
+                self._failures
+            ) < self.failure_threshold * len(self._failures):
+                return False
+
+            # start counting from scratch once the cooldown is over
+            self._failures.clear()
+            self._open_until = time.monotonic() + self.cooldown
+            return True
+
+    @property
+    def paused_for(self) -> float:
+        """
+        seconds until requests can be made again; 0 if the circuit is closed
+        """
+        return max(0, self._open_until - time.monotonic())
+
+    def wait(self):
+        while (delay := self.paused_for) > 0:
+            time.sleep(delay)
+
+
+class RequestPacer:
+    """
+    spreads requests evenly over what's left of reddit's rate limit window, going by the
+    latest `x-ratelimit-*` headers (or `interval` seconds apart until they arrive)
+    """
+
+    def __init__(self, interval: float = 0) -> None:
+        self.interval = interval
+        self._last_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def update(self, headers: Mapping[str, str]):
+        if "x-ratelimit-remaining" in headers and "x-ratelimit-reset" in headers:
+            remaining = float(headers["x-ratelimit-remaining"])
+            reset_after = float(headers["x-ratelimit-reset"])
+            with self._lock:
+                self.interval = reset_after / max(remaining, 1)
+
+    def wait(self):
+        """
+        blocks until it's this request's turn, `interval` after the previous one started
+        """
+        with self._lock:
+            now = time.monotonic()
+            start_at = now if self._last_at is None else self._last_at + self.interval
+            self._last_at = start_at = max(now, start_at)
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+# OAuth clients get 100 requests a minute, averaged over 10 minutes
+AUTHENTICATED_INTERVAL = 60 / 100
+
+
+class RedditRequestError(ValueError):
+    """
+    raised when Reddit refuses or mangles a request no matter what it asked for, e.g. an
+    HTML error page or missing permissions
+    """
+
+
+# reddit answers these for the request as a whole, not for any particular id
+REFUSED_STATUSES = {401, 403}
+
+
+def _unwrap_response_and_raise(response: "requests.Response"):
+    try:
+        result = response.json()
+    except ValueError as e:
+        raise RedditRequestError(
+            f"Received a non-JSON response from Reddit (HTTP {response.status_code})"
+        ) from e
 
     if "error" in result:
         if result["error"] == 429:
             raise RedditRateLimitException(cast(ErrorHeaders, response.headers))
+        if result["error"] in REFUSED_STATUSES:
+            raise RedditRequestError(
+                f'Received API error from Reddit (code {result["error"]}): {result["message"]}'
+            )
 
         raise ValueError(
             f'Received API error from Reddit (code {result["error"]}): {result["message"]}'
@@ -194,94 +406,390 @@ def _unwrap_response_and_raise(response: requests.Response):
     return result
 
 
-def _call_reddit_api(url: str, params: Optional[dict[str, Any]] = None):
-    return _unwrap_response_and_raise(
-        requests.get(
-            url,
-            {"raw_json": 1, "limit": PAGE_SIZE, **(params or {})},  # type: ignore
-            headers={"user-agent": USER_AGENT},
+class RedditClient:
+    """
+    makes requests to the Reddit API over a single HTTP session, sharing one budget,
+    rate limit, and set of retries between every thread that uses it
+    """
+
+    def __init__(
+        self,
+        budget: Optional[RequestBudget] = None,
+        metrics: Optional[Metrics] = None,
+        base_url: Optional[str] = None,
+        retry: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        auth: Optional[TokenProvider] = None,
+        pacer: Optional[RequestPacer] = None,
+    ) -> None:
+        # deferred so that `--help` and friends don't pay for importing it
+        import requests
+
+        self.budget = budget or RequestBudget()
+        self.metrics = metrics or Metrics()
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        if auth is None and (credentials := credentials_from_env()):
+            auth = TokenProvider(credentials, timeout=self.retry.timeout)
+        self.auth = auth
+        self.pacer = pacer or (RequestPacer(AUTHENTICATED_INTERVAL) if auth else None)
+        self._transient_errors = (
+            requests.ConnectionError,
+            requests.Timeout,
+            # the connection dropped partway through the response
+            requests.exceptions.ChunkedEncodingError,
         )
-    )
+        self.base_url = (
+            base_url
+            or os.environ.get("REDDIT_BASE_URL")
+            or (OAUTH_BASE_URL if auth else DEFAULT_BASE_URL)
+        ).rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["user-agent"] = USER_AGENT
+
+        self.rate_limited: Optional[RedditRateLimitException] = None
+        self._rate_limited_until = 0.0
+
+    def _note_rate_limit(self, e: RedditRateLimitException):
+        self.rate_limited = e
+        self.metrics.record_rate_limit(e.reset_after_seconds)
+        self._rate_limited_until = time.monotonic() + e.reset_after_seconds
+
+    @property
+    def rate_limit_resets_in(self) -> float:
+        """
+        seconds until Reddit will accept requests again; 0 if we're not rate limited
+        """
+        if not self.rate_limited:
+            return 0
+        return max(0, self._rate_limited_until - time.monotonic())
+
+    @property
+    def stopped(self) -> Optional[str]:
+        """
+        a human-readable reason that this client can't make requests right now, if any
+        """
+        if self.rate_limited and time.monotonic() < self._rate_limited_until:
+            return f"rate limited by reddit; {self.rate_limited.stats}"
+        return self.budget.check()
+
+    def get(self, path: str, params: Optional[dict[str, Any]] = None):
+        reauthorized = False
+        for attempt in itertools.count():
+            self.breaker.wait()
+            if self.rate_limited:
+                if time.monotonic() < self._rate_limited_until:
+                    raise self.rate_limited
+                self.rate_limited = None
+
+            self.budget.spend()
+            if self.pacer:
+                self.pacer.wait()
+
+            try:
+                headers = {}
+                if self.auth:
+                    token = self.auth.get_token(self.session)
+                    headers["authorization"] = f"bearer {token}"
+                response = self.session.get(
+                    f"{self.base_url}{path}",
+                    params={"raw_json": 1, "limit": PAGE_SIZE, **(params or {})},
+                    headers=headers,
+                    timeout=self.retry.timeout,
+                )
+            except self._transient_errors as e:
+                error = f"{e.__class__.__name__}: {e}"
+            else:
+                self.metrics.record_request(len(response.content))
+                if self.pacer:
+                    self.pacer.update(response.headers)
+                # tokens can be revoked early; a fresh one should work
+                if self.auth and response.status_code == 401 and not reauthorized:
+                    self.auth.invalidate(token)
+                    reauthorized = True
+                    continue
+                if response.status_code not in TRANSIENT_STATUSES:
+                    self.breaker.record(failed=False)
+                    return self._handle_response(response)
+                error = f"HTTP {response.status_code}"
+
+            if self.breaker.record(failed=True):
+                self.metrics.record_circuit_break()
+                click.echo(
+                    f"\nMost recent requests to reddit have failed; pausing for {self.breaker.cooldown:g} seconds",
+                    err=True,
+                )
+            if attempt >= self.retry.max_retries:
+                raise RedditUnavailableException(
+                    f"gave up on {path} after {attempt + 1} tries; last error: {error}"
+                )
+
+            delay = self.retry.backoff(attempt)
+            self.metrics.record_retry(delay)
+            time.sleep(delay)
+
+    def _handle_response(self, response: "requests.Response"):
+        try:
+            result = _unwrap_response_and_raise(response)
+        except RedditRateLimitException as e:
+            self._note_rate_limit(e)
+            raise
+
+        # the last request in a window succeeds, but we know the next one won't
+        headers = cast(ErrorHeaders, response.headers)
+        if "x-ratelimit-remaining" in headers and (
+            float(headers["x-ratelimit-remaining"]) < 1
+        ):
+            self._note_rate_limit(RedditRateLimitException(headers))
+
+        return result
+
+
+def _call_reddit_api(
+    path: str,
+    params: Optional[dict[str, Any]] = None,
+    client: Optional[RedditClient] = None,
+):
+    return (client or RedditClient()).get(path, params)
 
 
 def _rate_limit_message(e: RedditRateLimitException) -> str:
     return f"Rate limited by reddit; try again in {e.reset_after_seconds} seconds. Until then, saving what we have"
 
 
-def _load_paged_resource(resource: Literal["comments", "submitted"], username: str):
+def _budget_message(
+    e: Union[BudgetExhaustedException, RedditUnavailableException], remaining: str
+) -> str:
+    return f"Stopping early ({e}); {remaining}. Until then, saving what we have"
+
+
+# called with the ids on each page; paging stops early if it returns True
+StopPagingFunc = Callable[[list[str]], bool]
+T = TypeVar("T", Comment, Post)
+
+# listings only go 1k items deep, and default to `new`. Each of these is another 1k
+# items, most of which overlap with the others.
+SortType = Literal["new", "top", "controversial"]
+TimeFilter = Literal["hour", "day", "week", "month", "year", "all"]
+EXTRA_SORTS: list[tuple[SortType, TimeFilter]] = [
+    *(("top", t) for t in ("hour", "day", "week", "month", "year", "all")),
+    ("controversial", "all"),
+]
+
+
+def _iter_paged_resource(
+    resource: Literal["comments", "submitted"],
+    username: str,
+    client: Optional[RedditClient] = None,
+    stop_paging: Optional[StopPagingFunc] = None,
+    sort: Optional[SortType] = None,
+    time_filter: Optional[TimeFilter] = None,
+) -> Iterator[list[Any]]:
     """
-    handles paging logic for arbitrary-length queries with an "after" param
+    handles paging logic for arbitrary-length queries with an "after" param, yielding
+    the items on each page. A page is only requested once the previous one has been
+    consumed.
     """
-    result = []
+    from tqdm import trange
+
+    client = client or RedditClient()
     after = None
     # max number of pages we can fetch
-    for _ in trange(10):
+    for page in trange(10, disable=bool(os.environ.get("DISABLE_PROGRESS"))):
         try:
-            response: PagedResponse = _call_reddit_api(
-                f"https://www.reddit.com/user/{username}/{resource}.json",
-                params={"after": after},
-            )
-
-            result += [c["data"] for c in response["data"]["children"]]
-            after = response["data"]["after"]
-            if len(response["data"]["children"]) < PAGE_SIZE:
-                break
+            with client.metrics.stage(LISTING_FETCH) as stage:
+                response: PagedResponse = _call_reddit_api(
+                    f"/user/{username}/{resource}.json",
+                    # unset params aren't sent
+                    params={"after": after, "sort": sort, "t": time_filter},
+                    client=client,
+                )
+                stage["rows"] = len(response["data"]["children"])
         except RedditRateLimitException as e:
             click.echo(_rate_limit_message(e), err=True)
-            break
+            return
+        except (BudgetExhaustedException, RedditUnavailableException) as e:
+            label = f"{resource} ({sort}, {time_filter})" if sort else resource
+            click.echo(
+                _budget_message(e, f"{label} stopped after {page} page(s)"),
+                err=True,
+            )
+            return
+
+        items = [decode_child(c) for c in response["data"]["children"]]
+        yield items
+
+        after = response["data"]["after"]
+        if len(items) < PAGE_SIZE or (
+            stop_paging and stop_paging([i["id"] for i in items])
+        ):
+            return
+
+
+def iter_comments_for_user(
+    username: str,
+    client: Optional[RedditClient] = None,
+    stop_paging: Optional[StopPagingFunc] = None,
+    sort: Optional[SortType] = None,
+    time_filter: Optional[TimeFilter] = None,
+) -> Iterator[list[Comment]]:
+    return _iter_paged_resource(
+        "comments",
+        username,
+        client=client,
+        stop_paging=stop_paging,
+        sort=sort,
+        time_filter=time_filter,
+    )
+
+
+def iter_posts_for_user(
+    username: str,
+    client: Optional[RedditClient] = None,
+    stop_paging: Optional[StopPagingFunc] = None,
+    sort: Optional[SortType] = None,
+    time_filter: Optional[TimeFilter] = None,
+) -> Iterator[list[Post]]:
+    return _iter_paged_resource(
+        "submitted",
+        username,
+        client=client,
+        stop_paging=stop_paging,
+        sort=sort,
+        time_filter=time_filter,
+    )
+
+
+def iter_unseen(pages: Iterator[list[T]], seen: SeenIds) -> Iterator[list[T]]:
+    """
+    yields the items on each page that aren't in `seen` yet (adding them), and stops
+    paging at the first page that has nothing new. Pages from other sorts usually
+    overlap a lot, so once one is entirely known, the rest of that listing probably
+    is too.
+    """
+    for page in pages:
+        if not (new := seen.claim(i["id"] for i in page)):
+            return
+        yield [i for i in page if i["id"] in new]
 
-    return result
 
+def load_comments_for_user(
+    username: str,
+    client: Optional[RedditClient] = None,
+    stop_paging: Optional[StopPagingFunc] = None,
+) -> list[Comment]:
+    return [
+        c
+        for page in iter_comments_for_user(username, client, stop_paging)
+        for c in page
+    ]
 
-def load_comments_for_user(username: str) -> list[Comment]:
-    return _load_paged_resource("comments", username)
 
+def load_posts_for_user(
+    username: str,
+    client: Optional[RedditClient] = None,
+    stop_paging: Optional[StopPagingFunc] = None,
+) -> list[Post]:
+    return [
+        p for page in iter_posts_for_user(username, client, stop_paging) for p in page
+    ]
 
-def load_posts_for_user(username: str) -> list[Post]:
-    return _load_paged_resource("submitted", username)
+
+def _fetch_info(
+    batch: Sequence[str], client: RedditClient
+) -> list[Union[Comment, Post]]:
+    response: PagedResponse = _call_reddit_api(
+        "/api/info.json",
+        params={"id": ",".join(batch)},
+        client=client,
+    )
+    return list(map(decode_child, response["data"]["children"]))
 
 
-def load_info(resources: Sequence[str]) -> list[Union[Comment, Post]]:
+def _load_info_batch(
+    batch: Sequence[str],
+    result: list[Union[Comment, Post]],
+    client: RedditClient,
+):
     """
-    calls the `/info` endpoint to fetch data about a sequence of resources that include the type prefix
+    fetches a single batch of fullnames into `result`. If Reddit errors on the batch,
+    it's split in half and each half is retried, so a few bad ids can't sink the
+    rest. Ids that fail on their own are logged and skipped. A `RedditRequestError`
+    isn't down to the ids, so it's raised instead.
     """
-    result = []
+    try:
+        result += _fetch_info(batch, client)
+        return
+    except RedditRequestError:
+        raise
+    except ValueError as e:
+        if len(batch) == 1:
+            click.echo(f"\nUnable to load {batch[0]}; skipping it. {e}", err=True)
+            return
+
+    midpoint = len(batch) // 2
+    _load_info_batch(batch[:midpoint], result, client)
+    _load_info_batch(batch[midpoint:], result, client)
+
+
+def iter_info(
+    resources: Sequence[str],
+    client: Optional[RedditClient] = None,
+    stage_name: str = INFO_FETCH,
+) -> Iterator[tuple[Sequence[str], list[Union[Comment, Post]]]]:
+    """
+    calls the `/info` endpoint to fetch data about a sequence of resources that include the type prefix.
+
+    Yields each batch of requested fullnames alongside the items Reddit returned for
+    it. Stops early (but cleanly) if rate limited, out of budget, or Reddit keeps
+    failing. Time and requests are recorded under the `stage_name` metrics stage.
+    """
+    from tqdm import tqdm
+
+    client = client or RedditClient()
+    num_fetched = 0
     for batch in batched(
         tqdm(resources, disable=bool(os.environ.get("DISABLE_PROGRESS"))), PAGE_SIZE
     ):
+        result = []
         try:
-            response: PagedResponse = _call_reddit_api(
-                "https://www.reddit.com/api/info.json",
-                params={"id": ",".join(batch)},
-            )
-            result += [c["data"] for c in response["data"]["children"]]
+            with client.metrics.stage(stage_name) as stage:
+                _load_info_batch(batch, result, client)
+                stage["rows"] = len(result)
         except RedditRateLimitException as e:
             click.echo(_rate_limit_message(e), err=True)
-            break
+        except (BudgetExhaustedException, RedditUnavailableException) as e:
+            click.echo(
+                _budget_message(
+                    e,
+                    f"{len(resources) - num_fetched} of {len(resources)} ids are left for the next run",
+                ),
+                err=True,
+            )
+        else:
+            num_fetched += len(batch)
+            yield batch, result
+            continue
 
-    return result
+        # keep anything a partially-bisected batch loaded, but since the batch wasn't
+        # finished, don't claim that any of its ids were requested
+        if result:
+            yield (), result
+        return
 
 
-def get_user_id(username: str) -> str:
+def load_info(
+    resources: Sequence[str], client: Optional[RedditClient] = None
+) -> list[Union[Comment, Post]]:
+    """
+    calls the `/info` endpoint to fetch data about a sequence of resources that include the type prefix
+    """
+    return [item for _, items in iter_info(resources, client=client) for item in items]
+
+
+def get_user_id(username: str, client: Optional[RedditClient] = None) -> str:
     response: UserResponse = _call_reddit_api(
-        f"https://www.reddit.com/user/{username}/about.json"
+        f"/user/{username}/about.json", client=client
     )
 
     return response["data"]["id"]
-
-
-T = TypeVar("T", Comment, Post)
-
-
-def add_missing_user_fragment(
-    items: list[T], username: str, user_fullname: str
-) -> list[T]:
-    """
-    If an item lacks user details, this adds them. Otherwise the item passes through untouched.
-    """
-    return [
-        cast(T, {**i, "author": username, "author_fullname": user_fullname})
-        if "author_fullname" not in i
-        else i
-        for i in items
-    ]
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Collection, Optional, TypedDict
+
+from reddit_user_to_sqlite.sqlite_helpers import FTS_INSTRUCTIONS
+
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
+# wrapped around matched terms in snippets, so callers can highlight them however
+# they like. Control characters won't show up in reddit text.
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+DEFAULT_LIMIT = 20
+
+# a result's position in rank order: its (rank, table, id)
+SearchCursor = tuple[float, str, str]
+
+
+class SearchResult(TypedDict):
+    table: str
+    id: str
+    timestamp: int
+    subreddit: Optional[str]
+    # only posts have titles
+    title: Optional[str]
+    permalink: str
+    snippet: str
+    # bm25; lower is a better match
+    rank: float
+
+
+def parse_search_cursor(value: str) -> SearchCursor:
+    rank, table, id_ = value.split(":", 2)
+    return float(rank), table, id_
+
+
+def format_search_cursor(result: SearchResult) -> str:
+    # repr round-trips floats exactly, so the next page starts right after this one
+    return f"{result['rank']!r}:{result['table']}:{result['id']}"
+
+
+def searchable_tables(db: Database) -> list[str]:
+    table_names = set(db.table_names())
+    return [t for t, _ in FTS_INSTRUCTIONS if f"{t}_fts" in table_names]
+
+
+def _table_query(table: str, filters: list[str]) -> str:
+    fts = f"[{table}_fts]"
+    title = "t.title" if table.endswith("posts") else "null"
+    return f"""
+        select
+            '{table}' as [table],
+            t.id,
+            t.timestamp,
+            s.name as subreddit,
+            {title} as title,
+            t.permalink,
+            snippet({fts}, -1, char(2), char(3), '…', 16) as snippet,
+            bm25({fts}) as rank
+        from {fts}
+        join [{table}] t on t.rowid = {fts}.rowid
+        left join subreddits s on s.id = t.subreddit
+        where {" and ".join([f"{fts} match :query", *filters])}
+    """
+
+
+def search(
+    db: Database,
+    query: str,
+    tables: Optional[Collection[str]] = None,
+    subreddit: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+    after: Optional[SearchCursor] = None,
+    limit: int = DEFAULT_LIMIT,
+) -> list[SearchResult]:
+    """
+    runs an FTS5 `query` against every searchable table (or just `tables`) and returns
+    the best `limit` matches, best first. Pass the last result's cursor as `after` to
+    get the next page.
+
+    The subreddit (by name) and time (`since` <= timestamp < `until`) filters are
+    checked by sqlite as it walks the full-text matches, each of which is joined to
+    its row by rowid. Narrowing by a subreddit or timestamp index first and then
+    checking each row against the full-text index is much slower, even for small
+    subreddits. bm25 scores each table against its own contents, so ranks between
+    tables are only roughly comparable.
+    """
+    filters = []
+    params: dict[str, Any] = {"query": query, "limit": limit}
+    if subreddit:
+        filters.append(
+            "t.subreddit in (select id from subreddits where name = :subreddit collate nocase)"
+        )
+        params["subreddit"] = subreddit.removeprefix("r/")
+    if since is not None:
+        filters.append("t.timestamp >= :since")
+        params["since"] = since
+    if until is not None:
+        filters.append("t.timestamp < :until")
+        params["until"] = until
+
+    selected = [t for t in searchable_tables(db) if tables is None or t in tables]
+    if not selected:
+        return []
+
+    sql = f"select * from ({' union all '.join(_table_query(t, filters) for t in selected)})"
+    if after is not None:
+        sql += " where (rank, [table], id) > (:after_rank, :after_table, :after_id)"
+        params.update(zip(["after_rank", "after_table", "after_id"], after))
+    sql += " order by rank, [table], id limit :limit"
+
+    cursor = db.execute(sql, params)
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor]  # type: ignore
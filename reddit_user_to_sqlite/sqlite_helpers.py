@@ -1,15 +1,36 @@
-from typing import Callable, Iterable, Optional, Sequence, TypedDict, TypeVar
-
-from sqlite_utils import Database
+from __future__ import annotations
+
+import json
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    TypedDict,
+    TypeVar,
+)
 
-from reddit_user_to_sqlite.csv_helpers import PrefixType, build_table_name
+from reddit_user_to_sqlite.csv_helpers import (
+    FileFingerprint,
+    PrefixType,
+    build_table_name,
+)
+from reddit_user_to_sqlite.helpers import Shard, batched
 from reddit_user_to_sqlite.reddit_api import (
     Comment,
     Post,
     SubredditFragment,
-    UserFragment,
 )
 
+if TYPE_CHECKING:
+    from sqlite_utils import Database
+
 
 class SubredditRow(TypedDict):
     id: str
@@ -27,11 +48,11 @@ def item_to_subreddit_row(item: SubredditFragment) -> SubredditRow:
     }
 
 
-def upsert_subreddits(db: Database, subreddits: Iterable[SubredditFragment]):
+def upsert_subreddit_rows(db: Database, rows: Iterable[SubredditRow]):
     # upserts are actually important here, since subs are going private/public a lot
     # https://github.com/simonw/sqlite-utils/issues/554
     db["subreddits"].upsert_all(  # type: ignore
-        map(item_to_subreddit_row, subreddits),
+        rows,
         # ignore=True,  # type: ignore
         # only relevant if creating the table
         pk="id",  # type: ignore
@@ -44,25 +65,16 @@ class UserRow(TypedDict):
     username: str
 
 
-def item_to_user_row(item: UserFragment) -> Optional[UserRow]:
-    if "author_fullname" in item:
-        return {"id": item["author_fullname"][3:], "username": item["author"]}
-
-
-def insert_users(db: Database, users: Sequence[UserFragment]):
-    existing_users = {u["id"] for u in db["users"].rows}
-
-    unique_new_users = {
-        # needs to be hashable so it's deduped
-        (u["id"], u["username"])
-        for user in users
-        if (u := item_to_user_row(user)) and u["id"] not in existing_users
-    }
-
-    new_users = [{"id": user[0], "username": user[1]} for user in unique_new_users]
+def insert_user_rows(db: Database, rows: Iterable[UserRow]):
+    """
+    inserts users that aren't stored yet; existing users are left as-is
+    """
+    # deduped by id
+    unique_users = {u["id"]: u for u in rows}
+    existing_users = find_saved_ids(db, "users", unique_users)
 
     db["users"].insert_all(  # type: ignore
-        new_users,
+        [u for user_id, u in unique_users.items() if user_id not in existing_users],
         # ignore any write error
         # ignore=True,
         # only relevant if creating the table
@@ -79,22 +91,29 @@ class CommentRow(TypedDict):
     user: str
     is_submitter: int
     subreddit: str
+    # the post this comment is on, which isn't necessarily stored
+    post: str
     permalink: str
     controversiality: int
     num_awards: int
 
 
-def comment_to_comment_row(comment: Comment) -> Optional[CommentRow]:
-    if "author_fullname" not in comment:
-        return
+def comment_to_comment_row(
+    comment: Comment, user_id: Optional[str] = None
+) -> Optional[CommentRow]:
+    if user_id is None:
+        if "author_fullname" not in comment:
+            return
+        user_id = comment["author_fullname"][3:]  # strip leading t2_
 
     return {
         "id": comment["id"],
         "timestamp": int(comment["created"]),
         "score": comment["score"],
         "text": comment["body"],
-        "user": comment["author_fullname"][3:],  # strip leading t2_
+        "user": user_id,
         "subreddit": comment["subreddit_id"][3:],  # strip leading t5_
+        "post": comment["link_id"][3:],  # strip leading t3_
         "permalink": f'https://old.reddit.com{comment["permalink"]}?context=10',
         "is_submitter": int(comment["is_submitter"]),
         "controversiality": comment["controversiality"],
@@ -102,20 +121,11 @@ def comment_to_comment_row(comment: Comment) -> Optional[CommentRow]:
     }
 
 
-T = TypeVar("T")
-U = TypeVar("U")
-
-
-def apply_and_filter(
-    filterer: Callable[[T], Optional[U]], items: Iterable[T]
-) -> list[U]:
-    return [c for c in map(filterer, items) if c]
-
-
-def upsert_comments(
-    db: Database, comments: Iterable[Comment], table_prefix: Optional[PrefixType] = None
+def upsert_comment_rows(
+    db: Database,
+    comment_rows: list[CommentRow],
+    table_prefix: Optional[PrefixType] = None,
 ) -> int:
-    comment_rows = apply_and_filter(comment_to_comment_row, comments)
     db[build_table_name("comments", table_prefix)].upsert_all(  # type: ignore
         comment_rows,
         pk="id",  # type: ignore
@@ -157,9 +167,11 @@ class PostRow(TypedDict):
     is_removed: int
 
 
-def post_to_post_row(post: Post) -> Optional[PostRow]:
-    if "author_fullname" not in post:
-        return
+def post_to_post_row(post: Post, user_id: Optional[str] = None) -> Optional[PostRow]:
+    if user_id is None:
+        if "author_fullname" not in post:
+            return
+        user_id = post["author_fullname"][3:]
 
     return {
         "id": post["id"],
@@ -169,7 +181,7 @@ def post_to_post_row(post: Post) -> Optional[PostRow]:
         "title": post["title"],
         "text": post["selftext"],
         "external_url": "" if "reddit.com" in post["url"] else post["url"],
-        "user": post["author_fullname"][3:],
+        "user": user_id,
         "subreddit": post["subreddit_id"][3:],
         "permalink": f'https://old.reddit.com{post["permalink"]}',
         "upvote_ratio": post["upvote_ratio"],
@@ -178,10 +190,9 @@ def post_to_post_row(post: Post) -> Optional[PostRow]:
     }
 
 
-def upsert_posts(
-    db: Database, posts: Iterable[Post], table_prefix: Optional[PrefixType] = None
+def upsert_post_rows(
+    db: Database, post_rows: list[PostRow], table_prefix: Optional[PrefixType] = None
 ) -> int:
-    post_rows = apply_and_filter(post_to_post_row, posts)
     db[build_table_name("posts", table_prefix)].insert_all(  # type: ignore
         post_rows,
         upsert=True,
@@ -203,6 +214,80 @@ def upsert_posts(
     return len(post_rows)
 
 
+Item = TypeVar("Item", Comment, Post)
+Row = TypeVar("Row", CommentRow, PostRow)
+
+
+def items_to_rows(
+    items: Iterable[Item],
+    item_to_row: Callable[[Item, str], Optional[Row]],
+    fallback_user: Optional[tuple[str, str]] = None,
+) -> tuple[list[Row], list[UserRow], list[SubredditRow]]:
+    """
+    turns a batch of items into their rows, plus the (deduped) users and subreddits
+    they reference, in a single pass.
+
+    Items without an author are attributed to `fallback_user` (a username and user
+    fullname) if it's given, and skipped otherwise. Their subreddits are still included.
+    """
+    rows: list[Row] = []
+    users: dict[str, UserRow] = {}
+    subreddits: dict[str, SubredditRow] = {}
+
+    for item in items:
+        subreddit = item_to_subreddit_row(item)
+        # the latest copy of a subreddit wins, same as upserting them one by one
+        subreddits[subreddit["id"]] = subreddit
+
+        if "author_fullname" in item:
+            username, user_fullname = item["author"], item["author_fullname"]
+        elif fallback_user:
+            username, user_fullname = fallback_user
+        else:
+            continue
+
+        user_id = user_fullname[3:]
+        if user_id not in users:
+            users[user_id] = {"id": user_id, "username": username}
+        if row := item_to_row(item, user_id):
+            rows.append(row)
+
+    return rows, list(users.values()), list(subreddits.values())
+
+
+PARENT_POSTS_TABLE = build_table_name("posts", "parent_")
+
+
+def find_missing_parent_posts(db: Database) -> list[str]:
+    """
+    returns the (unprefixed) ids of the posts that stored comments are on, but which
+    aren't in any of the posts tables yet. Each post is listed once, no matter how many
+    comments are on it.
+    """
+    table_names = set(db.table_names())
+    comment_tables = [
+        t
+        for t in ("comments", "saved_comments")
+        # comments saved by older versions don't know their post
+        if t in table_names and "post" in db[t].columns_dict
+    ]
+    if not comment_tables:
+        return []
+
+    post_tables = [
+        t for t in ("posts", "saved_posts", PARENT_POSTS_TABLE) if t in table_names
+    ]
+    sql = " union ".join(
+        f"select distinct post from [{t}] where post is not null"
+        for t in comment_tables
+    )
+    if post_tables:
+        sql = f"select post from ({sql}) where " + " and ".join(
+            f"post not in (select id from [{t}])" for t in post_tables
+        )
+    return [row[0] for row in db.execute(sql)]
+
+
 FTS_INSTRUCTIONS: list[tuple[str, list[str]]] = [
     ("comments", ["text"]),
     ("posts", ["title", "text"]),
@@ -216,3 +301,283 @@ def ensure_fts(db: Database):
     for table, columns in FTS_INSTRUCTIONS:
         if table in table_names and f"{table}_fts" not in table_names:
             db[table].enable_fts(columns, create_triggers=True)
+
+
+ARCHIVE_FILES_TABLE = "archive_files"
+
+
+class ArchiveFileRow(FileFingerprint):
+    # matches the table the file is loaded into, e.g. `saved_comments`
+    filename: str
+    # fullnames from the file that weren't in the db after the last run
+    pending_ids: list[str]
+    # `INDEX/COUNT` if the last run only loaded one shard, since `pending_ids` only
+    # covers that shard's ids
+    shard: Optional[str]
+
+
+def get_archive_file_row(db: Database, filename: str) -> Optional[ArchiveFileRow]:
+    from sqlite_utils.db import NotFoundError
+
+    try:
+        row = db[ARCHIVE_FILES_TABLE].get(filename)  # type: ignore
+    except NotFoundError:
+        return None
+
+    return {
+        # rows from before sharding was tracked were always for the whole file
+        "shard": None,
+        **row,
+        "pending_ids": json.loads(row["pending_ids"]),
+    }  # type: ignore
+
+
+def format_shard(shard: Optional[Shard]) -> Optional[str]:
+    return f"{shard.index}/{shard.count}" if shard else None
+
+
+def find_saved_ids(db: Database, table_name: str, ids: Iterable[str]) -> set[str]:
+    """
+    returns the subset of (unprefixed) `ids` that are already stored in `table_name`
+    """
+    if not db[table_name].exists():
+        return set()
+
+    result = set()
+    # stay well under sqlite's max number of query variables
+    for batch in batched(ids, 500):
+        result.update(
+            row[0]
+            for row in db.execute(
+                f"select id from [{table_name}] where id in ({', '.join('?' * len(batch))})",
+                batch,
+            )
+        )
+    return result
+
+
+def find_user_item_ids(db: Database, table_name: str, username: str) -> set[str]:
+    """
+    returns the ids of everything by `username` that's stored in `table_name`. Like
+    reddit, usernames are matched regardless of case.
+    """
+    if not (db[table_name].exists() and db["users"].exists()):
+        return set()
+
+    return {
+        row[0]
+        for row in db.execute(
+            f"select t.id from [{table_name}] t join users u on u.id = t.user where u.username = ? collate nocase",
+            [username],
+        )
+    }
+
+
+def upsert_archive_file(
+    db: Database,
+    filename: str,
+    fingerprint: FileFingerprint,
+    pending_ids: Sequence[str],
+    shard: Optional[Shard] = None,
+):
+    """
+    stores the fingerprint of an archive file alongside any of its `pending_ids`
+    (fullnames) that still aren't saved, so they can be retried next time. That
+    includes ids that weren't requested this run because they're waiting to be retried.
+    """
+    saved_ids = find_saved_ids(db, filename, (i[3:] for i in pending_ids))
+
+    row: ArchiveFileRow = {
+        "filename": filename,
+        "size": fingerprint["size"],
+        "mtime_ns": fingerprint["mtime_ns"],
+        "sha256": fingerprint["sha256"],
+        "pending_ids": [i for i in pending_ids if i[3:] not in saved_ids],
+        "shard": format_shard(shard),
+    }
+
+    db[ARCHIVE_FILES_TABLE].upsert(  # type: ignore
+        row,
+        pk="filename",  # type: ignore
+        # older databases don't have the `shard` column yet
+        alter=True,  # type: ignore
+        not_null=["filename", "size", "mtime_ns", "sha256"],  # type: ignore
+    )
+
+
+MISSING_ITEMS_TABLE = "missing_items"
+
+
+class MissingItemRow(TypedDict):
+    # prefixed id, e.g. `t1_abc123`
+    fullname: str
+    # unix timestamp of the most recent request for this item
+    last_tried: int
+    attempts: int
+
+
+def load_ids_to_skip(
+    db: Database, retry_after: float, now: Optional[float] = None
+) -> set[str]:
+    """
+    returns the fullnames that Reddit didn't return recently enough that they shouldn't
+    be asked for again yet. The wait doubles after every failed attempt, starting with
+    `retry_after` seconds.
+    """
+    if not db[MISSING_ITEMS_TABLE].exists():
+        return set()
+
+    return {
+        row[0]
+        for row in db.execute(
+            # cap the exponent so the shift can't overflow
+            f"select fullname from [{MISSING_ITEMS_TABLE}] where last_tried + ? * (1 << min(attempts - 1, 32)) > ?",
+            [retry_after, time.time() if now is None else now],
+        )
+    }
+
+
+def update_missing_items(
+    db: Database,
+    requested: Collection[str],
+    found: Collection[str],
+    now: Optional[float] = None,
+):
+    """
+    records an attempt for each requested fullname that wasn't `found`, and forgets
+    about any previously missing items that have since turned up
+    """
+    table = db[MISSING_ITEMS_TABLE]
+    if found and table.exists():
+        for batch in batched(found, 500):
+            db.execute(
+                f"delete from [{MISSING_ITEMS_TABLE}] where fullname in ({', '.join('?' * len(batch))})",
+                batch,
+            )
+
+    if not (missing := [f for f in requested if f not in found]):
+        return
+
+    attempts: dict[str, int] = {}
+    if table.exists():
+        for batch in batched(missing, 500):
+            attempts.update(
+                db.execute(
+                    f"select fullname, attempts from [{MISSING_ITEMS_TABLE}] where fullname in ({', '.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+            )
+
+    last_tried = int(time.time() if now is None else now)
+    rows: list[MissingItemRow] = [
+        {"fullname": f, "last_tried": last_tried, "attempts": attempts.get(f, 0) + 1}
+        for f in missing
+    ]
+    table.upsert_all(  # type: ignore
+        rows,
+        pk="fullname",  # type: ignore
+        not_null=["fullname", "last_tried", "attempts"],  # type: ignore
+    )
+
+
+def _shard_tables(db: Database) -> list[str]:
+    # archive_files only describes what's pending in that shard, so it isn't merged
+    return [
+        row[0]
+        for row in db.execute(
+            "select name from shard.sqlite_master where type = 'table' and name not like 'sqlite_%' and name not like '%_fts%' and name != ? order by rowid",
+            [ARCHIVE_FILES_TABLE],
+        )
+    ]
+
+
+def merge_shard(db: Database, shard_path: Path) -> dict[str, int]:
+    """
+    copies every row from the database at `shard_path` into `db` using set-based
+    upserts, creating or widening tables as needed. Any existing FTS indexes on the
+    merged tables are dropped; call `ensure_fts` once all shards are in.
+
+    Returns how many rows each table contributed.
+    """
+    db.execute("attach database ? as shard", [str(shard_path)])
+    try:
+        table_names = _shard_tables(db)
+        for table_name in table_names:
+            if f"{table_name}_fts" in db.table_names():
+                # updating the index row by row is much slower than rebuilding it
+                db[table_name].disable_fts()  # type: ignore
+
+        counts: dict[str, int] = {}
+        # commit each shard's rows in one go, rather than a statement at a time
+        with db.conn:
+            for table_name in table_names:
+                table = db[table_name]
+                columns = db.execute(
+                    f"pragma shard.table_info([{table_name}])"
+                ).fetchall()
+
+                if not table.exists():
+                    # reuse the shard's schema, so primary and foreign keys match
+                    (create_sql,) = db.execute(
+                        "select sql from shard.sqlite_master where name = ?",
+                        [table_name],
+                    ).fetchone()
+                    db.execute(create_sql)
+                else:
+                    existing = set(table.columns_dict)  # type: ignore
+                    for _, name, type_, *_ in columns:
+                        if name not in existing:
+                            db.execute(
+                                f"alter table [{table_name}] add column [{name}] {type_}"
+                            )
+
+                names = [c[1] for c in columns]
+                pks = [c[1] for c in sorted(columns, key=lambda c: c[5]) if c[5]]
+                column_list = ", ".join(f"[{n}]" for n in names)
+                updates = ", ".join(
+                    f"[{n}] = excluded.[{n}]" for n in names if n not in pks
+                )
+                upsert = (
+                    f"on conflict ({', '.join(f'[{p}]' for p in pks)}) "
+                    + (f"do update set {updates}" if updates else "do nothing")
+                    if pks
+                    else ""
+                )
+                db.execute(
+                    # the `where true` keeps sqlite from parsing `on` as a join constraint
+                    f"insert into main.[{table_name}] ({column_list}) select {column_list} from shard.[{table_name}] where true {upsert}"
+                )
+                (counts[table_name],) = db.execute(
+                    f"select count(*) from shard.[{table_name}]"
+                ).fetchone()
+    finally:
+        db.execute("detach database shard")
+
+    return counts
+
+
+@contextmanager
+def staged_in_memory(db_path: str) -> Iterator[Database]:
+    """
+    yields an in-memory copy of the database at `db_path` (or an empty database, if
+    there's no file yet). If the block finishes without raising, the copy is written
+    back over `db_path` with sqlite's backup API in a single transaction, so the file
+    only ever has its old contents or all of its new ones. If it raises, the file is
+    left alone.
+    """
+    import sqlite3
+
+    from sqlite_utils import Database
+
+    memory = sqlite3.connect(":memory:")
+    try:
+        if Path(db_path).exists():
+            with closing(sqlite3.connect(db_path)) as source:
+                source.backup(memory)
+
+        yield Database(memory)
+
+        with closing(sqlite3.connect(db_path)) as target:
+            memory.backup(target)
+    finally:
+        memory.close()
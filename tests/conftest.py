@@ -8,6 +8,7 @@ from sqlite_utils import Database
 
 from reddit_user_to_sqlite.reddit_api import (
     USER_AGENT,
+    Comment,
     ErrorHeaders,
     PagedResponse,
     Post,
@@ -15,6 +16,21 @@ from reddit_user_to_sqlite.reddit_api import (
 from reddit_user_to_sqlite.sqlite_helpers import CommentRow, PostRow, UserRow
 
 
+@pytest.fixture(autouse=True)
+def no_oauth_credentials(monkeypatch: pytest.MonkeyPatch):
+    """
+    keeps app credentials in the environment from sending tests through OAuth
+    """
+    for name in [
+        "REDDIT_CLIENT_ID",
+        "REDDIT_CLIENT_SECRET",
+        "REDDIT_USERNAME",
+        "REDDIT_PASSWORD",
+        "REDDIT_TOKEN_URL",
+    ]:
+        monkeypatch.delenv(name, raising=False)
+
+
 @pytest.fixture
 def tmp_db_path(tmp_path):
     """
@@ -39,7 +55,9 @@ def _wrap_response(*children) -> PagedResponse:
             "dist": 1,
             "modhash": "whatever",
             "geo_filter": "",
-            "children": [{"kind": "t_", "data": c} for c in children],
+            "children": [
+                {"kind": "t3" if "title" in c else "t1", "data": c} for c in children
+            ],
             "before": None,
         },
     }
@@ -238,6 +256,7 @@ def stored_comment() -> CommentRow:
         "permalink": "https://old.reddit.com/r/patientgamers/comments/1371yrv/what_games_do_you_guys_love_to_replay_or_never/jj0ti6f/?context=10",
         "score": 1,
         "subreddit": "2t3ad",
+        "post": "1371yrv",
         "text": "Such a great game to pick up for a run every couple of months. Every time I think I'm done, it pulls be back in.",
         "timestamp": 1683327131,
         "user": "np8mb41h",
@@ -254,6 +273,7 @@ def stored_removed_comment() -> CommentRow:
         "permalink": "https://old.reddit.com/r/askscience/comments/asdf/why_do_birds_fly/?context=10",
         "score": -1,
         "subreddit": "2qm4e",
+        "post": "puwue",
         "text": "[removed]",
         "timestamp": 1329550785,
         # manually added this - if it's stored, I must have found a user
@@ -271,6 +291,7 @@ def stored_removed_comment_placeholder_user() -> CommentRow:
         "permalink": "https://old.reddit.com/r/askscience/comments/asdf/why_do_birds_fly/?context=10",
         "score": -1,
         "subreddit": "2qm4e",
+        "post": "puwue",
         "text": "[removed]",
         "timestamp": 1329550785,
         "user": "1234567",
@@ -936,18 +957,44 @@ def pytest_addoption(parser):
     parser.addoption(
         "--include-live", action="store_true", default=False, help="run live API tests"
     )
+    parser.addoption(
+        "--include-timing",
+        action="store_true",
+        default=False,
+        help="run tests that assert on wall-clock time",
+    )
 
 
 def pytest_configure(config):
     config.addinivalue_line("markers", "live: mark test as hitting the live API")
+    config.addinivalue_line(
+        "markers", "timing: mark test as asserting on wall-clock time"
+    )
 
 
 def pytest_collection_modifyitems(config, items):
-    if config.getoption("--include-live"):
-        # include-live flag given in cli; do not skip slow tests
-        return
-
-    skip_live = pytest.mark.skip(reason="need --include-live flag to run")
-    for item in items:
-        if "live" in item.keywords:
-            item.add_marker(skip_live)
+    for marker in ["live", "timing"]:
+        if config.getoption(f"--include-{marker}"):
+            # flag given in cli; do not skip these tests
+            continue
+
+        skip = pytest.mark.skip(reason=f"need --include-{marker} flag to run")
+        for item in items:
+            if marker in item.keywords:
+                item.add_marker(skip)
+
+
+@pytest.fixture
+def decoded_comment(comment):
+    """
+    `comment`, as it looks after being decoded from an API response
+    """
+    return {k: v for k, v in comment.items() if k in Comment.__annotations__}
+
+
+@pytest.fixture
+def decoded_self_post(self_post):
+    """
+    `self_post`, as it looks after being decoded from an API response
+    """
+    return {k: v for k, v in self_post.items() if k in Post.__annotations__}
@@ -0,0 +1,104 @@
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+from sqlite_utils import Database
+
+from reddit_user_to_sqlite.archiver import Archiver
+from reddit_user_to_sqlite.reddit_api import RedditClient, RequestBudget
+from tests.conftest import MockInfoFunc, MockPagedFunc
+
+
+def test_load_user(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    self_post_response,
+    stored_comment,
+    stored_self_post,
+):
+    comments = mock_paged_request(resource="comments", json=comment_response)
+    posts = mock_paged_request(resource="submitted", json=self_post_response)
+
+    with Archiver(tmp_db_path) as archiver:
+        session = archiver.client.session
+
+        assert archiver.load_user("/u/xavdid") == (1, 1)
+        assert archiver.load_user("xavdid", incremental=True) == (1, 1)
+
+        # the same connection and session were used throughout
+        assert archiver.client.session is session
+        assert archiver.metrics.requests == 4
+
+    assert comments.call_count == 2
+    assert posts.call_count == 2
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert list(tmp_db["posts"].rows) == [stored_self_post]
+    assert {"comments_fts", "posts_fts"} <= set(tmp_db.table_names())
+
+
+@pytest.mark.usefixtures("comments_file", "posts_file")
+def test_load_archive(
+    tmp_db: Database,
+    archive_dir,
+    mock_info_request: MockInfoFunc,
+    comment_info_response,
+    post_info_response,
+    empty_file_at_path,
+):
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+    mock_info_request("t1_a,t1_c", json=comment_info_response)
+    mock_info_request("t3_d,t3_f", json=post_info_response)
+
+    archiver = Archiver(tmp_db, client=RedditClient(RequestBudget(max_requests=10)))
+
+    assert archiver.load_archive(archive_dir) == {
+        "comments": 2,
+        "saved_comments": 0,
+        "posts": 2,
+        "saved_posts": 0,
+    }
+    assert archiver.db is tmp_db
+    assert archiver.client.budget.requests_made == 2
+    assert {"comments_fts", "posts_fts"} <= set(tmp_db.table_names())
+
+
+def test_close(tmp_db_path: str):
+    with Archiver(tmp_db_path) as archiver:
+        archiver.db.execute("select 1")
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        archiver.db.execute("select 1")
+
+
+def test_close_leaves_what_it_was_given_open(
+    tmp_db: Database, monkeypatch: pytest.MonkeyPatch
+):
+    client = RedditClient()
+    closed = []
+    monkeypatch.setattr(client.session, "close", lambda: closed.append(True))
+
+    with Archiver(tmp_db, client=client):
+        pass
+
+    # both still belong to the caller
+    tmp_db.execute("select 1")
+    assert closed == []
+
+
+def test_import_skips_cli():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, reddit_user_to_sqlite.archiver; print('reddit_user_to_sqlite.cli' in sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "False"
@@ -0,0 +1,85 @@
+import json
+
+from sqlite_utils import Database
+
+from benchmarks.e2e import format_results, run_suite
+from benchmarks.micro import BASELINE_PATH, benchmarks, compare, run_benchmarks
+from benchmarks.stand_in import RedditStandIn
+from benchmarks.synthetic import archive_ids, make_id, write_archive
+
+
+def test_archive_ids_are_unique():
+    ids = archive_ids(1000)
+
+    assert sum(map(len, ids.values())) == 1000
+    assert len({i for file_ids in ids.values() for i in file_ids}) == 1000
+    assert len(make_id(0)) == len(make_id(999_999)) == 7
+
+
+def test_write_archive(tmp_path):
+    archive = write_archive(tmp_path / "archive", 100)
+
+    assert (archive / "comments.csv").read_text().count("\n") == 51
+    assert "account name,bench_user" in (archive / "statistics.csv").read_text()
+
+
+def test_stand_in_rate_limits():
+    with RedditStandIn(latency=0, requests_per_window=2) as stand_in:
+        assert stand_in.respond("/nope", {})[0] == 404
+        assert stand_in.rate_limit.take()[0]
+
+        allowed, headers = stand_in.rate_limit.take()
+        assert allowed
+        assert headers["x-ratelimit-remaining"] == "0.0"
+
+        assert not stand_in.rate_limit.take()[0]
+
+
+def test_run_suite(tmp_path):
+    # a small smoke test, so the benchmarks don't rot
+    results = run_suite(
+        [500],
+        latency=0,
+        missing_rate=0.1,
+        requests_per_window=1000,
+        window_seconds=600,
+        listing_size=150,
+        work_dir=tmp_path,
+        track_memory=True,
+    )
+
+    user, archive = results
+    assert user["command"] == "user"
+    assert user["requests_served"] == 4
+    assert archive["command"] == "archive"
+    # 325 comments and 175 posts, 100 per request
+    assert archive["requests_served"] == 6
+    assert archive["metrics"]["stages"]["info_fetch"]["rows"] > 400
+
+    db = Database(tmp_path / "archive-500.db")
+    assert db["comments"].count > 200
+    assert archive["metrics"]["memory"]["peak_traced_bytes"] > 0
+    assert "stage peak memory:" in format_results(results)
+
+
+def test_micro_baseline_covers_every_benchmark():
+    baseline = json.loads(BASELINE_PATH.read_text())
+
+    assert set(baseline) == set(benchmarks())
+
+
+def test_micro_run_benchmarks():
+    results = run_benchmarks(repeat=1, only=["item_to_subreddit_row"])
+
+    assert list(results) == ["item_to_subreddit_row"]
+    assert results["item_to_subreddit_row"] > 0
+
+
+def test_micro_compare():
+    report, regressions = compare(
+        {"fast": 1.0, "slow": 3.0, "new": 1.0}, {"fast": 1.0, "slow": 1.0}, 1.5
+    )
+
+    assert regressions == ["slow"]
+    assert "3.00x  <- slower" in report
+    assert "new" in report
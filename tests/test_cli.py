@@ -1,15 +1,21 @@
+import json
+import subprocess
+import sys
 from traceback import print_tb
 
 import pytest
 from click.testing import CliRunner
+from responses import RequestsMock, matchers
 from sqlite_utils import Database
 
-from reddit_user_to_sqlite.cli import cli
+from reddit_user_to_sqlite.cli import cli, read_usernames, watch_users
+from reddit_user_to_sqlite.reddit_api import EXTRA_SORTS, RedditClient
 from tests.conftest import (
     MockInfoFunc,
     MockPagedFunc,
     MockUserFunc,
     WriteArchiveFileFunc,
+    _wrap_response,
 )
 
 
@@ -89,10 +95,13 @@ def test_load_live_data(
     assert stored_self_post["id"] in {p["id"] for p in posts}
 
 
-def test_missing_user_errors(tmp_db_path: str, mock_paged_request: MockPagedFunc):
+def test_missing_user_errors(
+    tmp_db_path: str, mock_paged_request: MockPagedFunc, empty_response
+):
     mock_paged_request(
         resource="comments", json={"error": 404, "message": "no user by that name"}
     )
+    mock_paged_request(resource="submitted", json=empty_response)
     result = CliRunner().invoke(cli, ["user", "xavdid", "--db", tmp_db_path])
 
     assert result.exception
@@ -501,7 +510,7 @@ def test_missing_username_entirely(
     assert "some data will not be saved." in api_result.output
     assert "ignored for now" in api_result.output
 
-    assert tmp_db.table_names() == ["subreddits"]
+    assert tmp_db.table_names() == ["subreddits", "archive_files"]
 
     assert list(tmp_db["subreddits"].rows) == [
         {"id": "2qm4e", "name": "askscience", "type": "public"},
@@ -617,3 +626,1032 @@ def test_load_data_skip_saved(
     assert list(tmp_db["users"].rows) == []
     assert list(tmp_db["saved_comments"].rows) == []
     assert list(tmp_db["saved_posts"].rows) == []
+
+
+@pytest.mark.usefixtures("comments_file", "posts_file")
+def test_unchanged_archive_is_skipped(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    comment_info_response,
+    post_info_response,
+    empty_file_at_path,
+):
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    comment_request = mock_info_request("t1_a,t1_c", json=comment_info_response)
+    post_request = mock_info_request("t3_d,t3_f", json=post_info_response)
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "unchanged since the last run" not in result.output
+
+    assert {r["filename"] for r in tmp_db["archive_files"].rows} == {
+        "comments",
+        "posts",
+        "saved_comments",
+        "saved_posts",
+    }
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "comments.csv is unchanged since the last run" in result.output
+
+    # nothing new was requested
+    assert comment_request.call_count == 1
+    assert post_request.call_count == 1
+
+
+@pytest.mark.usefixtures("comments_file")
+def test_unchanged_archive_retries_missing_ids(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    comment_response,
+    empty_response,
+    empty_file_at_path,
+    modify_comment,
+    stored_comment,
+):
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    # only one of the two comments comes back
+    first_request = mock_info_request(
+        "t1_a,t1_c", json=_wrap_response(modify_comment({"id": "a"}))
+    )
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert list(tmp_db["comments"].rows) == [{**stored_comment, "id": "a"}]
+
+    retry_request = mock_info_request(
+        "t1_c", json=_wrap_response(modify_comment({"id": "c"}))
+    )
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "archive",
+            str(archive_dir),
+            "--db",
+            tmp_db_path,
+            "--retry-missing-after",
+            "0",
+        ],
+    )
+    assert not result.exception, result.exception
+    assert "retrying 1 missing comments" in result.output
+
+    assert first_request.call_count == 1
+    assert retry_request.call_count == 1
+    assert list(tmp_db["comments"].rows) == [{**stored_comment, "id": i} for i in "ac"]
+
+
+@pytest.mark.usefixtures("comments_file")
+def test_unchanged_archive_keeps_ids_waiting_to_be_retried(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    empty_file_at_path,
+    modify_comment,
+    stored_comment,
+):
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    mock_info_request("t1_a,t1_c", json=_wrap_response(modify_comment({"id": "a"})))
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    # too soon to ask about `t1_c` again, so nothing is requested...
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "retrying 0 missing comments" in result.output
+    # ...but it's still remembered
+    assert tmp_db["archive_files"].get("comments")["pending_ids"] == '["t1_c"]'
+
+    retry_request = mock_info_request(
+        "t1_c", json=_wrap_response(modify_comment({"id": "c"}))
+    )
+    result = CliRunner().invoke(
+        cli,
+        [
+            "archive",
+            str(archive_dir),
+            "--db",
+            tmp_db_path,
+            "--retry-missing-after",
+            "0",
+        ],
+    )
+    assert not result.exception, result.exception
+
+    assert retry_request.call_count == 1
+    assert list(tmp_db["comments"].rows) == [{**stored_comment, "id": i} for i in "ac"]
+
+
+@pytest.mark.usefixtures("comments_file", "posts_file")
+def test_archive_resumes_after_budget_runs_out(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    stored_comment,
+    stored_self_post,
+    comment_info_response,
+    post_info_response,
+    empty_file_at_path,
+):
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    comment_request = mock_info_request("t1_a,t1_c", json=comment_info_response)
+
+    result = CliRunner().invoke(
+        cli, ["archive", str(archive_dir), "--db", tmp_db_path, "--max-requests", "1"]
+    )
+    assert not result.exception, result.exception
+    assert "Stopped early after 1 requests" in result.output
+    assert "2 of 2 ids are left for the next run" in result.output
+
+    assert list(tmp_db["comments"].rows) == [{**stored_comment, "id": i} for i in "ac"]
+    assert list(tmp_db["posts"].rows) == []
+
+    post_request = mock_info_request("t3_d,t3_f", json=post_info_response)
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert comment_request.call_count == 1
+    assert post_request.call_count == 1
+    assert list(tmp_db["posts"].rows) == [{**stored_self_post, "id": i} for i in "df"]
+
+
+def test_user_stops_when_budget_runs_out(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    stored_comment,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--max-requests", "1"]
+    )
+    assert not result.exception, result.exception
+    assert "Stopped early after 1 requests" in result.output
+
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+
+
+def test_items_that_are_yours_and_saved_are_fetched_once(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    stored_comment,
+    stored_removed_comment,
+    stored_removed_comment_placeholder_user,
+    all_comments_response,
+    write_archive_file: WriteArchiveFileFunc,
+    empty_file_at_path,
+):
+    write_archive_file("comments.csv", ["id", "jj0ti6f", "c3sgfl4"])
+    write_archive_file("saved_comments.csv", ["id", "c3sgfl4", "jj0ti6f"])
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    comment_request = mock_info_request(
+        "t1_jj0ti6f,t1_c3sgfl4", json=all_comments_response
+    )
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "Fetching info about 2 comments" in result.output
+
+    assert comment_request.call_count == 1
+
+    assert list(tmp_db["comments"].rows) == [stored_comment, stored_removed_comment]
+    # the removed comment gets the placeholder user in the saved table
+    assert list(tmp_db["saved_comments"].rows_where(order_by="id")) == [
+        stored_removed_comment_placeholder_user,
+        stored_comment,
+    ]
+
+
+@pytest.mark.usefixtures("comments_file")
+def test_missing_ids_are_not_requested_again_right_away(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    empty_file_at_path,
+    write_archive_file: WriteArchiveFileFunc,
+    modify_comment,
+):
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+
+    first_request = mock_info_request(
+        "t1_a,t1_c", json=_wrap_response(modify_comment({"id": "a"}))
+    )
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert [(r["fullname"], r["attempts"]) for r in tmp_db["missing_items"].rows] == [
+        ("t1_c", 1)
+    ]
+
+    # even though the file changed, the missing id is left out
+    write_archive_file("comments.csv", ["id", "a", "c", "e"])
+    second_request = mock_info_request(
+        "t1_e", json=_wrap_response(modify_comment({"id": "e"}))
+    )
+
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "Skipping 1 items that weren't found recently" in result.output
+
+    assert first_request.call_count == 1
+    assert second_request.call_count == 1
+    assert [r["id"] for r in tmp_db["comments"].rows] == ["a", "e"]
+
+
+def test_archive_loads_only_its_shard(
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    tmp_db: Database,
+    empty_file_at_path,
+    write_archive_file: WriteArchiveFileFunc,
+    modify_comment,
+):
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+    write_archive_file("comments.csv", ["id", "a", "c", "e", "g"])
+
+    # t1_e and t1_g hash into the other shard
+    info_request = mock_info_request(
+        "t1_a,t1_c",
+        json=_wrap_response(modify_comment({"id": "a"}), modify_comment({"id": "c"})),
+    )
+
+    result = CliRunner().invoke(
+        cli, ["archive", str(archive_dir), "--db", tmp_db_path, "--shard", "1/2"]
+    )
+    assert not result.exception, result.exception
+
+    assert info_request.call_count == 1
+    assert [r["id"] for r in tmp_db["comments"].rows] == ["a", "c"]
+    assert tmp_db["archive_files"].get("comments")["pending_ids"] == "[]"  # type: ignore
+
+    # the file hasn't changed, but the rest of it was never looked at
+    rest_request = mock_info_request(
+        "t1_e,t1_g",
+        json=_wrap_response(modify_comment({"id": "e"}), modify_comment({"id": "g"})),
+    )
+    result = CliRunner().invoke(cli, ["archive", str(archive_dir), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert "unchanged" not in result.output
+    assert rest_request.call_count == 1
+    assert [r["id"] for r in tmp_db["comments"].rows] == ["a", "c", "e", "g"]
+
+
+def test_archive_metrics_json(
+    tmp_path,
+    tmp_db_path,
+    mock_info_request: MockInfoFunc,
+    archive_dir,
+    empty_file_at_path,
+    write_archive_file: WriteArchiveFileFunc,
+    modify_comment,
+):
+    empty_file_at_path("posts.csv")
+    empty_file_at_path("saved_comments.csv")
+    empty_file_at_path("saved_posts.csv")
+    write_archive_file("comments.csv", ["id", "a", "c"])
+    mock_info_request(
+        "t1_a,t1_c",
+        json=_wrap_response(
+            modify_comment({"id": "a"}),
+            modify_comment(
+                {"id": "c", "subreddit_id": "t5_other", "subreddit": "other"}
+            ),
+        ),
+    )
+    metrics_path = tmp_path / "metrics.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "archive",
+            str(archive_dir),
+            "--db",
+            tmp_db_path,
+            "--metrics-json",
+            str(metrics_path),
+        ],
+    )
+    assert not result.exception, result.exception
+    assert f"wrote metrics to {metrics_path}" in result.output
+
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics["command"] == "archive"
+    assert metrics["requests"] == 1
+    assert metrics["bytes_received"] > 0
+    assert metrics["rows_written"] == 2
+
+    stages = metrics["stages"]
+    assert stages["archive_scan"] == {**stages["archive_scan"], "calls": 4, "rows": 2}
+    assert stages["info_fetch"]["rows"] == 2
+    # the one request was made while fetching info
+    assert stages["info_fetch"]["requests"] == 1
+    assert stages["info_fetch"]["bytes_received"] == metrics["bytes_received"]
+    assert stages["item_upsert"]["requests"] == 0
+    # one user and two subreddits
+    assert stages["user_and_subreddit_upsert"]["rows"] == 3
+    assert stages["item_upsert"]["rows"] == 2
+    assert stages["fts"]["calls"] == 1
+    assert "bookkeeping" in stages
+    assert "memory" not in metrics
+
+
+def test_user_track_memory(
+    tmp_db_path: str,
+    tmp_path,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    empty_response,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=empty_response)
+    metrics_path = tmp_path / "metrics.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "user",
+            "xavdid",
+            "--db",
+            tmp_db_path,
+            "--track-memory",
+            "--metrics-json",
+            str(metrics_path),
+        ],
+    )
+    assert not result.exception, result.exception
+
+    assert "memory by stage (peak / retained):" in result.output
+    assert "item_upsert" in result.output
+
+    metrics = json.loads(metrics_path.read_text())
+    assert metrics["memory"]["peak_traced_bytes"] > 0
+    # fetching and writing overlap, but nothing else is running by then
+    assert metrics["stages"]["fts"]["peak_bytes"] > 0
+
+
+def _mock_other_user(mock: RequestsMock, username: str, resource: str, json):
+    return mock.get(
+        f"https://www.reddit.com/user/{username}/{resource}.json", json=json
+    )
+
+
+def test_read_usernames():
+    assert read_usernames(
+        ["xavdid\n", "\n", "# a comment\n", "/u/xavdid\n", "  u/someone  \n"]
+    ) == ["xavdid", "someone"]
+
+
+def test_load_data_for_many_users(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock: RequestsMock,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    self_post_response,
+    stored_comment,
+    stored_self_post,
+    empty_response,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=self_post_response)
+    _mock_other_user(
+        mock, "someone", "comments", {"error": 404, "message": "no user by that name"}
+    )
+
+    result = CliRunner().invoke(
+        cli, ["users", "--db", tmp_db_path], input="xavdid\nsomeone\n/u/xavdid\n"
+    )
+    assert not result.exception, result.exception
+
+    assert "loading data about 2 users" in result.output
+    assert "/u/xavdid: saved/updated 1 comments and 1 posts" in result.output
+    assert "/u/someone: Received API error from Reddit (code 404)" in result.output
+
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert list(tmp_db["posts"].rows) == [stored_self_post]
+    assert {"comments_fts", "posts_fts"} <= set(tmp_db.table_names())
+
+
+def test_load_many_users_from_file(
+    tmp_path,
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    empty_response,
+    stored_comment,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=empty_response)
+
+    (usernames := tmp_path / "users.txt").write_text("xavdid\n")
+
+    result = CliRunner().invoke(cli, ["users", str(usernames), "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+
+
+def test_many_users_share_a_budget(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    empty_response,
+    stored_comment,
+):
+    comments = mock_paged_request(resource="comments", json=comment_response)
+    posts = mock_paged_request(resource="submitted", json=empty_response)
+
+    result = CliRunner().invoke(
+        cli,
+        ["users", "--db", tmp_db_path, "--workers", "1", "--max-requests", "2"],
+        input="xavdid\nsomeone\nsomeone_else\n",
+    )
+    assert not result.exception, result.exception
+
+    assert (
+        "Stopped early (used all 2 allowed requests); 2 users weren't loaded: someone, someone_else"
+        in result.output
+    )
+    assert comments.call_count == 1
+    assert posts.call_count == 1
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+
+
+def test_load_users_in_shards(
+    tmp_path,
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    self_post_response,
+    stored_comment,
+    stored_self_post,
+    stored_user,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=self_post_response)
+
+    shard_paths = [str(tmp_path / f"shard-{i}.db") for i in range(2)]
+    # `spez` belongs to the other shard, so it's never requested
+    for i, shard_path in enumerate(shard_paths):
+        result = CliRunner().invoke(
+            cli,
+            ["users", "--db", shard_path, "--shard", f"{i}/2"],
+            input="xavdid\nspez\n" if i == 1 else "",
+        )
+        assert not result.exception, result.exception
+
+    assert "loading data about 1 users" in result.output
+
+    result = CliRunner().invoke(cli, ["merge", *shard_paths, "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert "merging 2 databases" in result.output
+    assert "shard-0.db: nothing to merge" in result.output
+    assert "shard-1.db: 1 users, 2 subreddits, 1 comments, 1 posts" in result.output
+
+    assert list(tmp_db["users"].rows) == [stored_user]
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert list(tmp_db["posts"].rows) == [stored_self_post]
+    assert {"comments_fts", "posts_fts"} <= set(tmp_db.table_names())
+    assert tmp_db.execute(
+        "select rowid from comments_fts where comments_fts match 'game'"
+    ).fetchall()
+
+
+@pytest.mark.parametrize("shard", ["1", "2/2", "a/b", "-1/2"])
+def test_bad_shard(tmp_db_path: str, shard):
+    result = CliRunner().invoke(cli, ["users", "--db", tmp_db_path, "--shard", shard])
+
+    assert result.exit_code == 2
+    assert "Invalid value for '--shard'" in result.output
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_watch_users(
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    empty_response,
+    stored_comment,
+):
+    comments = mock_paged_request(resource="comments", json=comment_response)
+    posts = mock_paged_request(resource="submitted", json=empty_response)
+    clock = FakeClock()
+
+    watch_users(
+        tmp_db,
+        RedditClient(),
+        ["xavdid"],
+        interval=60,
+        jitter=0,
+        max_syncs=3,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    assert clock.sleeps == [60, 60]
+    assert comments.call_count == 3
+    assert posts.call_count == 3
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert "comments_fts" in tmp_db.table_names()
+
+
+def test_watch_users_backs_off_on_errors(
+    tmp_db: Database, mock_paged_request: MockPagedFunc
+):
+    mock_paged_request(
+        resource="comments", json={"error": 404, "message": "no user by that name"}
+    )
+    clock = FakeClock()
+
+    watch_users(
+        tmp_db,
+        RedditClient(),
+        ["xavdid"],
+        interval=60,
+        jitter=0,
+        max_backoff=300,
+        max_syncs=4,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    assert clock.sleeps == [120, 240, 300]
+
+
+def test_watch_users_waits_out_rate_limits(
+    tmp_db: Database, mock_paged_request: MockPagedFunc, rate_limit_headers
+):
+    response = mock_paged_request(
+        resource="comments", json={"error": 429}, headers=rate_limit_headers
+    )
+    client = RedditClient()
+    clock = FakeClock()
+
+    watch_users(
+        tmp_db,
+        client,
+        ["xavdid"],
+        interval=5,
+        jitter=0,
+        max_syncs=2,
+        sleep=clock.sleep,
+        clock=clock,
+    )
+
+    # waited (about) as long as reddit asked, rather than the interval
+    assert len(clock.sleeps) == 1
+    assert 19 < clock.sleeps[0] <= 20
+    # and didn't send anything while it was rate limited
+    assert response.call_count == 1
+
+
+def test_profile(tmp_path, tmp_db_path: str):
+    shard = Database(tmp_path / "shard.db")
+    shard["comments"].insert({"id": "a", "text": "hi"}, pk="id")  # type: ignore
+    shard.close()
+    profile_path = tmp_path / "out.prof"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--profile",
+            str(profile_path),
+            "merge",
+            str(tmp_path / "shard.db"),
+            "--db",
+            tmp_db_path,
+        ],
+    )
+    assert not result.exception, result.exception
+
+    assert "merged" in result.output
+    assert "hottest functions in sqlite_helpers (cumulative):" in result.output
+    assert "merge_shard (line" in result.output
+    assert f"wrote full profile to {profile_path}" in result.output
+    assert profile_path.stat().st_size
+
+
+# generous, so it only trips if something heavy sneaks back in (it used to be ~200ms)
+STARTUP_BUDGET_MICROSECONDS = 120_000
+
+
+def _import_times(code: str) -> dict[str, int]:
+    """
+    runs `code` in a fresh interpreter and returns the cumulative import time of every
+    module it imported
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    # lines look like: `import time:  self [us] | cumulative | imported package`
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "[us]" not in line:
+            _, cumulative, name = line.split("|")
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_help_skips_heavy_imports():
+    times = _import_times(
+        "from reddit_user_to_sqlite.cli import cli; cli(['--help'], standalone_mode=False)"
+    )
+
+    assert "reddit_user_to_sqlite.cli" in times
+    assert not {"requests", "sqlite_utils", "tqdm"} & set(times)
+
+
+# timings are too noisy for the default run; `test_help_skips_heavy_imports` catches
+# the usual regressions
+@pytest.mark.timing
+def test_startup_time_budget():
+    # best of a few runs, to smooth over a noisy machine
+    fastest = min(
+        _import_times("import reddit_user_to_sqlite.cli")["reddit_user_to_sqlite.cli"]
+        for _ in range(3)
+    )
+
+    assert fastest < STARTUP_BUDGET_MICROSECONDS
+
+
+def test_export(tmp_db_path: str, tmp_db: Database, tmp_path):
+    tmp_db["comments"].insert_all(  # type: ignore
+        [{"id": i, "timestamp": t, "text": "hi"} for i, t in ["b1", "a2", "c2"]],
+        pk="id",
+    )
+
+    result = CliRunner().invoke(cli, ["export", "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    lines = result.output.splitlines()
+    assert [json.loads(line)["id"] for line in lines[:3]] == ["b", "a", "c"]
+    assert "exported 3 comments; pass `--since 2:c` to continue" in lines[3]
+
+    out = tmp_path / "comments.csv"
+    CliRunner().invoke(
+        cli,
+        ["export", "--db", tmp_db_path, "--format", "csv", "-o", str(out)],
+        catch_exceptions=False,
+    )
+    assert out.read_text() == "id,timestamp,text\nb,1,hi\na,2,hi\nc,2,hi\n"
+
+    result = CliRunner().invoke(cli, ["export", "--db", tmp_db_path, "--since", "2:a"])
+    assert json.loads(result.output.splitlines()[0])["id"] == "c"
+
+    result = CliRunner().invoke(cli, ["export", "--db", tmp_db_path, "--since", "2:c"])
+    assert result.output == "no new comments to export\n"
+
+
+def test_export_errors(tmp_db_path: str, tmp_db: Database):
+    tmp_db["users"].insert({"id": "a"})
+
+    result = CliRunner().invoke(cli, ["export", "posts", "--db", tmp_db_path])
+    assert result.exit_code == 1
+    assert "no posts have been saved" in result.output
+
+    result = CliRunner().invoke(cli, ["export", "--db", tmp_db_path, "--since", "x"])
+    assert result.exit_code == 2
+    assert "expected TIMESTAMP or TIMESTAMP:ID" in result.output
+
+
+def test_search(tmp_db_path: str, tmp_db: Database):
+    tmp_db["subreddits"].insert({"id": "a", "name": "Python"}, pk="id")
+    tmp_db["posts"].insert_all(  # type: ignore
+        [
+            {
+                "id": f"p{i}",
+                "timestamp": 1690000000,
+                "subreddit": "a",
+                "permalink": f"/p{i}",
+                "title": f"post {i}",
+                "text": "snakes " * (i + 1),
+            }
+            for i in range(3)
+        ],
+        pk="id",
+    )
+    tmp_db["posts"].enable_fts(["title", "text"], create_triggers=True)
+
+    result = CliRunner().invoke(cli, ["search", "snakes", "--db", tmp_db_path])
+    assert not result.exception, result.exception
+    assert "[posts] r/Python on 2023-07-22: /p2\n  post 2\n  snakes" in result.output
+    assert "--after" not in result.output
+
+    result = CliRunner().invoke(
+        cli, ["search", "snakes", "--db", tmp_db_path, "--limit", "2"]
+    )
+    assert "/p0" not in result.output
+    cursor = result.output.split("--after ")[1].split("`")[0]
+
+    result = CliRunner().invoke(
+        cli, ["search", "snakes", "--db", tmp_db_path, "--after", cursor]
+    )
+    assert "/p0" in result.output
+    assert "/p1" not in result.output
+
+    result = CliRunner().invoke(
+        cli, ["search", "snakes", "--db", tmp_db_path, "--since", "2023-07-23"]
+    )
+    assert result.output == "no results\n"
+
+
+def test_search_errors(tmp_db_path: str, tmp_db: Database):
+    tmp_db["users"].insert({"id": "a"})
+
+    result = CliRunner().invoke(cli, ["search", "snakes", "--db", tmp_db_path])
+    assert result.exit_code == 1
+    assert "nothing has been saved" in result.output
+
+    tmp_db["comments"].insert({"id": "a", "text": "hi"}, pk="id")
+    tmp_db["comments"].enable_fts(["text"])
+
+    result = CliRunner().invoke(cli, ["search", '"snakes', "--db", tmp_db_path])
+    assert result.exit_code == 1
+    assert "couldn't run search" in result.output
+
+    result = CliRunner().invoke(
+        cli, ["search", "snakes", "--db", tmp_db_path, "--after", "best"]
+    )
+    assert result.exit_code == 2
+
+
+def test_user_stage_in_memory(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    self_post_response,
+    stored_comment,
+    stored_user,
+):
+    tmp_db["users"].insert(stored_user, pk="id")
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=self_post_response)
+
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--stage-in-memory"]
+    )
+    assert not result.exception, result.exception
+
+    assert f"copied staged changes to {tmp_db_path}" in result.output
+    assert list(tmp_db["users"].rows) == [stored_user]
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert {"comments_fts", "posts_fts"} <= set(tmp_db.table_names())
+
+
+def test_user_stage_in_memory_failure(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    stored_user,
+):
+    tmp_db["users"].insert(stored_user, pk="id")
+    mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(
+        resource="submitted", json={"error": 500, "message": "something broke"}
+    )
+
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--stage-in-memory"]
+    )
+    assert result.exception
+
+    # the comments were saved to the staged copy, which was thrown away
+    assert "copied staged changes" not in result.output
+    assert tmp_db.table_names() == ["users"]
+
+
+def test_user_hydrate_parents(
+    tmp_path,
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    mock_info_request: MockInfoFunc,
+    empty_response,
+    modify_comment,
+    modify_post,
+    stored_self_post,
+):
+    # two comments on the same thread, plus one on a thread that's gone
+    mock_paged_request(
+        resource="comments",
+        json=_wrap_response(
+            modify_comment({}),
+            modify_comment({"id": "other"}),
+            modify_comment({"id": "orphan", "link_id": "t3_gone"}),
+        ),
+    )
+    mock_paged_request(resource="submitted", json=empty_response)
+    info = mock_info_request(
+        "t3_1371yrv,t3_gone",
+        json=_wrap_response(modify_post({"id": "1371yrv"})),
+    )
+
+    metrics_path = tmp_path / "metrics.json"
+    result = CliRunner().invoke(
+        cli,
+        [
+            "user",
+            "xavdid",
+            "--db",
+            tmp_db_path,
+            "--hydrate-parents",
+            "--metrics-json",
+            str(metrics_path),
+        ],
+    )
+    assert not result.exception, result.exception
+
+    assert info.call_count == 1
+    stages = json.loads(metrics_path.read_text())["stages"]
+    assert stages["parent_fetch"]["requests"] == 1
+    assert stages["listing_fetch"]["requests"] == 2
+    assert "info_fetch" not in stages
+    assert "Fetching 2 posts that comments are on" in result.output
+    assert "saved 1 posts to parent_posts" in result.output
+    assert list(tmp_db["parent_posts"].rows) == [{**stored_self_post, "id": "1371yrv"}]
+    assert [r["fullname"] for r in tmp_db["missing_items"].rows] == ["t3_gone"]
+    # comments can be joined to their threads
+    assert tmp_db.execute(
+        "select c.id, p.title from comments c join parent_posts p on p.id = c.post"
+    ).fetchall() == [(i, stored_self_post["title"]) for i in ["jj0ti6f", "other"]]
+
+    # already stored, or recently missing, so there's nothing left to fetch
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--hydrate-parents"]
+    )
+    assert "Fetching 0 posts that comments are on" in result.output
+    assert info.call_count == 1
+
+
+def test_user_all_sorts(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock_paged_request: MockPagedFunc,
+    modify_comment,
+    comment_response,
+    empty_response,
+    stored_comment,
+    stored_user,
+):
+    tmp_db["users"].insert(stored_user, pk="id")
+    new = mock_paged_request(resource="comments", json=comment_response)
+    mock_paged_request(resource="submitted", json=empty_response)
+
+    sorted_responses = []
+    for sort, t in EXTRA_SORTS:
+        params = {"sort": sort, "t": t}
+        # only one sort turns up something that `new` didn't
+        items = [modify_comment({})]
+        if (sort, t) == ("top", "year"):
+            items.append(modify_comment({"id": "older"}))
+        sorted_responses.append(
+            mock_paged_request(
+                resource="comments", params=params, json=_wrap_response(*items)
+            )
+        )
+        mock_paged_request(resource="submitted", params=params, json=empty_response)
+
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--all-sorts"]
+    )
+    assert not result.exception, result.exception
+
+    assert new.call_count == 1
+    assert all(r.call_count == 1 for r in sorted_responses)
+    assert "saved/updated 2 comments" in result.output
+    assert sorted(tmp_db["comments"].rows, key=lambda r: r["id"]) == [
+        stored_comment,
+        {**stored_comment, "id": "older"},
+    ]
+
+
+def test_user_saves_what_it_has_when_reddit_is_down(
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock: RequestsMock,
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    stored_comment,
+):
+    mock_paged_request(resource="comments", json=comment_response)
+    posts = mock.get(
+        "https://www.reddit.com/user/xavdid/submitted.json", status=503, body="oops"
+    )
+
+    result = CliRunner().invoke(
+        cli, ["user", "xavdid", "--db", tmp_db_path, "--max-retries", "0"]
+    )
+    assert not result.exception, result.exception
+
+    assert posts.call_count == 1
+    assert "submitted stopped after 0 page(s)" in result.output
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+
+
+def test_user_with_oauth(
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_db_path: str,
+    tmp_db: Database,
+    mock: RequestsMock,
+    comment_response,
+    empty_response,
+    stored_comment,
+):
+    monkeypatch.setenv("REDDIT_CLIENT_ID", "app")
+    monkeypatch.setenv("REDDIT_CLIENT_SECRET", "shh")
+    token = mock.post(
+        "https://www.reddit.com/api/v1/access_token",
+        match=[
+            matchers.urlencoded_params_matcher({"grant_type": "client_credentials"})
+        ],
+        json={"access_token": "abc", "token_type": "bearer", "expires_in": 86400},
+    )
+    authorized = [matchers.header_matcher({"authorization": "bearer abc"})]
+    mock.get(
+        "https://oauth.reddit.com/user/xavdid/comments.json",
+        match=authorized,
+        json=comment_response,
+    )
+    mock.get(
+        "https://oauth.reddit.com/user/xavdid/submitted.json",
+        match=authorized,
+        json=empty_response,
+    )
+
+    result = CliRunner().invoke(cli, ["user", "xavdid", "--db", tmp_db_path])
+    assert not result.exception, result.exception
+
+    assert token.call_count == 1
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+
+
+def test_user_with_bad_oauth_credentials(
+    monkeypatch: pytest.MonkeyPatch, tmp_db_path: str, mock: RequestsMock
+):
+    monkeypatch.setenv("REDDIT_CLIENT_ID", "app")
+    monkeypatch.setenv("REDDIT_CLIENT_SECRET", "wrong")
+    mock.post(
+        "https://www.reddit.com/api/v1/access_token",
+        status=401,
+        json={"message": "Unauthorized", "error": 401},
+    )
+
+    result = CliRunner().invoke(cli, ["user", "xavdid", "--db", tmp_db_path])
+
+    assert result.exit_code == 1
+    assert (
+        "Error: Unable to get an OAuth token from reddit (HTTP 401): Unauthorized"
+        in (result.output)
+    )
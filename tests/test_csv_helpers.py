@@ -4,11 +4,14 @@ import pytest
 from sqlite_utils import Database
 
 from reddit_user_to_sqlite.csv_helpers import (
+    FileFingerprint,
     build_table_name,
+    fingerprint_file,
     get_username_from_archive,
     load_unsaved_ids_from_file,
     validate_and_build_path,
 )
+from tests.conftest import WriteArchiveFileFunc
 
 
 def test_validate_and_build_path(archive_dir, stats_file):
@@ -142,3 +145,44 @@ def test_get_username_from_archive_missing_file(archive_dir):
 )
 def test_build_table_name(table_name, table_prefix, expected):
     assert build_table_name(table_name, table_prefix) == expected
+
+
+def test_fingerprint_file(write_archive_file: WriteArchiveFileFunc):
+    path = write_archive_file("comments.csv", ["id", "a", "c"])
+
+    fingerprint = fingerprint_file(path)
+
+    assert fingerprint["size"] == 6
+    assert fingerprint["mtime_ns"] == path.stat().st_mtime_ns
+    assert (
+        fingerprint["sha256"]
+        == "de0658e6d7487349ff21fae795022b99aa79b53c32727c2748ec3e9090ba39aa"
+    )
+
+
+def test_fingerprint_file_reuses_hash_when_unchanged(
+    write_archive_file: WriteArchiveFileFunc,
+):
+    path = write_archive_file("comments.csv", ["id", "a", "c"])
+    stat = path.stat()
+
+    previous: FileFingerprint = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": "cached",
+    }
+
+    assert fingerprint_file(path, previous)["sha256"] == "cached"
+
+
+def test_fingerprint_file_rehashes_when_changed(
+    write_archive_file: WriteArchiveFileFunc,
+):
+    path = write_archive_file("comments.csv", ["id", "a", "c"])
+    original = fingerprint_file(path)
+
+    write_archive_file("comments.csv", ["id", "a", "b"])
+    updated = fingerprint_file(path, {**original, "mtime_ns": 0})
+
+    assert updated["size"] == original["size"]
+    assert updated["sha256"] != original["sha256"]
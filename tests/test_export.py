@@ -0,0 +1,84 @@
+import io
+
+from sqlite_utils import Database
+
+from reddit_user_to_sqlite.export import (
+    ensure_export_index,
+    format_cursor,
+    iter_rows_after,
+    parse_cursor,
+    write_csv,
+    write_ndjson,
+)
+
+
+def _make_comments(db: Database, num: int):
+    # a few share each timestamp, so ties are broken by id
+    db["comments"].insert_all(  # type: ignore
+        [{"id": f"c{i:02}", "timestamp": i // 3, "text": "hi"} for i in range(num)],
+        pk="id",
+    )
+
+
+def test_parse_cursor():
+    assert parse_cursor("1690000000:jg3mdbc") == (1690000000, "jg3mdbc")
+    # a bare timestamp sorts before every id with that timestamp
+    assert parse_cursor("1690000000") == (1690000000, "")
+    assert format_cursor((1690000000, "jg3mdbc")) == "1690000000:jg3mdbc"
+
+
+def test_iter_rows_after_pages(tmp_db: Database):
+    _make_comments(tmp_db, 10)
+    # inserted out of order
+    tmp_db["comments"].insert({"id": "c-1", "timestamp": -1, "text": "hi"})
+    columns = ["id", "timestamp"]
+
+    rows = list(iter_rows_after(tmp_db, "comments", columns, page_size=4, fetch_size=3))
+
+    assert [r[0] for r in rows] == ["c-1"] + [f"c{i:02}" for i in range(10)]
+
+
+def test_iter_rows_after_cursor(tmp_db: Database):
+    _make_comments(tmp_db, 10)
+    columns = ["id", "timestamp"]
+
+    assert list(iter_rows_after(tmp_db, "comments", columns, after=(2, "c07"))) == [
+        ("c08", 2),
+        ("c09", 3),
+    ]
+    assert list(iter_rows_after(tmp_db, "comments", columns, after=(2, ""))) == [
+        ("c06", 2),
+        ("c07", 2),
+        ("c08", 2),
+        ("c09", 3),
+    ]
+    assert list(iter_rows_after(tmp_db, "comments", columns, after=(3, "c09"))) == []
+
+
+def test_ensure_export_index(tmp_db: Database):
+    _make_comments(tmp_db, 1)
+
+    ensure_export_index(tmp_db, "comments")
+    ensure_export_index(tmp_db, "comments")
+
+    plan = tmp_db.execute(
+        "explain query plan select * from comments where (timestamp, id) > (?, ?) order by timestamp, id",
+        [0, ""],
+    ).fetchall()
+    assert "idx_comments_timestamp_id" in plan[0][-1]
+
+
+def test_writers():
+    columns = ["id", "text"]
+    rows = [("a", 'has "quotes", commas\nand newlines'), ("b", None)]
+
+    out = io.StringIO()
+    write_ndjson(columns, rows, out)
+    assert out.getvalue() == (
+        '{"id": "a", "text": "has \\"quotes\\", commas\\nand newlines"}\n'
+        '{"id": "b", "text": null}\n'
+    )
+
+    out = io.StringIO()
+    write_csv(columns, rows, out)
+    assert out.getvalue() == 'id,text\na,"has ""quotes"", commas\nand newlines"\nb,\n'
@@ -1,6 +1,12 @@
 import pytest
 
-from reddit_user_to_sqlite.helpers import clean_username, find_user_details_from_items
+from reddit_user_to_sqlite.helpers import (
+    SeenIds,
+    Shard,
+    clean_username,
+    find_user_details_from_items,
+    in_shard,
+)
 
 
 @pytest.mark.parametrize(
@@ -37,3 +43,26 @@ def test_find_user_details_from_items():
 
 def test_fail_to_find_user_details_from_items():
     assert find_user_details_from_items([{"asdf": 1}, {"author": "xavdid"}]) is None
+
+
+def test_in_shard_splits_keys_exactly_once():
+    keys = [f"t1_{i}" for i in range(100)]
+    shards = [Shard(i, 3) for i in range(3)]
+
+    owners = [[s for s in shards if in_shard(k, s)] for k in keys]
+
+    assert all(len(o) == 1 for o in owners)
+    # every shard gets some of the work
+    assert {o[0] for o in owners} == set(shards)
+
+
+def test_in_shard_no_shard():
+    assert in_shard("anything", None)
+
+
+def test_seen_ids_claims_each_id_once():
+    seen = SeenIds(["a"])
+
+    assert seen.claim(["a", "b", "c"]) == {"b", "c"}
+    assert seen.claim(["c", "d", "d"]) == {"d"}
+    assert seen.claim([]) == set()
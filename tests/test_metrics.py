@@ -0,0 +1,192 @@
+import json
+import threading
+import tracemalloc
+
+import pytest
+
+from reddit_user_to_sqlite.metrics import ITEM_UPSERT, Metrics, format_bytes
+
+
+def test_stage_accumulates():
+    metrics = Metrics("archive")
+
+    with metrics.stage("scan") as stage:
+        stage["rows"] = 3
+    with metrics.stage("scan") as stage:
+        stage["rows"] = 2
+
+    assert metrics.stages["scan"]["calls"] == 2
+    assert metrics.stages["scan"]["rows"] == 5
+    assert metrics.stages["scan"]["seconds"] >= 0
+
+
+def test_stage_records_failures():
+    metrics = Metrics()
+
+    with pytest.raises(ValueError):
+        with metrics.stage("fetch"):
+            raise ValueError()
+
+    assert metrics.stages["fetch"]["calls"] == 1
+
+
+def test_counters_are_thread_safe():
+    metrics = Metrics()
+
+    def _work():
+        for _ in range(1000):
+            metrics.record_request(10)
+            with metrics.stage("fetch") as stage:
+                stage["rows"] = 1
+
+    threads = [threading.Thread(target=_work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert metrics.requests == 4000
+    assert metrics.bytes_received == 40000
+    assert metrics.stages["fetch"]["rows"] == 4000
+
+
+def test_requests_count_towards_the_stage_on_their_thread():
+    metrics = Metrics()
+    in_listing = threading.Event()
+    upserted = threading.Event()
+
+    def _fetch():
+        with metrics.stage("listing_fetch"):
+            in_listing.set()
+            # the other thread's stage is open at the same time
+            assert upserted.wait(timeout=5)
+            metrics.record_request(100)
+            metrics.record_rate_limit(30)
+
+    thread = threading.Thread(target=_fetch)
+    thread.start()
+    assert in_listing.wait(timeout=5)
+    with metrics.stage("item_upsert"):
+        with metrics.stage("info_fetch"):
+            metrics.record_request(10)
+        # back in the outer stage once the inner one closes
+        metrics.record_request(1)
+        upserted.set()
+    thread.join()
+    # outside of any stage, it's only in the run's totals
+    metrics.record_request(1000)
+
+    stages = metrics.stages
+    assert stages["listing_fetch"]["requests"] == 1
+    assert stages["listing_fetch"]["bytes_received"] == 100
+    assert stages["listing_fetch"]["rate_limit_wait_seconds"] == 30
+    assert stages["info_fetch"]["bytes_received"] == 10
+    assert stages["item_upsert"]["requests"] == 1
+    assert stages["item_upsert"]["bytes_received"] == 1
+    assert stages["item_upsert"]["rate_limit_wait_seconds"] == 0
+    assert metrics.requests == 4
+    assert metrics.bytes_received == 1111
+
+
+def test_report(tmp_path):
+    metrics = Metrics("user")
+    metrics.record_request(100)
+    metrics.record_rate_limit(30)
+    metrics.record_retry(1.5)
+    metrics.record_retry(0.5)
+    metrics.record_circuit_break()
+    with metrics.stage(ITEM_UPSERT) as stage:
+        stage["rows"] = 7
+
+    metrics.write_json(path := tmp_path / "metrics.json")
+    report = json.loads(path.read_text())
+
+    assert report["command"] == "user"
+    assert report["requests"] == 1
+    assert report["bytes_received"] == 100
+    assert report["rate_limits"] == 1
+    assert report["rate_limit_wait_seconds"] == 30
+    assert report["retries"] == 2
+    assert report["retry_wait_seconds"] == 2
+    assert report["circuit_breaks"] == 1
+    assert report["rows_written"] == 7
+    assert report["stages"][ITEM_UPSERT]["rows"] == 7
+    assert report["wall_seconds"] >= 0
+
+
+def test_track_memory():
+    metrics = Metrics(track_memory=True)
+
+    with metrics.stage("scan"):
+        kept = [str(i) for i in range(10_000)]
+    with metrics.stage("scan"):
+        [str(i) for i in range(10_000)]
+    metrics.stop()
+
+    scan = metrics.stages["scan"]
+    assert scan["peak_bytes"] > 100_000
+    # the first list is still around, the second isn't
+    assert 100_000 < scan["retained_bytes"] < scan["peak_bytes"] * 2
+    assert len(kept) == 10_000
+
+    memory = metrics.report()["memory"]
+    assert memory["peak_traced_bytes"] >= scan["peak_bytes"]
+    assert "memory by stage (peak / retained):" in metrics.memory_summary()
+    assert not tracemalloc.is_tracing()
+
+
+def test_track_memory_skips_overlapping_stages():
+    metrics = Metrics(track_memory=True)
+    fetching = threading.Event()
+    upserted = threading.Event()
+
+    def _fetch():
+        with metrics.stage("fetch"):
+            fetching.set()
+            assert upserted.wait(timeout=5)
+
+    thread = threading.Thread(target=_fetch)
+    thread.start()
+    assert fetching.wait(timeout=5)
+    with metrics.stage("upsert"):
+        kept = [str(i) for i in range(10_000)]
+    upserted.set()
+    thread.join()
+    with metrics.stage("fts"):
+        pass
+    metrics.stop()
+
+    for name in ["fetch", "upsert"]:
+        assert "peak_bytes" not in metrics.stages[name]
+        assert metrics.stages[name]["overlapped_calls"] == 1
+    assert "overlapped_calls" not in metrics.stages["fts"]
+    assert metrics.stages["fts"]["peak_bytes"] >= 0
+    # the run's peak still covers everything
+    assert metrics.report()["memory"]["peak_traced_bytes"] > 100_000
+    assert len(kept) == 10_000
+
+    summary = metrics.memory_summary()
+    assert "upsert" in summary and "always overlapped other stages" in summary
+
+
+def test_no_memory_by_default():
+    metrics = Metrics()
+
+    with metrics.stage("scan"):
+        pass
+
+    assert "peak_bytes" not in metrics.stages["scan"]
+    assert "memory" not in metrics.report()
+
+
+@pytest.mark.parametrize(
+    "num_bytes, expected",
+    [
+        (10, "10.0 B"),
+        (2048, "2.0 KB"),
+        (3 * 1024**2, "3.0 MB"),
+        (5 * 1024**3, "5.0 GB"),
+    ],
+)
+def test_format_bytes(num_bytes, expected):
+    assert format_bytes(num_bytes) == expected
@@ -0,0 +1,148 @@
+import time
+
+import pytest
+
+from benchmarks.stand_in import RedditStandIn
+from benchmarks.synthetic import USER_ID
+from reddit_user_to_sqlite.oauth import (
+    OAUTH_BASE_URL,
+    OAuthError,
+    TokenProvider,
+    credentials_from_env,
+)
+from reddit_user_to_sqlite.reddit_api import (
+    AUTHENTICATED_INTERVAL,
+    RedditClient,
+    RequestPacer,
+    get_user_id,
+    load_comments_for_user,
+)
+
+CREDENTIALS = {"client_id": "app", "client_secret": "shh"}
+
+
+@pytest.fixture
+def stand_in():
+    with RedditStandIn(latency=0, client_id="app", client_secret="shh") as stand_in:
+        yield stand_in
+
+
+def _client(stand_in: RedditStandIn, credentials=CREDENTIALS, **kwargs):
+    return RedditClient(
+        auth=TokenProvider(credentials, token_url=stand_in.token_url, **kwargs),
+        base_url=stand_in.base_url,
+    )
+
+
+def test_credentials_from_env():
+    assert credentials_from_env({}) is None
+    assert credentials_from_env({"REDDIT_CLIENT_ID": "app"}) is None
+    assert (
+        credentials_from_env(
+            {
+                "REDDIT_CLIENT_ID": "app",
+                "REDDIT_CLIENT_SECRET": "shh",
+                # no password, so it's not a script app
+                "REDDIT_USERNAME": "xavdid",
+            }
+        )
+        == CREDENTIALS
+    )
+    assert credentials_from_env(
+        {
+            "REDDIT_CLIENT_ID": "app",
+            "REDDIT_CLIENT_SECRET": "shh",
+            "REDDIT_USERNAME": "xavdid",
+            "REDDIT_PASSWORD": "hunter2",
+        }
+    ) == {**CREDENTIALS, "username": "xavdid", "password": "hunter2"}
+
+
+def test_client_uses_client_credentials(stand_in: RedditStandIn):
+    client = _client(stand_in)
+
+    assert get_user_id("xavdid", client=client) == USER_ID
+    assert len(load_comments_for_user("xavdid", client=client)) == 1000
+
+    # one token covers every request
+    assert client.auth and client.auth.tokens_fetched == 1
+    assert stand_in.tokens and stand_in.tokens.grants == [
+        {"grant_type": "client_credentials"}
+    ]
+
+
+def test_client_uses_script_credentials(stand_in: RedditStandIn):
+    client = _client(stand_in, {**CREDENTIALS, "username": "me", "password": "pw"})
+
+    assert get_user_id("xavdid", client=client) == USER_ID
+    assert stand_in.tokens and stand_in.tokens.grants == [
+        {"grant_type": "password", "username": "me", "password": "pw"}
+    ]
+
+
+def test_client_refreshes_expiring_tokens(stand_in: RedditStandIn):
+    # every token is already inside the refresh margin by the time it arrives
+    client = _client(stand_in, refresh_margin=3600)
+
+    get_user_id("xavdid", client=client)
+    get_user_id("xavdid", client=client)
+
+    assert client.auth and client.auth.tokens_fetched == 2
+    assert client.budget.requests_made == 2
+
+
+def test_client_replaces_rejected_tokens(stand_in: RedditStandIn):
+    client = _client(stand_in)
+    get_user_id("xavdid", client=client)
+
+    assert stand_in.tokens
+    stand_in.tokens.revoke_all()
+
+    assert get_user_id("xavdid", client=client) == USER_ID
+    assert client.auth and client.auth.tokens_fetched == 2
+    # the rejected request counts, too
+    assert client.budget.requests_made == 3
+
+
+def test_bad_credentials(stand_in: RedditStandIn):
+    client = _client(stand_in, {**CREDENTIALS, "client_secret": "wrong"})
+
+    with pytest.raises(OAuthError) as e:
+        get_user_id("xavdid", client=client)
+
+    assert "HTTP 401" in str(e.value)
+
+
+def test_client_auth_from_env(monkeypatch: pytest.MonkeyPatch):
+    assert RedditClient().auth is None
+
+    monkeypatch.setenv("REDDIT_CLIENT_ID", "app")
+    monkeypatch.setenv("REDDIT_CLIENT_SECRET", "shh")
+    client = RedditClient()
+
+    assert client.auth and client.auth.credentials == CREDENTIALS
+    assert client.base_url == OAUTH_BASE_URL
+    assert client.pacer and client.pacer.interval == AUTHENTICATED_INTERVAL
+
+
+def test_pacer_follows_rate_limit_headers():
+    pacer = RequestPacer(interval=10)
+
+    pacer.update({"x-ratelimit-remaining": "600.0", "x-ratelimit-reset": "30"})
+    assert pacer.interval == 0.05
+    # nothing left in the window, so wait for all of it
+    pacer.update({"x-ratelimit-remaining": "0.0", "x-ratelimit-reset": "30"})
+    assert pacer.interval == 30
+    # other responses don't change anything
+    pacer.update({})
+    assert pacer.interval == 30
+
+
+def test_pacer_spaces_out_requests():
+    pacer = RequestPacer(interval=0.05)
+
+    start = time.monotonic()
+    for _ in range(3):
+        pacer.wait()
+
+    assert time.monotonic() - start >= 0.1
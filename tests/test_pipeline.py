@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+
+from reddit_user_to_sqlite.pipeline import fetch_and_write
+
+
+def test_fetch_and_write_keeps_producer_order():
+    written = []
+
+    fetch_and_write([iter([1, 2, 3]), iter("ab"), iter([])], written.append)
+
+    assert written == [1, 2, 3, "a", "b"]
+
+
+def test_fetch_and_write_out_of_order():
+    # the first producer can't finish until the second one has been written from
+    second_written = threading.Event()
+
+    def slow():
+        assert second_written.wait(timeout=5)
+        yield 1
+
+    def write(item):
+        written.append(item)
+        if item == "a":
+            second_written.set()
+
+    written = []
+    fetch_and_write([slow(), iter("ab"), iter([])], write, in_order=False)
+
+    assert sorted(map(str, written)) == ["1", "a", "b"]
+    assert written.index("a") < written.index("b")
+
+
+def test_fetch_and_write_runs_producers_off_the_calling_thread():
+    fetched_on = set()
+    written_on = set()
+
+    def producer():
+        for i in range(3):
+            fetched_on.add(threading.get_ident())
+            yield i
+
+    fetch_and_write([producer()], lambda _: written_on.add(threading.get_ident()))
+
+    assert written_on == {threading.get_ident()}
+    assert threading.get_ident() not in fetched_on
+
+
+def test_fetch_and_write_bounds_pending_items():
+    fetched = []
+    written = []
+
+    def producer():
+        for i in range(10):
+            fetched.append(i)
+            yield i
+
+    def write(item):
+        if not written:
+            # give the fetcher every chance to run ahead
+            threading.Event().wait(0.2)
+            # 2 queued, plus one waiting to be put
+            assert len(fetched) <= 4
+        written.append(item)
+
+    fetch_and_write([producer()], write, max_pending=2)
+
+    assert written == list(range(10))
+
+
+def test_fetch_and_write_reraises_producer_errors():
+    written = []
+
+    def producer():
+        yield 1
+        raise ValueError("oh no")
+
+    with pytest.raises(ValueError, match="oh no"):
+        fetch_and_write([producer(), iter([2])], written.append)
+
+    assert written == [1]
+
+
+def test_fetch_and_write_stops_fetchers_when_writer_fails():
+    def write(item):
+        raise RuntimeError("disk full")
+
+    with pytest.raises(RuntimeError, match="disk full"):
+        # would never finish if the fetcher kept waiting on a full queue
+        fetch_and_write([iter(range(1000))], write, max_pending=1)
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from reddit_user_to_sqlite.helpers import batched
+from reddit_user_to_sqlite.profiling import (
+    PACKAGE_DIR,
+    module_label,
+    profile_thread,
+    start_profiling,
+    stop_profiling,
+    summarize_stats,
+)
+
+
+@pytest.mark.parametrize(
+    "filename, expected",
+    [
+        (str(PACKAGE_DIR / "reddit_api.py"), "reddit_api"),
+        ("/venv/lib/python3.11/site-packages/sqlite_utils/db.py", "sqlite_utils"),
+        ("/venv/lib/python3.11/site-packages/six.py", "six"),
+        ("~", "builtins"),
+        ("<frozen importlib._bootstrap>", "builtins"),
+        ("/usr/lib/python3.11/json/decoder.py", "stdlib"),
+    ],
+)
+def test_module_label(filename, expected):
+    assert module_label(filename) == expected
+
+
+def _busy_work():
+    return sum(range(1000))
+
+
+def _function_names(stats) -> set[str]:
+    return {funcname for _, _, funcname in stats.stats}
+
+
+def test_profile_thread_includes_worker_threads():
+    profiler = start_profiling()
+    thread = threading.Thread(target=profile_thread(_busy_work))
+    thread.start()
+    thread.join()
+    stats = stop_profiling(profiler)
+
+    assert "_busy_work" in _function_names(stats)
+
+
+def test_profile_thread_does_nothing_when_not_profiling():
+    profiler = start_profiling()
+    stop_profiling(profiler)
+
+    assert profile_thread(_busy_work)() == 499500
+
+
+def test_summarize_stats():
+    profiler = start_profiling()
+    list(batched(range(10), 3))
+    stats = stop_profiling(profiler)
+
+    summary = summarize_stats(stats)
+
+    assert summary.startswith("time spent per module")
+    assert "hottest functions in helpers (cumulative):" in summary
+    assert "batched (line" in summary
+    assert "hottest functions in profiling" not in summary
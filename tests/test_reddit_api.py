@@ -1,31 +1,55 @@
+import json
+import time
 from unittest.mock import MagicMock, patch
 
 import pytest
+import requests
 
+from reddit_user_to_sqlite.helpers import SeenIds
 from reddit_user_to_sqlite.reddit_api import (
+    BudgetExhaustedException,
+    CircuitBreaker,
     PagedResponse,
+    RedditClient,
     RedditRateLimitException,
+    RedditRequestError,
+    RedditUnavailableException,
+    RequestBudget,
+    RetryPolicy,
     _unwrap_response_and_raise,
-    add_missing_user_fragment,
+    decode_child,
     get_user_id,
+    iter_comments_for_user,
+    iter_info,
+    iter_unseen,
     load_comments_for_user,
     load_info,
     load_posts_for_user,
 )
-from tests.conftest import MockInfoFunc, MockPagedFunc, MockUserFunc
+from tests.conftest import (
+    MockInfoFunc,
+    MockPagedFunc,
+    MockUserFunc,
+    _wrap_response,
+)
 
 
-def test_load_comments(mock_paged_request: MockPagedFunc, comment_response, comment):
+def test_load_comments(
+    mock_paged_request: MockPagedFunc, comment_response, decoded_comment
+):
     response = mock_paged_request(resource="comments", json=comment_response)
 
-    assert load_comments_for_user("xavdid") == [comment]
+    assert load_comments_for_user("xavdid") == [decoded_comment]
 
     assert response.call_count == 1
 
 
 @patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
 def test_load_comments_rate_limited(
-    mock_paged_request: MockPagedFunc, comment_response, comment, rate_limit_headers
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    rate_limit_headers,
+    decoded_comment,
 ):
     good_response = mock_paged_request(
         resource="comments", params={"limit": 1}, json=comment_response
@@ -38,33 +62,39 @@ def test_load_comments_rate_limited(
     )
 
     # despite getting an error, we still got the first comment
-    assert load_comments_for_user("xavdid") == [comment]
+    assert load_comments_for_user("xavdid") == [decoded_comment]
 
     assert good_response.call_count == 1
     assert bad_response.call_count == 1
 
 
-def test_load_posts(mock_paged_request: MockPagedFunc, self_post_response, self_post):
+def test_load_posts(
+    mock_paged_request: MockPagedFunc, self_post_response, decoded_self_post
+):
     response = mock_paged_request(resource="submitted", json=self_post_response)
 
-    assert load_posts_for_user("xavdid") == [self_post]
+    assert load_posts_for_user("xavdid") == [decoded_self_post]
     assert response.call_count == 1
 
 
 @patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
-def test_loads_10_pages(mock_paged_request: MockPagedFunc, comment_response, comment):
+def test_loads_10_pages(
+    mock_paged_request: MockPagedFunc, comment_response, decoded_comment
+):
     response = mock_paged_request(
         resource="comments", params={"limit": 1}, json=comment_response
     )
 
-    assert load_comments_for_user("xavdid") == [comment] * 10
+    assert load_comments_for_user("xavdid") == [decoded_comment] * 10
 
     assert response.call_count == 10
 
 
 @patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
 def test_loads_multiple_pages(
-    mock_paged_request: MockPagedFunc, comment_response: PagedResponse, comment
+    mock_paged_request: MockPagedFunc,
+    comment_response: PagedResponse,
+    decoded_comment,
 ):
     comment_response["data"]["after"] = "abc"
     first_request = mock_paged_request(
@@ -87,7 +117,7 @@ def test_loads_multiple_pages(
     assert second_request.call_count == 1
     assert third_request.call_count == 1
 
-    assert comments == [comment, comment]
+    assert comments == [decoded_comment, decoded_comment]
 
 
 def test_error_response(mock_paged_request: MockPagedFunc):
@@ -103,31 +133,36 @@ def test_error_response(mock_paged_request: MockPagedFunc):
     )
 
 
-def test_load_info(mock_info_request: MockInfoFunc, comment_response, comment):
+def test_load_info(mock_info_request: MockInfoFunc, comment_response, decoded_comment):
     mock_info_request("a,b,c", json=comment_response)
 
-    assert load_info(["a", "b", "c"]) == [comment]
+    assert load_info(["a", "b", "c"]) == [decoded_comment]
 
 
 @patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=2)
-def test_load_info_pages(mock_info_request: MockInfoFunc, comment_response, comment):
+def test_load_info_pages(
+    mock_info_request: MockInfoFunc, comment_response, decoded_comment
+):
     mock_info_request("a,b", json=comment_response, limit=2)
     mock_info_request("c,d", json=comment_response, limit=2)
     mock_info_request("e", json=comment_response, limit=2)
 
-    assert load_info(["a", "b", "c", "d", "e"]) == [comment] * 3
+    assert load_info(["a", "b", "c", "d", "e"]) == [decoded_comment] * 3
 
 
 @patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=2)
 def test_load_info_pages_with_rate_limit(
-    mock_info_request: MockInfoFunc, comment_response, comment, rate_limit_headers
+    mock_info_request: MockInfoFunc,
+    comment_response,
+    rate_limit_headers,
+    decoded_comment,
 ):
     mock_info_request("a,b", json=comment_response, limit=2)
     mock_info_request("c,d", json=comment_response, limit=2)
     mock_info_request("e", json={"error": 429}, limit=2, headers=rate_limit_headers)
 
     # call for e fails, but we still got the first ones
-    assert load_info(["a", "b", "c", "d", "e"]) == [comment] * 2
+    assert load_info(["a", "b", "c", "d", "e"]) == [decoded_comment] * 2
 
 
 def test_load_info_empty(mock_info_request: MockInfoFunc, empty_response):
@@ -179,19 +214,439 @@ def test_get_user_id_unknown_user(mock_user_request: MockUserFunc):
         get_user_id("xavdid")
 
 
-def test_add_missing_user_fragment():
-    items = [{"a": 1}, {"a": 2}, {"a": 3}]
-    assert add_missing_user_fragment(items, "xavdid", "t2_abc123") == [  # type: ignore
-        {"a": 1, "author": "xavdid", "author_fullname": "t2_abc123"},
-        {"a": 2, "author": "xavdid", "author_fullname": "t2_abc123"},
-        {"a": 3, "author": "xavdid", "author_fullname": "t2_abc123"},
+def test_request_budget_max_requests():
+    budget = RequestBudget(max_requests=2)
+
+    budget.spend()
+    budget.spend()
+    with pytest.raises(BudgetExhaustedException):
+        budget.spend()
+
+    assert budget.requests_made == 2
+    assert budget.exhausted == "used all 2 allowed requests"
+
+
+def test_request_budget_max_duration():
+    budget = RequestBudget(max_duration=10)
+
+    budget.spend()
+    budget.started_at -= 11
+    with pytest.raises(BudgetExhaustedException):
+        budget.spend()
+
+    assert budget.requests_made == 1
+    assert budget.exhausted == "ran for the allowed 10 seconds"
+
+
+def test_request_budget_unlimited():
+    budget = RequestBudget()
+    for _ in range(1000):
+        budget.spend()
+
+    assert not budget.exhausted
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=2)
+def test_load_info_stops_when_budget_runs_out(
+    mock_info_request: MockInfoFunc,
+    comment_response,
+    capsys,
+    decoded_comment,
+):
+    mock_info_request("a,b", json=comment_response, limit=2)
+    mock_info_request("c,d", json=comment_response, limit=2)
+
+    client = RedditClient(RequestBudget(max_requests=2))
+    assert load_info(["a", "b", "c", "d", "e"], client=client) == [decoded_comment] * 2
+
+    assert "1 of 5 ids are left for the next run" in capsys.readouterr().err
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
+def test_load_comments_stops_when_budget_runs_out(
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    decoded_comment,
+):
+    response = mock_paged_request(
+        resource="comments", params={"limit": 1}, json=comment_response
+    )
+
+    client = RedditClient(RequestBudget(max_requests=3))
+    assert load_comments_for_user("xavdid", client=client) == [decoded_comment] * 3
+
+    assert response.call_count == 3
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=4)
+def test_load_info_bisects_failing_batches(
+    mock_info_request: MockInfoFunc, modify_comment, capsys
+):
+    error = {"error": 500, "message": "bad id"}
+
+    whole_batch = mock_info_request("a,b,c,d", json=error, limit=4)
+    first_half = mock_info_request(
+        "a,b",
+        json=_wrap_response(*(modify_comment({"id": i}) for i in "ab")),
+        limit=4,
+    )
+    second_half = mock_info_request("c,d", json=error, limit=4)
+    good_id = mock_info_request(
+        "c", json=_wrap_response(modify_comment({"id": "c"})), limit=4
+    )
+    bad_id = mock_info_request("d", json=error, limit=4)
+    next_batch = mock_info_request(
+        "e", json=_wrap_response(modify_comment({"id": "e"})), limit=4
+    )
+
+    assert [c["id"] for c in load_info(["a", "b", "c", "d", "e"])] == [
+        "a",
+        "b",
+        "c",
+        "e",
     ]
 
+    for response in (whole_batch, first_half, second_half, good_id, bad_id, next_batch):
+        assert response.call_count == 1
+
+    assert "Unable to load d; skipping it." in capsys.readouterr().err
+
 
-def test_add_missing_user_fragment_no_overwrite():
-    items = [{"a": 1}, {"author": "david", "author_fullname": "t2_def456"}]
+def test_load_info_isolates_bad_ids_in_both_halves(mock, modify_comment, capsys):
+    bad_ids = {"t1_10", "t1_90"}
+
+    def _respond(request):
+        ids = request.params["id"].split(",")
+        if bad_ids & set(ids):
+            return (200, {}, json.dumps({"error": 500, "message": "bad id"}))
+        return (
+            200,
+            {},
+            json.dumps(_wrap_response(*(modify_comment({"id": i[3:]}) for i in ids))),
+        )
 
-    assert add_missing_user_fragment(items, "xavdid", "t2_abc123") == [  # type: ignore
-        {"a": 1, "author": "xavdid", "author_fullname": "t2_abc123"},
-        {"author": "david", "author_fullname": "t2_def456"},
+    info = mock.add_callback(
+        "GET", "https://www.reddit.com/api/info.json", callback=_respond
+    )
+
+    result = load_info([f"t1_{i}" for i in range(100)])
+
+    assert [c["id"] for c in result] == [
+        str(i) for i in range(100) if i not in (10, 90)
     ]
+    # the batch, then 12 requests bisecting each half down to its bad id
+    assert info.call_count == 25
+    err = capsys.readouterr().err
+    assert "Unable to load t1_10; skipping it." in err
+    assert "Unable to load t1_90; skipping it." in err
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        # e.g. a block page, which fails no matter which ids are asked for
+        {"status": 403, "body": "<html>blocked</html>"},
+        {"status": 403, "json": {"error": 403, "message": "Forbidden"}},
+    ],
+)
+def test_load_info_stops_when_the_request_is_refused(mock, capsys, response):
+    blocked = mock.get("https://www.reddit.com/api/info.json", **response)
+
+    with pytest.raises(RedditRequestError):
+        load_info([f"t1_{i}" for i in range(300)])
+
+    # not bisected, since smaller batches would be refused too
+    assert blocked.call_count == 1
+    assert "Unable to load" not in capsys.readouterr().err
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=2)
+def test_load_info_bisect_keeps_partial_results_when_rate_limited(
+    mock_info_request: MockInfoFunc,
+    comment_response,
+    rate_limit_headers,
+    decoded_comment,
+):
+    mock_info_request("a,b", json={"error": 500, "message": "bad id"}, limit=2)
+    mock_info_request("a", json=comment_response, limit=2)
+    mock_info_request("b", json={"error": 429}, limit=2, headers=rate_limit_headers)
+
+    assert load_info(["a", "b", "c"]) == [decoded_comment]
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=2)
+def test_iter_info_yields_requested_batches(
+    mock_info_request: MockInfoFunc,
+    comment_response,
+    rate_limit_headers,
+    decoded_comment,
+):
+    mock_info_request("a,b", json=comment_response, limit=2)
+    mock_info_request("c,d", json={"error": 429}, limit=2, headers=rate_limit_headers)
+
+    assert list(iter_info(["a", "b", "c", "d", "e"])) == [
+        (("a", "b"), [decoded_comment])
+    ]
+
+
+def test_client_stops_everyone_once_rate_limited(
+    mock_paged_request: MockPagedFunc, rate_limit_headers
+):
+    response = mock_paged_request(
+        resource="comments", json={"error": 429}, headers=rate_limit_headers
+    )
+    client = RedditClient()
+
+    assert load_comments_for_user("xavdid", client=client) == []
+    # the second load doesn't even try
+    assert load_comments_for_user("xavdid", client=client) == []
+
+    assert response.call_count == 1
+    assert (
+        client.stopped
+        == "rate limited by reddit; Used 4/10 requests (resets in 20 seconds)"
+    )
+
+
+def test_client_notices_last_request_in_window(
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    decoded_comment,
+):
+    response = mock_paged_request(
+        resource="comments",
+        json=comment_response,
+        headers={
+            "x-ratelimit-used": "10",
+            "x-ratelimit-remaining": "0.0",
+            "x-ratelimit-reset": "20",
+        },
+    )
+    client = RedditClient()
+
+    assert load_comments_for_user("xavdid", client=client) == [decoded_comment]
+    assert client.stopped
+    assert load_comments_for_user("xavdid", client=client) == []
+
+    assert response.call_count == 1
+
+
+def test_client_resumes_after_rate_limit_resets(
+    mock_paged_request: MockPagedFunc, rate_limit_headers
+):
+    mock_paged_request(
+        resource="comments", json={"error": 429}, headers=rate_limit_headers
+    )
+    client = RedditClient()
+    assert load_comments_for_user("xavdid", client=client) == []
+
+    client._rate_limited_until = 0
+    assert not client.stopped
+
+
+def test_request_budget_check_does_not_spend():
+    budget = RequestBudget(max_requests=1)
+
+    assert budget.check() is None
+    budget.spend()
+    assert budget.check() == "used all 1 allowed requests"
+    assert budget.requests_made == 1
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
+def test_load_comments_stop_paging(
+    mock_paged_request: MockPagedFunc,
+    comment_response,
+    decoded_comment,
+):
+    response = mock_paged_request(
+        resource="comments", params={"limit": 1}, json=comment_response
+    )
+    pages = []
+
+    def _stop_paging(ids):
+        pages.append(ids)
+        return len(pages) == 2
+
+    assert (
+        load_comments_for_user("xavdid", stop_paging=_stop_paging)
+        == [decoded_comment] * 2
+    )
+
+    assert response.call_count == 2
+    assert pages == [["jj0ti6f"], ["jj0ti6f"]]
+
+
+def test_iter_comments_sorted(mock_paged_request: MockPagedFunc, comment_response):
+    response = mock_paged_request(
+        resource="comments",
+        params={"sort": "top", "t": "week"},
+        json=comment_response,
+    )
+
+    assert len(list(iter_comments_for_user("xavdid", sort="top", time_filter="week")))
+    assert response.call_count == 1
+
+
+def test_iter_unseen():
+    seen = SeenIds(["a"])
+    pages = iter([[{"id": "a"}, {"id": "b"}], [{"id": "b"}], [{"id": "c"}]])
+
+    assert list(iter_unseen(pages, seen)) == [[{"id": "b"}]]
+    # it stopped at the page with nothing new, without reading the last one
+    assert next(pages) == [{"id": "c"}]
+    assert seen.claim(["b", "c"]) == {"c"}
+
+
+def test_client_base_url(mock, monkeypatch, user_response):
+    monkeypatch.setenv("REDDIT_BASE_URL", "http://localhost:8000/")
+    response = mock.get(
+        "http://localhost:8000/user/xavdid/about.json", json=user_response
+    )
+
+    assert get_user_id("xavdid") == "np8mb41h"
+    assert response.call_count == 1
+
+    # passed explicitly, it wins
+    assert RedditClient(base_url="http://other").base_url == "http://other"
+
+
+USER_URL = "https://www.reddit.com/user/xavdid/about.json"
+
+
+def _retrying_client(max_retries=3, **kwargs) -> RedditClient:
+    return RedditClient(
+        retry=RetryPolicy(max_retries=max_retries, timeout=5, backoff_base=0),
+        **kwargs,
+    )
+
+
+def test_client_retries_transient_failures(mock, user_response):
+    mock.get(USER_URL, status=503, body="upstream connect error")
+    mock.get(USER_URL, body=requests.ConnectionError("connection reset by peer"))
+    mock.get(USER_URL, body=requests.ReadTimeout("read timed out"))
+    success = mock.get(USER_URL, json=user_response)
+    client = _retrying_client()
+
+    assert get_user_id("xavdid", client=client) == "np8mb41h"
+    assert success.call_count == 1
+    assert client.budget.requests_made == 4
+    assert client.metrics.retries == 3
+    assert mock.calls[0].request.req_kwargs["timeout"] == 5
+
+
+def test_client_gives_up_after_max_retries(mock):
+    response = mock.get(USER_URL, status=502, body="bad gateway")
+    client = _retrying_client(max_retries=2)
+
+    with pytest.raises(RedditUnavailableException) as e:
+        get_user_id("xavdid", client=client)
+
+    assert str(e.value) == (
+        "gave up on /user/xavdid/about.json after 3 tries; last error: HTTP 502"
+    )
+    assert response.call_count == 3
+
+
+def test_client_does_not_retry_api_errors(mock):
+    response = mock.get(USER_URL, status=404, json={"error": 404, "message": "nope"})
+
+    with pytest.raises(ValueError):
+        get_user_id("xavdid", client=_retrying_client())
+
+    assert response.call_count == 1
+
+
+@patch("reddit_user_to_sqlite.reddit_api.PAGE_SIZE", new=1)
+def test_load_comments_stops_when_reddit_is_unavailable(
+    mock, comment_response, decoded_comment, capsys
+):
+    url = "https://www.reddit.com/user/xavdid/comments.json"
+    mock.get(url, json=comment_response)
+    failing = mock.get(url, status=500, body="oops")
+
+    assert load_comments_for_user("xavdid", client=_retrying_client(1)) == [
+        decoded_comment
+    ]
+
+    assert failing.call_count == 2
+    assert "comments stopped after 1 page(s)" in capsys.readouterr().err
+
+
+def test_retry_policy_backoff_is_jittered_and_capped():
+    retry = RetryPolicy(backoff_base=1, backoff_max=5)
+
+    for attempt, cap in [(0, 1), (1, 2), (2, 4), (3, 5), (10, 5)]:
+        delays = [retry.backoff(attempt) for _ in range(50)]
+        assert all(0 <= d <= cap for d in delays)
+        assert len(set(delays)) > 1
+
+
+def test_circuit_breaker_opens_when_failures_spike():
+    breaker = CircuitBreaker(window=4, min_requests=4, failure_threshold=0.5)
+
+    # not enough requests to judge yet
+    assert not any(breaker.record(failed=True) for _ in range(3))
+    assert breaker.paused_for == 0
+
+    assert breaker.record(failed=False)
+    assert 29 < breaker.paused_for <= 30
+
+    # the window starts over once it's open
+    assert not breaker.record(failed=True)
+
+
+def test_circuit_breaker_ignores_occasional_failures():
+    breaker = CircuitBreaker(window=4, min_requests=4, failure_threshold=0.5)
+
+    for failed in [True, False, False, False, True, False, False]:
+        assert not breaker.record(failed)
+
+
+def test_client_waits_for_open_circuit(mock, user_response):
+    mock.get(USER_URL, status=500, body="oops")
+    mock.get(USER_URL, json=user_response)
+    breaker = CircuitBreaker(min_requests=1, cooldown=0.05)
+    client = _retrying_client(breaker=breaker)
+
+    start = time.monotonic()
+    assert get_user_id("xavdid", client=client) == "np8mb41h"
+
+    assert client.metrics.circuit_breaks == 1
+    assert time.monotonic() - start >= 0.05
+
+
+def test_decode_child_keeps_only_stored_fields(comment, self_post):
+    decoded = decode_child({"kind": "t1", "data": comment})
+
+    assert set(decoded) == {
+        "id",
+        "author",
+        "author_fullname",
+        "subreddit",
+        "subreddit_id",
+        "subreddit_type",
+        "total_awards_received",
+        "parent_id",
+        "link_id",
+        "score",
+        "controversiality",
+        "body",
+        "is_submitter",
+        "created",
+        "permalink",
+    }
+    assert len(comment) > 50
+    assert (
+        decode_child({"kind": "t3", "data": self_post})["title"] == self_post["title"]
+    )
+
+
+def test_decode_child_leaves_missing_fields_out(comment):
+    del comment["author_fullname"]
+
+    assert "author_fullname" not in decode_child({"kind": "t1", "data": comment})
+
+
+def test_decode_child_passes_other_kinds_through():
+    assert decode_child({"kind": "t5", "data": {"a": 1}}) == {"a": 1}  # type: ignore
@@ -0,0 +1,95 @@
+import pytest
+from sqlite_utils import Database
+
+from reddit_user_to_sqlite.search import (
+    MATCH_END,
+    MATCH_START,
+    format_search_cursor,
+    parse_search_cursor,
+    search,
+    searchable_tables,
+)
+from reddit_user_to_sqlite.sqlite_helpers import ensure_fts
+
+DAY = 60 * 60 * 24
+
+
+@pytest.fixture
+def search_db(tmp_db: Database) -> Database:
+    tmp_db["subreddits"].insert_all(  # type: ignore
+        [{"id": "a", "name": "Python"}, {"id": "b", "name": "rust"}], pk="id"
+    )
+    tmp_db["comments"].insert_all(  # type: ignore
+        [
+            {
+                "id": f"c{i}",
+                "timestamp": i * DAY,
+                "subreddit": "ab"[i % 2],
+                "permalink": f"/c{i}",
+                # later comments mention it more, so they rank higher
+                "text": "python " * (i + 1) + "and some other words",
+            }
+            for i in range(6)
+        ],
+        pk="id",
+    )
+    tmp_db["posts"].insert(
+        {
+            "id": "p1",
+            "timestamp": 0,
+            "subreddit": "b",
+            "permalink": "/p1",
+            "title": "Rewriting it in python",
+            "text": "",
+        },
+        pk="id",
+    )
+    ensure_fts(tmp_db)
+    return tmp_db
+
+
+def test_searchable_tables(search_db: Database):
+    assert searchable_tables(search_db) == ["comments", "posts"]
+
+
+def test_search(search_db: Database):
+    results = search(search_db, "python")
+
+    assert [r["id"] for r in results[:3]] == ["c5", "c4", "c3"]
+    assert {r["id"] for r in results} == {"c0", "c1", "c2", "c3", "c4", "c5", "p1"}
+    assert results == sorted(results, key=lambda r: r["rank"])
+
+    top = results[0]
+    assert top["table"] == "comments"
+    assert top["subreddit"] == "rust"
+    assert top["title"] is None
+    assert f"{MATCH_START}python{MATCH_END}" in top["snippet"]
+
+    post = next(r for r in results if r["table"] == "posts")
+    assert post["title"] == "Rewriting it in python"
+
+
+def test_search_filters(search_db: Database):
+    assert [r["id"] for r in search(search_db, "python", subreddit="r/RUST")] == [
+        "c5",
+        "c3",
+        "c1",
+        "p1",
+    ]
+    assert [
+        r["id"] for r in search(search_db, "python", since=2 * DAY, until=4 * DAY)
+    ] == ["c3", "c2"]
+    assert [r["id"] for r in search(search_db, "python", tables=["posts"])] == ["p1"]
+    assert search(search_db, "python", tables=["saved_comments"]) == []
+
+
+def test_search_pages(search_db: Database):
+    everything = search(search_db, "python")
+
+    pages = []
+    after = None
+    while page := search(search_db, "python", after=after, limit=3):
+        pages += page
+        after = parse_search_cursor(format_search_cursor(page[-1]))
+
+    assert pages == everything
@@ -1,26 +1,37 @@
-from typing import Callable, Optional
+from typing import Callable
 
 import pytest
 from pytest import FixtureRequest
 from sqlite_utils import Database
 from sqlite_utils.db import ForeignKey, NotFoundError
 
+from reddit_user_to_sqlite.csv_helpers import FileFingerprint
+from reddit_user_to_sqlite.helpers import Shard
 from reddit_user_to_sqlite.reddit_api import (
     Comment,
     Post,
     SubredditFragment,
-    UserFragment,
 )
 from reddit_user_to_sqlite.sqlite_helpers import (
     CommentRow,
     comment_to_comment_row,
-    insert_users,
+    ensure_fts,
+    find_missing_parent_posts,
+    find_saved_ids,
+    find_user_item_ids,
+    get_archive_file_row,
+    insert_user_rows,
     item_to_subreddit_row,
-    item_to_user_row,
+    items_to_rows,
+    load_ids_to_skip,
+    merge_shard,
     post_to_post_row,
-    upsert_comments,
-    upsert_posts,
-    upsert_subreddits,
+    staged_in_memory,
+    update_missing_items,
+    upsert_archive_file,
+    upsert_comment_rows,
+    upsert_post_rows,
+    upsert_subreddit_rows,
 )
 
 
@@ -37,23 +48,25 @@ def make_sr():
     return make_subreddit
 
 
-MakeUserFunc = Callable[[str], UserFragment]
-
-
-@pytest.fixture
-def make_user() -> MakeUserFunc:
-    def _make_user(name: str, id_: Optional[str] = None) -> UserFragment:
-        return {"author_fullname": f"t2_{id_ or name[::-1]}", "author": name}
-
-    return _make_user
+def save_items(
+    db: Database,
+    items: list,
+    item_to_row: Callable = comment_to_comment_row,
+    upsert_rows: Callable = upsert_comment_rows,
+):
+    # the same steps the loaders take to save a batch
+    rows, users, subreddits = items_to_rows(items, item_to_row)
+    insert_user_rows(db, users)
+    upsert_subreddit_rows(db, subreddits)
+    upsert_rows(db, rows)
 
 
 def test_insert_subreddits(tmp_db: Database, make_sr):
-    upsert_subreddits(
+    upsert_subreddit_rows(
         tmp_db,
         [
-            make_sr("Games"),
-            make_sr("JRPG", type_="private"),
+            item_to_subreddit_row(make_sr("Games")),
+            item_to_subreddit_row(make_sr("JRPG", type_="private")),
         ],
     )
 
@@ -68,21 +81,21 @@ def test_insert_subreddits(tmp_db: Database, make_sr):
     "skipped because of a sqlite-utils bug; subreddits to get upserted right now"
 )
 def test_repeat_subs_ignored(tmp_db: Database, make_sr):
-    upsert_subreddits(
+    upsert_subreddit_rows(
         tmp_db,
         [
-            make_sr("Games"),
-            make_sr("JRPG", type_="private"),
+            item_to_subreddit_row(make_sr("Games")),
+            item_to_subreddit_row(make_sr("JRPG", type_="private")),
         ],
     )
 
     # updates are ignored
-    upsert_subreddits(
+    upsert_subreddit_rows(
         tmp_db,
         [
-            make_sr("ames", id_="Games"),
-            make_sr("RPG", id_="JRPG"),
-            make_sr("Apple"),
+            item_to_subreddit_row(make_sr("ames", id_="Games")),
+            item_to_subreddit_row(make_sr("RPG", id_="JRPG")),
+            item_to_subreddit_row(make_sr("Apple")),
         ],
     )
 
@@ -94,8 +107,8 @@ def test_repeat_subs_ignored(tmp_db: Database, make_sr):
     ]
 
 
-def test_insert_user(tmp_db: Database, make_user: MakeUserFunc):
-    insert_users(tmp_db, [make_user("xavdid")])
+def test_insert_user(tmp_db: Database):
+    insert_user_rows(tmp_db, [{"id": "didvax", "username": "xavdid"}])
 
     assert "users" in tmp_db.table_names()
     assert list(tmp_db["users"].rows) == [
@@ -103,24 +116,29 @@ def test_insert_user(tmp_db: Database, make_user: MakeUserFunc):
     ]
 
 
-def test_insert_user_missing(tmp_db: Database, make_user: MakeUserFunc):
-    user = make_user("xavdid")
-    user.pop("author_fullname")
-    insert_users(tmp_db, [user])
+def test_insert_user_keeps_existing(tmp_db: Database):
+    insert_user_rows(tmp_db, [{"id": "didvax", "username": "xavdid"}])
+    insert_user_rows(
+        tmp_db,
+        [
+            {"id": "didvax", "username": "renamed"},
+            {"id": "divad", "username": "david"},
+        ],
+    )
 
-    assert "users" not in tmp_db.table_names()
+    assert list(tmp_db["users"].rows) == [
+        {"id": "didvax", "username": "xavdid"},
+        {"id": "divad", "username": "david"},
+    ]
 
 
 def test_insert_comments(
     tmp_db: Database, comment: Comment, stored_comment: CommentRow
 ):
-    upsert_subreddits(tmp_db, [comment])
-    insert_users(tmp_db, [comment])
-
     comment_without_user = comment.copy()
-    comment.pop("author_fullname")
+    comment_without_user.pop("author_fullname")
 
-    upsert_comments(tmp_db, [comment, comment_without_user])
+    save_items(tmp_db, [comment, comment_without_user])
 
     assert {"subreddits", "users", "comments"}.issubset(tmp_db.table_names())
 
@@ -143,15 +161,13 @@ def test_insert_comments(
 
 
 def test_update_comments(tmp_db: Database, comment: Comment, stored_comment):
-    upsert_subreddits(tmp_db, [comment])
-    insert_users(tmp_db, [comment])
-    upsert_comments(tmp_db, [comment])
+    save_items(tmp_db, [comment])
 
     assert list(tmp_db["comments"].rows) == [stored_comment]
 
     assert comment["score"] != 10
     comment["score"] = 10
-    upsert_comments(tmp_db, [comment])
+    save_items(tmp_db, [comment])
 
     updated_comment = tmp_db["comments"].get(comment["id"])  # type: ignore
     assert updated_comment["score"] == 10
@@ -175,10 +191,7 @@ def test_insert_posts(
     no_user_post = post.copy()
     no_user_post.pop("author_fullname")
 
-    upsert_subreddits(tmp_db, [post])
-    insert_users(tmp_db, [post])
-
-    upsert_posts(tmp_db, [post, no_user_post])
+    save_items(tmp_db, [post, no_user_post], post_to_post_row, upsert_post_rows)
 
     assert {"subreddits", "users", "posts"}.issubset(tmp_db.table_names())
 
@@ -200,20 +213,6 @@ def test_insert_posts(
         pytest.fail(", ".join(failure_reasons))
 
 
-@pytest.mark.parametrize(
-    ["item", "expected"],
-    [
-        (
-            {"author_fullname": "t1_abc123", "author": "xavdid"},
-            {"id": "abc123", "username": "xavdid"},
-        ),
-        ({"author": "xavdid"}, None),
-    ],
-)
-def test_item_to_user_row(item, expected):
-    assert item_to_user_row(item) == expected
-
-
 @pytest.mark.parametrize(
     ["item", "expected"],
     [
@@ -248,3 +247,240 @@ def test_post_to_post_row(self_post, stored_self_post):
 def test_post_to_post_row_missing_user(self_post):
     self_post.pop("author_fullname")
     assert post_to_post_row(self_post) is None
+
+
+def test_items_to_rows(comment, stored_comment, stored_user):
+    other_comment = {**comment, "id": "other"}
+
+    rows, users, subreddits = items_to_rows(
+        [comment, other_comment], comment_to_comment_row
+    )
+
+    assert rows == [stored_comment, {**stored_comment, "id": "other"}]
+    assert users == [stored_user]
+    assert subreddits == [item_to_subreddit_row(comment)]
+
+
+def test_items_to_rows_fallback_user(self_post, stored_self_post, deleted_user):
+    self_post.pop("author_fullname")
+
+    assert items_to_rows([self_post], post_to_post_row)[:2] == ([], [])
+
+    rows, users, _ = items_to_rows(
+        [self_post], post_to_post_row, ("__DeletedUser__", "t2_1234567")
+    )
+    assert rows == [{**stored_self_post, "user": "1234567"}]
+    assert users == [deleted_user]
+
+
+def test_items_to_rows_fallback_user_keeps_authors(
+    comment, stored_comment, stored_user
+):
+    rows, users, _ = items_to_rows(
+        [comment], comment_to_comment_row, ("__DeletedUser__", "t2_1234567")
+    )
+
+    assert rows == [stored_comment]
+    assert users == [stored_user]
+
+
+def test_items_to_rows_keeps_latest_subreddit(comment):
+    private = {**comment, "subreddit_type": "private"}
+
+    _, _, subreddits = items_to_rows([comment, private], comment_to_comment_row)
+
+    assert subreddits == [item_to_subreddit_row(private)]
+
+
+def test_find_saved_ids(tmp_db: Database):
+    tmp_db["comments"].insert_all([{"id": "a"}, {"id": "b"}], pk="id")  # type: ignore
+
+    assert find_saved_ids(tmp_db, "comments", ["a", "c"]) == {"a"}
+
+
+def test_find_saved_ids_missing_table(tmp_db: Database):
+    assert find_saved_ids(tmp_db, "comments", ["a"]) == set()
+
+
+def test_find_missing_parent_posts(tmp_db: Database):
+    assert find_missing_parent_posts(tmp_db) == []
+
+    tmp_db["comments"].insert_all(  # type: ignore
+        [{"id": i, "post": p} for i, p in [("1", "a"), ("2", "a"), ("3", "b")]]
+    )
+    tmp_db["saved_comments"].insert_all(  # type: ignore
+        [{"id": i, "post": p} for i, p in [("4", "c"), ("5", "d"), ("6", None)]]
+    )
+    tmp_db["posts"].insert({"id": "b"})
+    tmp_db["parent_posts"].insert({"id": "c"})
+
+    assert find_missing_parent_posts(tmp_db) == ["a", "d"]
+
+
+def test_find_missing_parent_posts_old_comments(tmp_db: Database):
+    # saved before comments knew their post
+    tmp_db["comments"].insert({"id": "1", "text": "hi"})
+
+    assert find_missing_parent_posts(tmp_db) == []
+
+
+def test_find_user_item_ids(tmp_db: Database):
+    assert find_user_item_ids(tmp_db, "comments", "xavdid") == set()
+
+    tmp_db["users"].insert_all(  # type: ignore
+        [{"id": "1", "username": "xavdid"}, {"id": "2", "username": "other"}]
+    )
+    tmp_db["comments"].insert_all(  # type: ignore
+        [{"id": i, "user": u} for i, u in [("a", "1"), ("b", "1"), ("c", "2")]]
+    )
+
+    assert find_user_item_ids(tmp_db, "comments", "xavdid") == {"a", "b"}
+    assert find_user_item_ids(tmp_db, "posts", "xavdid") == set()
+    # usernames are typed in any case
+    assert find_user_item_ids(tmp_db, "comments", "XavDid") == {"a", "b"}
+
+
+def test_archive_file_round_trip(tmp_db: Database):
+    assert get_archive_file_row(tmp_db, "comments") is None
+
+    tmp_db["comments"].insert({"id": "a"}, pk="id")  # type: ignore
+    fingerprint: FileFingerprint = {"size": 7, "mtime_ns": 123, "sha256": "abc"}
+
+    upsert_archive_file(tmp_db, "comments", fingerprint, ["t1_a", "t1_c"])
+
+    assert get_archive_file_row(tmp_db, "comments") == {
+        "filename": "comments",
+        "size": 7,
+        "mtime_ns": 123,
+        "sha256": "abc",
+        "pending_ids": ["t1_c"],
+        "shard": None,
+    }
+
+    upsert_archive_file(
+        tmp_db, "comments", {**fingerprint, "sha256": "def"}, [], shard=Shard(1, 4)
+    )
+
+    assert get_archive_file_row(tmp_db, "comments") == {
+        "filename": "comments",
+        "size": 7,
+        "mtime_ns": 123,
+        "sha256": "def",
+        "pending_ids": [],
+        "shard": "1/4",
+    }
+
+
+def test_update_missing_items(tmp_db: Database):
+    update_missing_items(tmp_db, ["t1_a", "t1_b", "t1_c"], {"t1_b"}, now=100)
+
+    assert list(tmp_db["missing_items"].rows) == [
+        {"fullname": "t1_a", "last_tried": 100, "attempts": 1},
+        {"fullname": "t1_c", "last_tried": 100, "attempts": 1},
+    ]
+
+    # `a` is still missing, `c` turned up
+    update_missing_items(tmp_db, ["t1_a", "t1_c"], {"t1_c"}, now=200)
+
+    assert list(tmp_db["missing_items"].rows) == [
+        {"fullname": "t1_a", "last_tried": 200, "attempts": 2},
+    ]
+
+
+def test_update_missing_items_nothing_missing(tmp_db: Database):
+    update_missing_items(tmp_db, ["t1_a"], {"t1_a"})
+
+    assert "missing_items" not in tmp_db.table_names()
+
+
+def test_load_ids_to_skip_backs_off_exponentially(tmp_db: Database):
+    assert load_ids_to_skip(tmp_db, 10) == set()
+
+    tmp_db["missing_items"].insert_all(  # type: ignore
+        [
+            {"fullname": "t1_a", "last_tried": 100, "attempts": 1},
+            {"fullname": "t1_b", "last_tried": 100, "attempts": 3},
+        ],
+        pk="fullname",
+    )
+
+    # a waits 10 seconds, b waits 40
+    assert load_ids_to_skip(tmp_db, 10, now=105) == {"t1_a", "t1_b"}
+    assert load_ids_to_skip(tmp_db, 10, now=115) == {"t1_b"}
+    assert load_ids_to_skip(tmp_db, 10, now=145) == set()
+
+
+def test_merge_shard(
+    tmp_db: Database, tmp_path, comment: Comment, stored_comment: CommentRow
+):
+    shard = Database(tmp_path / "shard.db")
+    save_items(shard, [comment])
+    shard["archive_files"].insert({"filename": "comments"}, pk="filename")
+    shard.close()
+
+    counts = merge_shard(tmp_db, tmp_path / "shard.db")
+
+    assert counts == {"subreddits": 1, "users": 1, "comments": 1}
+    assert list(tmp_db["comments"].rows) == [stored_comment]
+    assert tmp_db["comments"].foreign_keys == [  # type: ignore
+        ForeignKey("comments", "subreddit", "subreddits", "id"),
+        ForeignKey("comments", "user", "users", "id"),
+    ]
+    # only describes the shard's own progress
+    assert "archive_files" not in tmp_db.table_names()
+
+
+def test_merge_shard_updates_existing_rows(
+    tmp_db: Database, tmp_path, comment: Comment
+):
+    save_items(tmp_db, [comment])
+    ensure_fts(tmp_db)
+
+    shard = Database(tmp_path / "shard.db")
+    save_items(shard, [{**comment, "score": 10}])
+    shard["comments"].add_column("extra", str)
+    shard.close()
+
+    merge_shard(tmp_db, tmp_path / "shard.db")
+
+    assert tmp_db["comments"].count == 1
+    assert tmp_db["comments"].get(comment["id"])["score"] == 10  # type: ignore
+    assert "extra" in tmp_db["comments"].columns_dict  # type: ignore
+    # rebuilt with ensure_fts once everything's merged
+    assert "comments_fts" not in tmp_db.table_names()
+
+
+def test_staged_in_memory(tmp_db_path: str, tmp_db: Database):
+    tmp_db["users"].insert({"id": "a", "username": "xavdid"}, pk="id")
+
+    with staged_in_memory(tmp_db_path) as staged:
+        assert list(staged["users"].rows) == [{"id": "a", "username": "xavdid"}]
+        staged["users"].insert({"id": "b", "username": "spez"})
+        # nothing is written until the block finishes
+        assert tmp_db["users"].count == 1
+
+    assert list(tmp_db["users"].rows) == [
+        {"id": "a", "username": "xavdid"},
+        {"id": "b", "username": "spez"},
+    ]
+    assert tmp_db["users"].pks == ["id"]
+
+
+def test_staged_in_memory_new_file(tmp_path):
+    db_path = str(tmp_path / "new.db")
+
+    with staged_in_memory(db_path) as staged:
+        staged["users"].insert({"id": "a", "username": "xavdid"}, pk="id")
+
+    assert Database(db_path)["users"].count == 1
+
+
+def test_staged_in_memory_failure(tmp_db_path: str, tmp_db: Database):
+    tmp_db["users"].insert({"id": "a", "username": "xavdid"}, pk="id")
+
+    with pytest.raises(ValueError):
+        with staged_in_memory(tmp_db_path) as staged:
+            staged["users"].insert({"id": "b", "username": "spez"})
+            raise ValueError("oh no")
+
+    assert list(tmp_db["users"].rows) == [{"id": "a", "username": "xavdid"}]